@@ -0,0 +1,231 @@
+"""
+Online anomaly scoring for new check-ins and sleep sessions.
+
+The detector that outlier_detection.py (Isolation Forest on the check-in
+weekday and hour) and fitbit-sleep/outliers-detection.py (One-Class SVM on
+the sleep start weekday and time) fit for their plots is kept on disk and
+used to score new records as they arrive, in micro-batches. A background
+thread refits it on a sliding window of the latest records and swaps it in
+atomically, so scoring never waits for a fit.
+
+New records are read by following a file: the check-ins NDJSON written by
+swarmapp/get_data.py, or the sleep csv written by fitbit-sleep/get_data.py.
+Anomalies are printed as JSON lines, and the per-record latency and the
+throughput are reported every batch.
+
+Usage:
+    python anomaly_service.py checkins ../swarmapp/data/checkins.ndjson
+    python anomaly_service.py sleep ../fitbit-sleep/data/df.csv
+"""
+import argparse
+import collections
+import csv
+import datetime
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import dump, load
+from sklearn.ensemble import IsolationForest
+
+# the sleep features and detector live with the fitbit-sleep scripts
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, '..', 'fitbit-sleep'))
+import one_class  # noqa: E402
+
+BATCH_SIZE = 100
+# seconds between polls of the followed file
+POLL_INTERVAL = 1.0
+WINDOW_SIZE = 5000
+# refit after this many new records...
+REFIT_EVERY = 500
+# ...or after this many seconds, whatever comes first
+REFIT_INTERVAL = 3600.0
+MIN_FIT_SIZE = 20
+
+
+def checkin_features(checkin):
+    """Weekday (Monday is 0) and hour of the check-in, in local time, like
+    data/start_times.csv.
+    """
+    local = datetime.datetime.utcfromtimestamp(
+        checkin['createdAt'] + checkin.get('timeZoneOffset', 0) * 60)
+    return [local.weekday(), local.hour]
+
+
+def checkins_batch(checkins):
+    return np.array([checkin_features(checkin) for checkin in checkins],
+                    dtype=float)
+
+
+def sleep_batch(sessions):
+    """The features fitbit-sleep/one_class.py fits on, for the sleep csv
+    rows of sessions.
+    """
+    return one_class.sleep_features(pd.DataFrame(sessions)).to_numpy(
+        dtype=float)
+
+
+# the features of a batch of records, a new detector, and where the script
+# that fits the detector for the plots keeps it
+SOURCES = {
+    'checkins': (checkins_batch, lambda: IsolationForest(random_state=0),
+                 os.path.join(HERE, 'data', 'checkins_detector.joblib')),
+    'sleep': (sleep_batch, one_class.make_detector,
+              os.path.join(HERE, '..', 'fitbit-sleep', 'data',
+                           'sleep_detector.joblib')),
+}
+
+
+def _follow_lines(f, poll_interval, follow):
+    """Yields lists of the complete lines appended to f."""
+    while True:
+        lines = []
+        while True:
+            position = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if not line.endswith('\n'):
+                # the writer isn't done with this line yet
+                f.seek(position)
+                break
+            lines.append(line)
+        if lines:
+            yield lines
+        elif not follow:
+            return
+        else:
+            time.sleep(poll_interval)
+
+
+def follow_ndjson(path, poll_interval=POLL_INTERVAL, follow=True):
+    """Yields lists of the records appended to an NDJSON file."""
+    with open(path) as f:
+        for lines in _follow_lines(f, poll_interval, follow):
+            yield [json.loads(line) for line in lines if line.strip()]
+
+
+def follow_csv(path, poll_interval=POLL_INTERVAL, follow=True):
+    """Yields lists of the rows (as dicts) appended to a csv file."""
+    with open(path, newline='') as f:
+        header = next(csv.reader([f.readline()]))
+        for lines in _follow_lines(f, poll_interval, follow):
+            yield list(csv.DictReader(io.StringIO(''.join(lines)),
+                                      fieldnames=header))
+
+
+class AnomalyScorer:
+    """Scores feature batches with the current model and refits a new model
+    in the background on the last window_size records.
+    """
+
+    def __init__(self, make_model, model_path, window_size=WINDOW_SIZE,
+                 refit_every=REFIT_EVERY, refit_interval=REFIT_INTERVAL):
+        self.make_model = make_model
+        self.model_path = model_path
+        self.window = collections.deque(maxlen=window_size)
+        self.refit_every = refit_every
+        self.refit_interval = refit_interval
+        self.model = load(model_path) if os.path.exists(model_path) else None
+        self.seen_since_fit = 0
+        self.last_fit = time.monotonic()
+        self.lock = threading.Lock()
+        self.fitting = None
+
+    def score(self, X):
+        """Returns the decision function of X, or None if no model was fit
+        yet. Negative values are anomalies.
+        """
+        model = self.model
+        if model is None:
+            return None
+        if hasattr(model, 'feature_names_in_'):
+            # the plotting scripts fit their models on DataFrames
+            X = pd.DataFrame(X, columns=model.feature_names_in_)
+        return model.decision_function(X)
+
+    def observe(self, X):
+        with self.lock:
+            self.window.extend(map(tuple, X))
+            self.seen_since_fit += len(X)
+            due = self.seen_since_fit >= self.refit_every or \
+                time.monotonic() - self.last_fit >= self.refit_interval or \
+                self.model is None
+            busy = self.fitting is not None and self.fitting.is_alive()
+            if not due or busy or len(self.window) < MIN_FIT_SIZE:
+                return
+            snapshot = np.array(self.window, dtype=float)
+            self.seen_since_fit = 0
+            self.last_fit = time.monotonic()
+        self.fitting = threading.Thread(target=self._refit, args=(snapshot,),
+                                        daemon=True)
+        self.fitting.start()
+
+    def _refit(self, X):
+        started = time.perf_counter()
+        model = self.make_model().fit(X)
+        dump(model, self.model_path + '.tmp')
+        os.replace(self.model_path + '.tmp', self.model_path)
+        # swapping the reference is atomic, so score() sees either model
+        self.model = model
+        print('Refit on {} records in {:.2f}s'.format(
+            len(X), time.perf_counter() - started), flush=True)
+
+    def wait(self):
+        if self.fitting is not None:
+            self.fitting.join()
+
+
+def run(source, path, model_path, batch_size=BATCH_SIZE, follow=True,
+        out=None):
+    to_features, make_model, _ = SOURCES[source]
+    scorer = AnomalyScorer(make_model, model_path)
+    follower = follow_ndjson if path.endswith('.ndjson') else follow_csv
+    total, total_time = 0, 0.0
+
+    for records in follower(path, follow=follow):
+        for i in range(0, len(records), batch_size):
+            batch = records[i:i + batch_size]
+            started = time.perf_counter()
+            X = to_features(batch)
+            scores = scorer.score(X)
+            elapsed = time.perf_counter() - started
+            scorer.observe(X)
+
+            total += len(batch)
+            total_time += elapsed
+            if scores is not None:
+                for record, features, score in zip(batch, X, scores):
+                    if score < 0:
+                        print(json.dumps({'id': record.get('id', record.get('date')),
+                                          'features': features.tolist(),
+                                          'score': float(score)}),
+                              file=out, flush=True)
+            print('Batch of {}: {:.1f}us per record, {:.0f} records/s overall'
+                  .format(len(batch), elapsed / len(batch) * 1e6,
+                          total / total_time if total_time else 0),
+                  flush=True)
+    scorer.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', choices=sorted(SOURCES))
+    parser.add_argument('path', help='ndjson or csv file to follow')
+    parser.add_argument('--model', default=None,
+                        help='Where the fitted model is kept; by default the '
+                             'one the plotting script of the source writes')
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--once', action='store_true',
+                        help='Score what is in the file and exit')
+    args = parser.parse_args()
+
+    model_path = args.model or SOURCES[args.source][2]
+    run(args.source, args.path, model_path, args.batch_size,
+        follow=not args.once)
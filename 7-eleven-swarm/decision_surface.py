@@ -0,0 +1,137 @@
+"""
+Coarse-to-fine evaluation of a model's decision function over a 2D grid,
+used to draw the decision boundaries of the anomaly detection models.
+
+Instead of scoring every point of the dense grid, the function is scored on
+a coarse lattice first. Only the cells where the score changes sign (the
+levels=[0] boundary) and their neighbours are scored at full resolution; the
+rest of the grid is filled by bilinear interpolation, which is plenty for the
+shaded areas. The exact points are scored across processes, and the surface
+is cached on disk by a hash of the fitted model and its training data.
+
+With more than two features, the surface is a 2D slice through base_point
+(by default the median of the training data) along the two dims.
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+
+CACHE_DIR = '.surface_cache'
+# below this many points the process pool costs more than it saves
+MIN_POINTS_PER_PROCESS = 20000
+
+
+def _cache_key(clf, X_train, *args):
+    h = hashlib.sha1()
+    # the fitted state, not only the params: two forests with the same
+    # params and data differ unless their random_state is fixed
+    h.update(joblib.hash(clf).encode())
+    h.update(np.ascontiguousarray(np.asarray(X_train, dtype=float)).tobytes())
+    h.update(repr(args).encode())
+    return h.hexdigest()
+
+
+def _score(clf, points):
+    return clf.decision_function(points)
+
+
+def _score_points(clf, points, processes):
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(points) // MIN_POINTS_PER_PROCESS)
+    if processes <= 1:
+        return _score(clf, points)
+    chunks = np.array_split(points, processes)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return np.concatenate(list(executor.map(
+            _score, [clf] * len(chunks), chunks)))
+
+
+def _cells(coarse, fine):
+    """For every fine index, the indices of the coarse cells it touches
+    (a point on a coarse line touches the cells on both sides).
+    """
+    hi = np.clip(np.searchsorted(coarse, fine, side='right') - 1,
+                 0, len(coarse) - 2)
+    lo = hi - ((coarse[hi] == fine) & (hi > 0))
+    return lo, hi
+
+
+def _interpolate(Zc, coarse, fine):
+    """Bilinear interpolation of the coarse lattice values on the fine grid."""
+    k = np.clip(np.searchsorted(coarse, fine, side='right') - 1,
+                0, len(coarse) - 2)
+    t = (fine - coarse[k]) / (coarse[k + 1] - coarse[k])
+    ky, kx = k[:, None], k[None, :]
+    ty, tx = t[:, None], t[None, :]
+    return ((1 - ty) * (1 - tx) * Zc[ky, kx] + (1 - ty) * tx * Zc[ky, kx + 1] +
+            ty * (1 - tx) * Zc[ky + 1, kx] + ty * tx * Zc[ky + 1, kx + 1])
+
+
+def decision_surface(clf, X_train, x_range, y_range, resolution=500, step=8,
+                     dims=(0, 1), base_point=None, processes=None,
+                     cache_dir=CACHE_DIR):
+    """Returns xx, yy and Z like np.meshgrid(np.linspace(*x_range, resolution),
+    np.linspace(*y_range, resolution)) followed by clf.decision_function.
+    Z is exact around the 0 level and interpolated elsewhere.
+    """
+    X = np.asarray(X_train, dtype=float)
+    if base_point is None:
+        base_point = np.median(X, axis=0)
+    base_point = np.asarray(base_point, dtype=float)
+
+    x = np.linspace(x_range[0], x_range[1], resolution)
+    y = np.linspace(y_range[0], y_range[1], resolution)
+    xx, yy = np.meshgrid(x, y)
+
+    cache_path = None
+    if cache_dir is not None:
+        key = _cache_key(clf, X, tuple(x_range), tuple(y_range), resolution,
+                         step, tuple(dims), tuple(base_point))
+        cache_path = os.path.join(cache_dir, '{}.npy'.format(key))
+        if os.path.exists(cache_path):
+            return xx, yy, np.load(cache_path)
+
+    def to_points(rows, cols):
+        points = np.tile(base_point, (len(rows), 1))
+        points[:, dims[0]] = x[cols]
+        points[:, dims[1]] = y[rows]
+        return points
+
+    fine = np.arange(resolution)
+    coarse = np.unique(np.r_[np.arange(0, resolution, step), resolution - 1])
+
+    # 1. score the coarse lattice
+    rows, cols = np.meshgrid(coarse, coarse, indexing='ij')
+    Zc = _score_points(clf, to_points(rows.ravel(), cols.ravel()),
+                       processes).reshape(len(coarse), len(coarse))
+
+    # 2. find the cells crossed by the boundary, plus their neighbours
+    corners = np.stack([Zc[:-1, :-1], Zc[:-1, 1:], Zc[1:, :-1], Zc[1:, 1:]])
+    boundary = (corners.min(axis=0) <= 0) & (corners.max(axis=0) >= 0)
+    padded = np.pad(boundary, 1)
+    boundary = np.zeros_like(boundary)
+    for dy in range(3):
+        for dx in range(3):
+            boundary |= padded[dy:dy + boundary.shape[0],
+                               dx:dx + boundary.shape[1]]
+
+    # 3. interpolate everything, then score the fine points of those cells
+    Z = _interpolate(Zc, coarse, fine)
+    lo, hi = _cells(coarse, fine)
+    refine = (boundary[lo][:, lo] | boundary[lo][:, hi] |
+              boundary[hi][:, lo] | boundary[hi][:, hi])
+    on_lattice = np.zeros((resolution, resolution), dtype=bool)
+    on_lattice[np.ix_(coarse, coarse)] = True
+    Z[np.ix_(coarse, coarse)] = Zc
+    rows, cols = np.nonzero(refine & ~on_lattice)
+    if len(rows):
+        Z[rows, cols] = _score_points(clf, to_points(rows, cols), processes)
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache_path, Z)
+    return xx, yy, Z
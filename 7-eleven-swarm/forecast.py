@@ -0,0 +1,201 @@
+"""
+Forecasts many time series at once, one Prophet model per series.
+
+The input is a long-format frame with a series key, ds and y, for instance
+the activities of fitbit/data (one csv file per activity, used as the series
+key) or the rows of a csv file with a column that splits them. The series
+are fitted across a pool of processes, each one with an optional cap on its
+address space, and the forecast of every series (yhat, its bounds and the
+trend and seasonality components) is written to its own Parquet file:
+
+    <out_dir>/series=<key>/forecast.parquet
+
+A series that fails, runs out of memory, or even kills its worker is
+reported in <out_dir>/_summary.csv without stopping the rest.
+
+Usage:
+    python forecast.py ts_df.csv --out forecasts
+    python forecast.py ../fitbit/data/steps.csv ../fitbit/data/calories.csv \\
+        --ds dateTime --y value --out forecasts
+    python forecast.py checkins.csv --key country --out forecasts
+"""
+import argparse
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+from fbprophet import Prophet
+
+import prophet_cache
+
+OUT_DIR = 'forecasts'
+PERIODS = 30
+
+
+def load(paths, key=None, ds='ds', y='y'):
+    """Reads csv files into a long-format frame with series, ds and y. The
+    file name is the series key when key is None.
+    """
+    frames = []
+    for path in paths:
+        df = pd.read_csv(path)
+        series = df[key].astype(str) if key is not None else \
+            os.path.splitext(os.path.basename(path))[0]
+        frames.append(pd.DataFrame({'series': series, 'ds': df[ds],
+                                    'y': pd.to_numeric(df[y], errors='coerce')}))
+    return pd.concat(frames, ignore_index=True).dropna(subset=['y'])
+
+
+def series_path(out_dir, key):
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', str(key))
+    return os.path.join(out_dir, 'series={}'.format(safe), 'forecast.parquet')
+
+
+def _limit_memory(max_memory):
+    """Caps the address space of the worker at max_memory MB, so a series
+    that needs too much memory fails with a MemoryError instead of taking
+    the machine down. Only on Unix.
+    """
+    if max_memory:
+        import resource
+        limit = max_memory * 2 ** 20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def forecast_series(key, df, out_dir, periods, freq, params, cache):
+    started = time.perf_counter()
+    result = {'series': key, 'rows': len(df), 'error': None}
+    try:
+        path = series_path(out_dir, key)
+        if cache:
+            # a cache per series, so the warm starts don't mix them up
+            m = prophet_cache.fit(df, cache_dir=os.path.join(
+                os.path.dirname(path), '.prophet_cache'), **params)
+        else:
+            m = Prophet(**params).fit(df)
+        future = m.make_future_dataframe(periods=periods, freq=freq)
+        forecast = m.predict(future)
+        forecast.insert(0, 'series', key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        forecast.to_parquet(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+    except Exception as e:
+        result['error'] = repr(e)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def _report(result):
+    print('{series}: {rows} rows in {seconds:.1f}s{failed}'.format(
+        failed=' FAILED {}'.format(result['error'])
+        if result['error'] else '', **result), flush=True)
+
+
+def _run_pool(jobs, workers, max_memory, args):
+    """Runs the jobs, no more than workers at a time, until they are done or
+    a worker dies. Returns their results, the keys of the jobs that were
+    running when the pool broke, and the jobs that hadn't started yet.
+    """
+    jobs = deque(jobs)
+    results, crashed = [], []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_limit_memory,
+                             initargs=(max_memory,)) as executor:
+        running = {}
+        while jobs or running:
+            # only as many jobs as workers are handed to the pool, so the
+            # ones it loses when it breaks are the ones that were running
+            while jobs and len(running) < workers:
+                key, df = jobs.popleft()
+                running[executor.submit(forecast_series, key, df, *args)] = key
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in finished:
+                key = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    crashed.append(key)
+                    broken = True
+                    continue
+                results.append(result)
+                _report(result)
+            if broken:
+                for future, key in running.items():
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        crashed.append(key)
+                        continue
+                    results.append(result)
+                    _report(result)
+                break
+    return results, crashed, list(jobs)
+
+
+def run(df, out_dir=OUT_DIR, periods=PERIODS, freq='D', params=None,
+        workers=None, max_memory=None, cache=True):
+    """Forecasts every series of df and returns a DataFrame with one row
+    per series: its rows, seconds and error (None if it worked).
+    """
+    workers = workers or os.cpu_count() or 1
+    args = (out_dir, periods, freq, params or {}, cache)
+    groups = {key: group[['ds', 'y']].reset_index(drop=True)
+              for key, group in df.groupby('series', sort=True)}
+    started = time.perf_counter()
+
+    results, crashed, pending = [], [], list(groups.items())
+    while pending:
+        # a dead worker breaks the whole pool: the series that hadn't
+        # started go on in a new pool of the same size
+        done, died, pending = _run_pool(pending, workers, max_memory, args)
+        results.extend(done)
+        crashed.extend(died)
+    # and the ones that were running with it are tried again one at a time,
+    # to find the one that kills it
+    for key in crashed:
+        retried, died, _ = _run_pool([(key, groups[key])], 1, max_memory,
+                                     args)
+        results.extend(retried)
+        if died:
+            print('{}: FAILED worker crashed'.format(key), flush=True)
+            results.append({'series': key, 'rows': len(groups[key]),
+                            'error': 'worker crashed', 'seconds': None})
+
+    elapsed = time.perf_counter() - started
+    summary = pd.DataFrame(results, columns=['series', 'rows', 'seconds',
+                                             'error'])
+    failed = summary['error'].notna().sum()
+    print('{} series in {:.1f}s with {} workers: {:.1f} series/minute, '
+          '{} failed'.format(len(summary), elapsed, workers,
+                             len(summary) / elapsed * 60, failed))
+    os.makedirs(out_dir, exist_ok=True)
+    summary.sort_values('series').to_csv(os.path.join(out_dir, '_summary.csv'),
+                                         index=False)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='csv files in long format')
+    parser.add_argument('--key', help='column with the series key; the file '
+                                      'name is used if not given')
+    parser.add_argument('--ds', default='ds')
+    parser.add_argument('--y', default='y')
+    parser.add_argument('--out', default=OUT_DIR)
+    parser.add_argument('--periods', type=int, default=PERIODS)
+    parser.add_argument('--freq', default='D')
+    parser.add_argument('--changepoint_prior_scale', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max_memory', type=int, default=None,
+                        help='MB of address space per worker')
+    parser.add_argument('--no_cache', action='store_true')
+    args = parser.parse_args()
+
+    df = load(args.paths, args.key, args.ds, args.y)
+    run(df, args.out, args.periods, args.freq,
+        {'changepoint_prior_scale': args.changepoint_prior_scale},
+        args.workers, args.max_memory, cache=not args.no_cache)
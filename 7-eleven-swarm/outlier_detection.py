@@ -8,31 +8,55 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
+from joblib import dump, load
 from sklearn.ensemble import IsolationForest
 
+from decision_surface import decision_surface
+
 # setting the Seaborn aesthetics.
 sns.set(font_scale=1.5)
 
-df = pd.read_csv('data/start_times.csv', encoding='utf-8')
-X_train = df[['weekday', 'hour']]
-
-clf = IsolationForest()
-clf.fit(X_train)
-
-# plot of the decision frontier
-xx, yy = np.meshgrid(np.linspace(-1, 7, 500), np.linspace(-2, 25, 500))
-Z = clf.decision_function(np.c_[xx.ravel(), yy.ravel()])
-Z = Z.reshape(xx.shape)
-plt.title("\"Visiting hours\" Decision Boundary")
-# comment out the next line to see the "ripples" of the boundary
-plt.contourf(xx, yy, Z, levels=np.linspace(
-    Z.min(), 0, 8), cmap=plt.cm.PuBu, alpha=0.5)
-a = plt.contour(xx, yy, Z, levels=[0], linewidths=2, colors='darkred')
-plt.contourf(xx, yy, Z, levels=[0, Z.max()], colors='palevioletred')
-b1 = plt.scatter(X_train.iloc[:, 0],
-                 X_train.iloc[:, 1], s=(df['n'] * 50).tolist(),
-                 c='white', edgecolors='k')
-plt.xlabel('Day of the week (as number)')
-plt.ylabel('Time of the day')
-plt.grid(True)
-plt.show()
+
+def plot_boundary(clf, df):
+    """The decision frontier of clf over the check-ins of df."""
+    X_train = df[['weekday', 'hour']]
+    # the surface is only scored exactly around the boundary and cached
+    # between runs
+    xx, yy, Z = decision_surface(clf, X_train, (-1, 7), (-2, 25),
+                                 resolution=500)
+    fig = plt.figure()
+    plt.title("\"Visiting hours\" Decision Boundary")
+    # comment out the next line to see the "ripples" of the boundary
+    plt.contourf(xx, yy, Z, levels=np.linspace(
+        Z.min(), 0, 8), cmap=plt.cm.PuBu, alpha=0.5)
+    a = plt.contour(xx, yy, Z, levels=[0], linewidths=2, colors='darkred')
+    plt.contourf(xx, yy, Z, levels=[0, Z.max()], colors='palevioletred')
+    b1 = plt.scatter(X_train.iloc[:, 0],
+                     X_train.iloc[:, 1], s=(df['n'] * 50).tolist(),
+                     c='white', edgecolors='k')
+    plt.xlabel('Day of the week (as number)')
+    plt.ylabel('Time of the day')
+    plt.grid(True)
+    return fig
+
+
+def boundary_figure(inputs):
+    """Render job: the boundary of the model inputs[1] over the check-ins
+    of inputs[0].
+    """
+    return plot_boundary(load(inputs[1]),
+                         pd.read_csv(inputs[0], encoding='utf-8'))
+
+
+if __name__ == '__main__':
+    df = pd.read_csv('data/start_times.csv', encoding='utf-8')
+    X_train = df[['weekday', 'hour']]
+
+    # fixed, so refitting on the same check-ins gives the same model
+    clf = IsolationForest(random_state=0)
+    clf.fit(X_train)
+    # anomaly_service.py starts from this model to score new check-ins
+    dump(clf, 'data/checkins_detector.joblib')
+
+    plot_boundary(clf, df)
+    plt.show()
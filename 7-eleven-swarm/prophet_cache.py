@@ -0,0 +1,121 @@
+"""
+On-disk cache of fitted Prophet models for the time series scripts.
+
+A model is stored under a hash of its hyperparameters and a hash of its
+input rows, so running a script again on the same data loads the fitted
+model (and its forecast) instead of running the Stan fit:
+
+    .prophet_cache/<params hash>/<data hash>.json     the model
+    .prophet_cache/<params hash>/<data hash>.pkl      its forecast
+    .prophet_cache/<params hash>/latest.json          the last fit
+
+When the new data only has rows appended to the data of the last fit, the
+new fit is warm-started from the parameters of that model, which converges
+in a fraction of the iterations of a cold start.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from fbprophet import Prophet
+from fbprophet.serialize import model_from_json, model_to_json
+
+CACHE_DIR = '.prophet_cache'
+
+
+def _params_key(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True,
+                                   default=str).encode()).hexdigest()
+
+
+def _row_hashes(df):
+    # leave out the row names column of the csv files written by R
+    columns = [c for c in df.columns if not str(c).startswith('Unnamed')]
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+def _data_key(row_hashes):
+    return hashlib.sha1(np.ascontiguousarray(row_hashes).tobytes()).hexdigest()
+
+
+def stan_init(m):
+    """The fitted parameters of m, in the form Prophet.fit(init=...) takes.
+    From the Prophet docs on updating fitted models.
+    """
+    res = {}
+    for pname in ['k', 'm', 'sigma_obs']:
+        res[pname] = m.params[pname][0][0]
+    for pname in ['delta', 'beta']:
+        res[pname] = m.params[pname][0]
+    return res
+
+
+def _write_atomic(path, write):
+    write(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def _save_json(path, data):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+    _write_atomic(path, write)
+
+
+def fit(df, cache_dir=CACHE_DIR, **params):
+    """Returns Prophet(**params) fitted on df, from the cache if possible."""
+    return fit_predict(df, cache_dir=cache_dir, predict=False, **params)[0]
+
+
+def fit_predict(df, cache_dir=CACHE_DIR, predict=True, **params):
+    """Returns Prophet(**params) fitted on df and its forecast of df (None
+    if predict is False), both from the cache if possible.
+    """
+    directory = os.path.join(cache_dir, _params_key(params))
+    os.makedirs(directory, exist_ok=True)
+    row_hashes = _row_hashes(df)
+    key = _data_key(row_hashes)
+    model_path = os.path.join(directory, key + '.json')
+    forecast_path = os.path.join(directory, key + '.pkl')
+    latest_path = os.path.join(directory, 'latest.json')
+
+    if os.path.exists(model_path):
+        with open(model_path) as f:
+            m = model_from_json(f.read())
+        print('Loaded the fitted model from {}'.format(model_path))
+    else:
+        init = None
+        latest = None
+        if os.path.exists(latest_path):
+            with open(latest_path) as f:
+                latest = json.load(f)
+        if latest is not None and latest['rows'] < len(df) and \
+                _data_key(row_hashes[:latest['rows']]) == latest['key'] and \
+                os.path.exists(os.path.join(directory, latest['key'] + '.json')):
+            with open(os.path.join(directory, latest['key'] + '.json')) as f:
+                init = stan_init(model_from_json(f.read()))
+            print('Warm-starting from the fit on the first {} rows'.format(
+                latest['rows']))
+        m = Prophet(**params)
+        if init is None:
+            m.fit(df)
+        else:
+            m.fit(df, init=init)
+        _save_json(model_path, model_to_json(m))
+        _save_json(latest_path, json.dumps({'key': key, 'rows': len(df)}))
+        if init is not None:
+            # the older fit was a prefix of this one, so it won't be asked for
+            for extension in ('.json', '.pkl'):
+                path = os.path.join(directory, latest['key'] + extension)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    if not predict:
+        return m, None
+    if os.path.exists(forecast_path):
+        return m, pd.read_pickle(forecast_path)
+    forecast = m.predict(df)
+    _write_atomic(forecast_path, forecast.to_pickle)
+    return m, forecast
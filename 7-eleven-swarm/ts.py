@@ -1,15 +1,21 @@
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
-from fbprophet import Prophet
+
+import prophet_cache
 
 # setting the Seaborn aesthetics.
 sns.set(font_scale=1.3)
 
-df = pd.read_csv('ts_df.csv')
 
-m = Prophet()
-m.fit(df)
-forecast = m.predict(df)
-fig = m.plot_components(forecast)
-plt.show()
+def components_figure(inputs):
+    """Render job: the trend and seasonalities of the series inputs[0]."""
+    # the fitted model and its forecast are cached, and reused until the data
+    # changes
+    m, forecast = prophet_cache.fit_predict(pd.read_csv(inputs[0]))
+    return m.plot_components(forecast)
+
+
+if __name__ == '__main__':
+    components_figure(['ts_df.csv'])
+    plt.show()
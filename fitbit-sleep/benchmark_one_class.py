@@ -0,0 +1,91 @@
+"""
+Compares the exact One-Class SVM with the approx engine of one_class.py
+(trained in mini-batches): fit time, peak memory of the fit, and how much
+their boundaries agree (the share of a 200x200 grid over the plot area where
+both give the same inlier/outlier answer).
+
+Every fit runs in its own process, and its memory is the growth of the peak
+RSS of that process, which also counts what libsvm allocates in C.
+
+The larger samples are drawn from data/start_times.csv with some jitter, to
+stand in for minute-level data or several users.
+
+Usage:
+    python benchmark_one_class.py --sizes 1000 10000 100000
+"""
+import argparse
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import one_class
+
+# the exact SVM takes minutes past this size
+MAX_EXACT_SIZE = 20000
+BATCH_SIZE = 10000
+
+
+def sample(df, n, seed=0):
+    rng = np.random.default_rng(seed)
+    X = df.sample(n, replace=True, random_state=seed).to_numpy(dtype=float)
+    X[:, 1] += rng.normal(0, 0.25, n)
+    return X
+
+
+def _max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def _fit(engine, X, nu, gamma, grid):
+    before = _max_rss_mb()
+    started = time.perf_counter()
+    if engine == 'approx':
+        clf = one_class.fit_batches(
+            [X[i:i + BATCH_SIZE] for i in range(0, len(X), BATCH_SIZE)],
+            nu=nu, gamma=gamma)
+    else:
+        clf = one_class.make_detector(engine, nu, gamma).fit(X)
+    elapsed = time.perf_counter() - started
+    return elapsed, _max_rss_mb() - before, clf.predict(grid)
+
+
+def measure(engine, X, nu, gamma, grid):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_fit, engine, X, nu, gamma, grid).result()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--nu', type=float, default=0.1)
+    parser.add_argument('--gamma', type=float, default=0.1)
+    args = parser.parse_args()
+
+    df = pd.read_csv('data/start_times.csv')[['weekday', 'time']]
+    xx, yy = np.meshgrid(np.linspace(0, 8, 200), np.linspace(-2, 25, 200))
+    grid = np.c_[xx.ravel(), yy.ravel()]
+
+    print('{:>8} {:>7} {:>10} {:>10} {:>10}'.format(
+        'n', 'engine', 'fit (s)', 'peak (MB)', 'agreement'))
+    for n in args.sizes:
+        X = sample(df, n)
+        exact = None
+        for engine in one_class.ENGINES:
+            if engine == 'exact' and n > MAX_EXACT_SIZE:
+                print('{:>8} {:>7} {:>10}'.format(n, engine, 'skipped'))
+                continue
+            elapsed, peak, predictions = measure(engine, X, args.nu,
+                                                 args.gamma, grid)
+            if engine == 'exact':
+                exact = predictions
+            agreement = '' if exact is None else \
+                '{:.3f}'.format(np.mean(predictions == exact))
+            print('{:>8} {:>7} {:>10.2f} {:>10.1f} {:>10}'.format(
+                n, engine, elapsed, peak, agreement))
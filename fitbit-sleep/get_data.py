@@ -1,12 +1,24 @@
 import fitbit
 import os
+import sys
 import argparse
-import datetime
 import pandas as pd
 
+# the shared fetcher lives next to the other Fitbit scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'fitbit'))
+from fetcher import DayFetcher, date_range  # noqa: E402
+from cache import CachedClient, ResponseCache  # noqa: E402
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--base_date', '-bd', help="Starting date", type=str,
                     default='2019-05-28')
+parser.add_argument('--cache', '-c', action='store_true',
+                    help="Serve already downloaded days from the local cache")
 args = parser.parse_args()
 
 
@@ -17,23 +29,25 @@ def run():
                            access_token=os.environ['ACCESS_TOKEN'],
                            refresh_token=os.environ['REFRESH_TOKEN'],
                            system='en_DE')
+    telemetry.instrument_session(client.client.session, 'fitbit')
+    if args.cache:
+        client = CachedClient(client, ResponseCache('data/fitbit_cache.sqlite'))
     base_date = args.base_date
     df = get_sleep_data(client, base_date)
     df.to_csv('data/df.csv', index=False, encoding='utf-8')
 
 
-def get_sleep_data(client, base_date):
+def get_sleep_data(client, base_date, fetcher=None):
     """
     This function retrieves sleep data, from base_date until today
     """
     # get sleep data
-    start = datetime.datetime.strptime(base_date, '%Y-%m-%d')
-    delta = datetime.datetime.today() - start
-    dates = [start + datetime.timedelta(days=i) for i in range(delta.days + 1)]
+    dates = date_range(base_date)
+    fetcher = fetcher or DayFetcher(client)
+    responses = fetcher.map(lambda c, date: c.get_sleep(date.date()), dates)
     sleep_data = []
 
-    for date in dates:
-        single_day_sleep = client.get_sleep(date.date())
+    for single_day_sleep in responses:
         stages = single_day_sleep.get('summary').get('stages')
         for sleep_activity in single_day_sleep.get('sleep'):
             # ignore naps
@@ -68,4 +82,5 @@ def get_sleep_data(client, base_date):
 
 if __name__ == "__main__":
     print('Starting....')
+    telemetry.start('fitbit-sleep-get_data')
     run()
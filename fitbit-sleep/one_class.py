@@ -0,0 +1,175 @@
+"""
+One-class detectors for the sleep start times.
+
+The exact OneClassSVM of outliers-detection.py needs the full kernel matrix,
+so its fit time grows super-linearly with the number of nights. The "approx"
+engine maps the features with a Nystroem approximation of the same RBF
+kernel and fits a linear SGDOneClassSVM on top of it, which is linear in the
+number of samples and can be trained in mini-batches (for instance straight
+from the columnar store of fitbit/store.py).
+
+grid_search() picks nu and gamma by cross-validation. There are no labels,
+so a combination is scored by how well the outlier rate on the held-out
+folds matches the contamination it was fit for (nu), and by how stable the
+rate is across folds.
+"""
+import itertools
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDOneClassSVM
+from sklearn.model_selection import KFold
+from sklearn.pipeline import make_pipeline
+from sklearn.svm import OneClassSVM
+
+# the columnar store lives with the fitbit scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'fitbit'))
+import store  # noqa: E402
+
+# where fitbit/get_data.py --format parquet writes the sleep resource
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', 'fitbit', 'data', 'store')
+ENGINES = ('exact', 'approx')
+N_COMPONENTS = 300
+# rows of the store held at once to tune and plot a model trained on it
+SAMPLE_SIZE = 10000
+NUS = (0.05, 0.1, 0.2)
+GAMMAS = (0.01, 0.05, 0.1, 0.5)
+
+
+def make_detector(engine='exact', nu=0.1, gamma=0.1,
+                  n_components=N_COMPONENTS, random_state=0):
+    if engine == 'exact':
+        return OneClassSVM(nu=nu, kernel='rbf', gamma=gamma)
+    if engine == 'approx':
+        return make_pipeline(
+            Nystroem(kernel='rbf', gamma=gamma, n_components=n_components,
+                     random_state=random_state),
+            SGDOneClassSVM(nu=nu, random_state=random_state))
+    raise ValueError('Unknown engine: {}'.format(engine))
+
+
+def sleep_features(df):
+    """Weekday (Monday is 1) of the night and decimal start time, the two
+    columns of data/start_times.csv, from the date and startTime columns of
+    the sleep resource.
+    """
+    date = pd.to_datetime(df['date'])
+    start = pd.to_datetime(df['startTime'].astype(str).str[:19])
+    return pd.DataFrame({
+        'weekday': date.dt.weekday + 1,
+        'time': start.dt.hour + start.dt.minute / 60,
+    })
+
+
+def _read_sleep(store_dir):
+    return store.read_compat('sleep', store_dir=store_dir).dropna(
+        subset=['date', 'startTime'])
+
+
+def read_start_times(path='data/start_times.csv', store_dir=None):
+    """The weekday and time columns of data/start_times.csv, from the sleep
+    resource of the store in store_dir if given, else from the csv of the
+    notebook.
+    """
+    if store_dir is None:
+        return pd.read_csv(path, encoding='utf-8')
+    return sleep_features(_read_sleep(store_dir))
+
+
+def read_decimal_start(path='data/decimal_start.csv', store_dir=None):
+    """The ds and y (decimal start time) columns of data/decimal_start.csv,
+    from the sleep resource of the store in store_dir if given, else from
+    the csv.
+    """
+    if store_dir is None:
+        return pd.read_csv(path)
+    start = pd.to_datetime(
+        _read_sleep(store_dir)['startTime'].astype(str).str[:19])
+    return pd.DataFrame({'ds': start,
+                         'y': start.dt.hour + start.dt.minute / 60})
+
+
+def fit_batches(batches, nu=0.1, gamma=0.1, n_components=N_COMPONENTS,
+                epochs=1, random_state=0):
+    """Fits the approx engine on an iterable of feature DataFrames without
+    holding all of them in memory. The Nystroem landmarks are taken from the
+    first batch. batches is called again for every epoch if it's callable.
+    """
+    nystroem = None
+    sgd = SGDOneClassSVM(nu=nu, random_state=random_state)
+    for _ in range(epochs):
+        for X in (batches() if callable(batches) else batches):
+            if nystroem is None:
+                nystroem = Nystroem(kernel='rbf', gamma=gamma,
+                                    n_components=min(n_components, len(X)),
+                                    random_state=random_state).fit(X)
+            sgd.partial_fit(nystroem.transform(X))
+    if nystroem is None:
+        raise ValueError('No batches to fit')
+    return make_pipeline(nystroem, sgd)
+
+
+def store_batches(resource='sleep', store_dir=store.STORE_DIR,
+                  batch_size=65536):
+    """Yields the features of the sleep sessions of the columnar store, in
+    DataFrames of at most batch_size rows.
+    """
+    for df in store.read_batches(resource, ['date', 'startTime'],
+                                 batch_size, store_dir):
+        yield sleep_features(df.dropna())
+
+
+def sample_store(size=SAMPLE_SIZE, resource='sleep',
+                 store_dir=store.STORE_DIR, batch_size=65536, random_state=0):
+    """A uniform sample of at most size rows of the features of
+    store_batches, holding no more than the sample and one batch at a time.
+    """
+    rng = np.random.default_rng(random_state)
+    sample, keys = None, np.empty(0)
+    for X in store_batches(resource, store_dir, batch_size):
+        # the size rows with the smallest random keys are a uniform sample
+        X = X if sample is None else pd.concat([sample, X], ignore_index=True)
+        keys = np.concatenate([keys, rng.random(len(X) - len(keys))])
+        keep = np.sort(np.argsort(keys, kind='stable')[:size])
+        sample = X.iloc[keep].reset_index(drop=True)
+        keys = keys[keep]
+    if sample is None:
+        raise ValueError('No {} rows in {}'.format(resource, store_dir))
+    return sample
+
+
+def fit_from_store(resource='sleep', store_dir=store.STORE_DIR,
+                   batch_size=65536, **kwargs):
+    """Fits the approx engine on the sleep sessions of the columnar store."""
+    return fit_batches(
+        lambda: store_batches(resource, store_dir, batch_size), **kwargs)
+
+
+def _evaluate(X, engine, nu, gamma, folds, n_components):
+    rates = []
+    for train, test in KFold(folds, shuffle=True, random_state=0).split(X):
+        clf = make_detector(engine, nu, gamma, n_components)
+        clf.fit(X[train])
+        rates.append(float(np.mean(clf.predict(X[test]) == -1)))
+    return {'engine': engine, 'nu': nu, 'gamma': gamma,
+            'outlier_rate': float(np.mean(rates)),
+            'outlier_rate_std': float(np.std(rates)),
+            'error': abs(float(np.mean(rates)) - nu) + float(np.std(rates))}
+
+
+def grid_search(X, engine='exact', nus=NUS, gammas=GAMMAS, folds=5,
+                n_components=N_COMPONENTS, n_jobs=-1):
+    """Cross-validates every (nu, gamma) pair in parallel and returns the
+    results, best first.
+    """
+    X = np.asarray(X, dtype=float)
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_evaluate)(X, engine, nu, gamma, folds, n_components)
+        for nu, gamma in itertools.product(nus, gammas))
+    return sorted(results, key=lambda result: result['error'])
@@ -2,27 +2,75 @@
 This script fits a One Class SVM
 Code for plotting the decision function was taken from:
 https://scikit-learn.org/stable/auto_examples/svm/plot_oneclass.html#sphx-glr-auto-examples-svm-plot-oneclass-py
+
+--engine approx swaps the exact SVM for the kernel approximation of
+one_class.py, --store trains it in mini-batches from the columnar store, and
+--grid picks nu and gamma by cross-validation first.
 """
 
-from sklearn.svm import OneClassSVM
+from joblib import dump
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
+import os
+import sys
+
+# the surface evaluator lives with the 7-eleven-swarm scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '7-eleven-swarm'))
+from decision_surface import CACHE_DIR, decision_surface  # noqa: E402
+import one_class  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--engine', choices=one_class.ENGINES, default='exact')
+parser.add_argument('--nu', type=float, default=0.1)
+parser.add_argument('--gamma', type=float, default=0.1)
+parser.add_argument('--grid', action='store_true',
+                    help='Cross-validate nu and gamma before fitting')
+parser.add_argument('--store', action='store_true',
+                    help='Train the approx engine from the columnar store')
+parser.add_argument('--store_dir', default=one_class.STORE_DIR)
+parser.add_argument('--sample_size', type=int, default=one_class.SAMPLE_SIZE,
+                    help='Rows of the store used by --grid and the plot')
+args = parser.parse_args()
+if args.store and args.engine != 'approx':
+    parser.error('--store trains in mini-batches, which needs --engine approx')
 
 # setting the Seaborn aesthetics.
 sns.set(font_scale=1.5)
 
-df = pd.read_csv('data/start_times.csv', encoding='utf-8')
-X_train = df[['weekday', 'time']]
+if args.store:
+    # the model is trained on the whole store in mini-batches; --grid and
+    # the plot only see a sample of it, so the memory doesn't grow with it
+    X_train = one_class.sample_store(args.sample_size,
+                                     store_dir=args.store_dir)
+else:
+    df = one_class.read_start_times()
+    X_train = df[['weekday', 'time']]
+
+nu, gamma = args.nu, args.gamma
+if args.grid:
+    results = one_class.grid_search(X_train, engine=args.engine)
+    for result in results:
+        print(result)
+    nu, gamma = results[0]['nu'], results[0]['gamma']
+    print('Using nu={}, gamma={}'.format(nu, gamma))
 
-clf = OneClassSVM(nu=0.1, kernel="rbf", gamma=0.1)
-clf.fit(X_train)
+if args.store:
+    clf = one_class.fit_from_store(store_dir=args.store_dir, nu=nu,
+                                   gamma=gamma)
+else:
+    clf = one_class.make_detector(args.engine, nu=nu, gamma=gamma)
+    clf.fit(X_train)
+# anomaly_service.py starts from this model to score new sleep sessions
+dump(clf, 'data/sleep_detector.joblib')
 
-# plot of the decision frontier
-xx, yy = np.meshgrid(np.linspace(0, 8, 500), np.linspace(-2, 25, 500))
-Z = clf.decision_function(np.c_[xx.ravel(), yy.ravel()])
-Z = Z.reshape(xx.shape)
+# plot of the decision frontier; the surface is only scored exactly around
+# the boundary and cached between runs
+xx, yy, Z = decision_surface(clf, X_train, (0, 8), (-2, 25), resolution=500,
+                             cache_dir=CACHE_DIR)
 plt.title("\"Sleep Times\" Decision Boundary")
 # comment out the next line to see the "ripples" of the boundary
 # plt.contourf(xx, yy, Z, levels=np.linspace(Z.min(), 0, 7), cmap=plt.cm.PuBu)
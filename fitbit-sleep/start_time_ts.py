@@ -1,21 +1,38 @@
 """
 This script fits a time series model using my Fitbit steps data.
 """
+import argparse
+import os
+import sys
+
 import matplotlib.pyplot as plt
-import pandas as pd
 import seaborn as sns
-from fbprophet import Prophet
+
+import one_class
+
+# the model cache lives with the 7-eleven-swarm scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '7-eleven-swarm'))
+import prophet_cache  # noqa: E402
 
 # setting the Seaborn aesthetics.
 sns.set()
 
-df = pd.read_csv('data/decimal_start.csv')
+parser = argparse.ArgumentParser()
+parser.add_argument('--store', action='store_true',
+                    help='Read the sleep resource of the columnar store '
+                         'instead of data/decimal_start.csv')
+parser.add_argument('--store_dir', default=one_class.STORE_DIR)
+args = parser.parse_args()
+
+df = one_class.read_decimal_start(
+    store_dir=args.store_dir if args.store else None)
 
 # the trend line is a bit underfit, so I'll increase changepoint_prior_scale
 # to 0.06 (from 0.05).
-m = Prophet(changepoint_prior_scale=0.3)
-m.fit(df)
-forecast = m.predict(df)
+# the fitted model and its forecast are cached, and reused until the data
+# changes
+m, forecast = prophet_cache.fit_predict(df, changepoint_prior_scale=0.3)
 fig = m.plot_components(forecast)
 # this plot shows the trend, weekly and daily seasonality.
 plt.show()
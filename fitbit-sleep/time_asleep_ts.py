@@ -1,19 +1,26 @@
 """
 This script fits a time series model using my Fitbit steps data.
 """
+import os
+import sys
+
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
-from fbprophet import Prophet
+
+# the model cache lives with the 7-eleven-swarm scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '7-eleven-swarm'))
+import prophet_cache  # noqa: E402
 
 # setting the Seaborn aesthetics.
 sns.set(font_scale=1.3)
 
 df = pd.read_csv('data/time_in_bed.csv')
 
-m = Prophet(changepoint_prior_scale=0.5)
-m.fit(df)
-forecast = m.predict(df)
+# the fitted model and its forecast are cached, and reused until the data
+# changes
+m, forecast = prophet_cache.fit_predict(df, changepoint_prior_scale=0.5)
 fig = m.plot_components(forecast)
 # this plot shows the trend, weekly and daily seasonality
 # but for this case, the daily doesn't make any sense
@@ -0,0 +1,175 @@
+"""
+Persistent on-disk cache for the Fitbit API responses.
+
+Responses are stored in a SQLite file keyed by method, resource, date range
+and detail level. Days that are already over can't change anymore, so they
+are cached indefinitely, while today's data expires after a short TTL. The
+cache is bounded in size and evicts the least recently used entries.
+"""
+import datetime
+import json
+import sqlite3
+import threading
+import time
+
+CACHE_FILE = 'data/fitbit_cache.sqlite'
+# how long today's responses are valid, in seconds
+TODAY_TTL = 15 * 60
+# 256 MB
+MAX_SIZE = 256 * 1024 * 1024
+
+
+def to_day(date):
+    """Normalizes a date, datetime or string to a YYYY-MM-DD string."""
+    if date is None or date == 'today':
+        return datetime.date.today().isoformat()
+    if isinstance(date, (datetime.date, datetime.datetime)):
+        return date.strftime('%Y-%m-%d')
+    return str(date)[:10]
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_FILE, max_size=MAX_SIZE,
+                 today_ttl=TODAY_TTL):
+        self.max_size = max_size
+        self.today_ttl = today_ttl
+        self.lock = threading.Lock()
+        # the fetcher calls the cache from several threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                start_day TEXT,
+                end_day TEXT,
+                body TEXT,
+                size INTEGER,
+                expires_at REAL,
+                accessed_at REAL
+            )""")
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_days ON responses (start_day, end_day)')
+        self.conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT body, expires_at FROM responses WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+            body, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute(
+                'UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self.conn.commit()
+        return json.loads(body)
+
+    def put(self, key, start_day, end_day, response):
+        """Stores response. It never expires unless end_day is today (or
+        later), in which case it lives for today_ttl seconds.
+        """
+        now = time.time()
+        body = json.dumps(response)
+        expires_at = None
+        if end_day >= datetime.date.today().isoformat():
+            expires_at = now + self.today_ttl
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, start_day, end_day, body, len(body), expires_at, now))
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        total = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self.conn.execute(
+            'SELECT key, size FROM responses ORDER BY accessed_at').fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+
+    def invalidate(self, start_date, end_date):
+        """Removes every entry that overlaps with [start_date, end_date]."""
+        with self.lock:
+            cursor = self.conn.execute(
+                'DELETE FROM responses WHERE start_day <= ? AND end_day >= ?',
+                (to_day(end_date), to_day(start_date)))
+            self.conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self.conn.close()
+
+
+class CachedClient:
+    """Wraps a fitbit.Fitbit client and serves get_sleep,
+    intraday_time_series and time_series from the cache when possible.
+    Every other attribute is forwarded to the wrapped client. on_miss() is
+    called before every call that goes to the API, e.g. to take a token of
+    the rate limit only for those.
+    """
+
+    def __init__(self, client, cache, on_miss=None):
+        self.wrapped = client
+        self.cache = cache
+        self.on_miss = on_miss
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def with_on_miss(self, on_miss):
+        """The same client and cache, calling on_miss() on the misses."""
+        return CachedClient(self.wrapped, self.cache, on_miss)
+
+    def _miss(self):
+        if self.on_miss is not None:
+            self.on_miss()
+
+    def _cached(self, key_parts, start_day, end_day, call):
+        key = json.dumps(key_parts)
+        response = self.cache.get(key)
+        if response is None:
+            self._miss()
+            response = call()
+            self.cache.put(key, start_day, end_day, response)
+        return response
+
+    def get_sleep(self, date):
+        day = to_day(date)
+        return self._cached(['sleep', day], day, day,
+                            lambda: self.wrapped.get_sleep(date))
+
+    def intraday_time_series(self, resource, base_date='today',
+                             detail_level='1min', start_time=None,
+                             end_time=None):
+        day = to_day(base_date)
+        return self._cached(
+            ['intraday', resource, day, detail_level, start_time, end_time],
+            day, day,
+            lambda: self.wrapped.intraday_time_series(
+                resource, base_date=base_date, detail_level=detail_level,
+                start_time=start_time, end_time=end_time))
+
+    def time_series(self, resource, user_id=None, base_date='today',
+                    period=None, end_date=None):
+        if period is not None:
+            # relative periods move every day, so they are never cached
+            self._miss()
+            return self.wrapped.time_series(resource, user_id=user_id,
+                                            base_date=base_date, period=period)
+        start_day, end_day = to_day(base_date), to_day(end_date)
+        return self._cached(
+            ['time_series', resource, user_id, start_day, end_day],
+            start_day, end_day,
+            lambda: self.wrapped.time_series(
+                resource, user_id=user_id, base_date=base_date,
+                end_date=end_date))
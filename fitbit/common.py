@@ -1,6 +1,7 @@
 import os.path
 import pandas as pd
-import datetime
+
+from fetcher import DayFetcher, date_range
 
 # TODO: pls rename this file
 
@@ -11,18 +12,17 @@ def append_to_csv(filename, df):
         df.to_csv(f, header=should_write_header, index=False)
 
 
-def get_sleep_data(client, base_date):
+def get_sleep_data(client, base_date, fetcher=None):
     """
     This function retrieves sleep data, from base_date until todat
     """
     # get sleep data
-    start = datetime.datetime.strptime(base_date, '%Y-%m-%d')
-    delta = datetime.datetime.today() - start
-    dates = [start + datetime.timedelta(days=i) for i in range(delta.days + 1)]
+    dates = date_range(base_date)
+    fetcher = fetcher or DayFetcher(client)
+    responses = fetcher.map(lambda c, date: c.get_sleep(date.date()), dates)
     sleep_data = []
 
-    for date in dates:
-            single_day_sleep = client.get_sleep(date.date())
+    for single_day_sleep in responses:
             for sleep_activity in single_day_sleep.get('sleep'):
                     if not sleep_activity.get('isMainSleep'):
                             continue
@@ -37,14 +37,13 @@ def get_sleep_data(client, base_date):
                         'endTime', 'timeInBed', 'minutesAsleep'])
 
 
-def get_intraday_steps_data(client, start_date, end_date):
-    start = datetime.datetime.strptime(start_date, '%Y-%m-%d')
-    end = datetime.datetime.strptime(end_date, '%Y-%m-%d')
-    delta = end - start
-    dates = [start + datetime.timedelta(days=i) for i in range(delta.days + 1)]
+def get_intraday_steps_data(client, start_date, end_date, fetcher=None):
+    dates = date_range(start_date, end_date)
+    fetcher = fetcher or DayFetcher(client)
+    responses = fetcher.map(lambda c, date: c.intraday_time_series(
+        'activities/steps', base_date=date, detail_level='15min'), dates)
     steps_data = []
-    for date in dates:
-        single_day_steps = client.intraday_time_series('activities/steps', base_date=date, detail_level='15min')
+    for date, single_day_steps in zip(dates, responses):
         for entry in single_day_steps.get('activities-steps-intraday').get('dataset'):
             steps_data.append((date, entry.get('time'), entry.get('value')))
 
@@ -0,0 +1,183 @@
+"""
+Concurrent, rate-limit-aware fetcher for the per-day Fitbit API calls.
+
+The Fitbit API allows 150 requests per hour per authorized user, so the
+calls are spread over a small thread pool and throttled with a token bucket
+that is kept in sync with the Fitbit-Rate-Limit-* response headers.
+"""
+import datetime
+import itertools
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from fitbit.exceptions import HTTPTooManyRequests
+
+from cache import CachedClient
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
+
+# Fitbit per-user quota
+REQUESTS_PER_HOUR = 150
+MAX_WORKERS = 4
+MAX_RETRIES = 5
+
+
+class TokenBucket:
+    """Token bucket that refills capacity tokens every period seconds.
+    It can be corrected with the remaining budget reported by the API and
+    paused when the API answers with a 429.
+    """
+
+    def __init__(self, capacity=REQUESTS_PER_HOUR, period=3600.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        """Consumes a token if one is available and returns 0. Otherwise it
+        returns the seconds to wait before trying again.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until:
+                return self.paused_until - now
+            elif self.paused_until:
+                # the quota window has been reset by the API
+                self.paused_until = 0.0
+                self.tokens = float(self.capacity) - 1
+                return 0
+            elif self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def update(self, remaining, reset):
+        """Syncs the bucket with the API's view of the quota. remaining is
+        the number of calls left and reset the seconds until the quota resets.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.tokens, float(remaining))
+            if remaining <= 0:
+                self._pause(now, reset)
+
+    def pause(self, seconds):
+        """Stops every caller from acquiring tokens for the given seconds."""
+        with self.lock:
+            self._pause(time.monotonic(), seconds)
+
+    def _pause(self, now, seconds):
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+
+
+class DayFetcher:
+    """Runs one API call per day across a bounded thread pool.
+    Results are returned in the same order as the dates, so callers can
+    build the exact same DataFrame the serial loops used to build.
+    """
+
+    def __init__(self, client, max_workers=MAX_WORKERS, bucket=None,
+                 max_retries=MAX_RETRIES):
+        self.client = client
+        self.max_workers = max_workers
+        self.bucket = bucket or TokenBucket()
+        self.max_retries = max_retries
+        self._install_rate_limit_hook()
+
+    def _install_rate_limit_hook(self):
+        # python-fitbit only returns the decoded JSON, so the rate limit
+        # headers are read with a response hook on the underlying session.
+        session = getattr(getattr(self.client, 'client', None), 'session', None)
+        if session is None:
+            return
+        hooks = session.hooks.setdefault('response', [])
+        if self._on_response not in hooks:
+            hooks.append(self._on_response)
+
+    def _on_response(self, response, *args, **kwargs):
+        remaining = response.headers.get('Fitbit-Rate-Limit-Remaining')
+        reset = response.headers.get('Fitbit-Rate-Limit-Reset')
+        if remaining is not None and reset is not None:
+            self.bucket.update(int(remaining), int(reset))
+        return response
+
+    def _call(self, fn, date):
+        client, acquire = self.client, self.bucket.acquire
+        if isinstance(client, CachedClient):
+            # the cache hits cost no quota, only the misses wait for a token
+            client, acquire = client.with_on_miss(acquire), None
+        for attempt in range(self.max_retries + 1):
+            if acquire is not None:
+                acquire()
+            try:
+                return fn(client, date)
+            except HTTPTooManyRequests as e:
+                if attempt == self.max_retries:
+                    raise
+                # wait out the quota window instead of crashing
+                retry_after = getattr(e, 'retry_after_secs', None) or 60
+                print('Rate limited on {}, waiting {}s'.format(date, retry_after))
+                telemetry.METRICS.retry('fitbit', 429)
+                self.bucket.pause(int(retry_after) + 1)
+
+    def map(self, fn, dates):
+        """Calls fn(client, date) for every date and returns the results
+        in the order of dates.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda date: self._call(fn, date), dates))
+
+    def imap(self, fn, dates):
+        """Calls fn(client, date) for every date and yields (date, result)
+        as the calls finish, so every day can be stored as soon as it
+        arrives. At most two results per worker are waiting at a time.
+        """
+        dates = iter(dates)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                for date in itertools.islice(
+                        dates, 2 * self.max_workers - len(pending)):
+                    pending[executor.submit(self._call, fn, date)] = date
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+
+
+def date_range(start_date, end_date=None):
+    """Returns the datetimes from start_date until end_date (both included).
+    If end_date is None, the range goes until today.
+    """
+    start = datetime.datetime.strptime(start_date, '%Y-%m-%d')
+    if end_date is None:
+        end = datetime.datetime.today()
+    else:
+        end = datetime.datetime.strptime(end_date, '%Y-%m-%d')
+    delta = end - start
+    return [start + datetime.timedelta(days=i) for i in range(delta.days + 1)]
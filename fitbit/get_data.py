@@ -5,12 +5,28 @@ import datetime
 import os
 import pandas as pd
 import requests
+import store
+import sync
+import sys
+from cache import CachedClient, ResponseCache
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--base_date', '-bd', help="Starting date", type=str,
                     default='2019-09-03')
 parser.add_argument('--access_token', '-at', help="Fitbit Access Token", type=str)
 parser.add_argument('--refresh_token', '-rt', help="Fitbit Refresh Token", type=str)
+parser.add_argument('--sync', '-s', action='store_true',
+                    help="Only download the days after the last run and upsert them")
+parser.add_argument('--overlap', type=int, default=sync.OVERLAP_DAYS,
+                    help="Days re-downloaded before the last synced date")
+parser.add_argument('--format', '-f', choices=['csv', 'parquet'], default='csv',
+                    help="Write csv files or the month-partitioned Parquet store")
+parser.add_argument('--cache', '-c', action='store_true',
+                    help="Serve already downloaded days from the local cache")
 args = parser.parse_args()
 base_date = args.base_date
 access_token = args.access_token
@@ -20,16 +36,49 @@ refresh_token = args.refresh_token
 client = fitbit.Fitbit(os.environ['FITBIT_KEY'], os.environ['FITBIT_SECRET'],
                        access_token=access_token, refresh_token=refresh_token,
                        system='en_DE')
+telemetry.start('fitbit-get_data')
+telemetry.instrument_session(client.client.session, 'fitbit')
+if args.cache:
+    client = CachedClient(client, ResponseCache())
+
+watermarks = sync.load_watermarks() if args.sync else {}
+
+
+def save(resource, filename, df, key='dateTime'):
+    """Writes df to its csv file or to the Parquet store. In sync mode the
+    rows are upserted by date and the watermark of the resource moves forward.
+    """
+    if args.format == 'parquet':
+        # the store always replaces the rows with the same date
+        store.append(resource, df)
+        last_date = str(df[key].max())[:10] if not df.empty else None
+    elif args.sync:
+        last_date = sync.upsert_csv(filename, df, key)
+    else:
+        common.append_to_csv(filename, df)
+        return
+    if args.sync and last_date is not None:
+        watermarks[resource] = last_date
+        sync.save_watermarks(watermarks)
+
+
+def start_date(resource, filename, key='dateTime'):
+    if not args.sync:
+        return base_date
+    watermark = sync.get_watermark(watermarks, resource, filename, key)
+    return sync.sync_start_date(watermark, base_date, args.overlap)
 
 
 # get water logs
-result = client.time_series(resource='foods/log/water', base_date=base_date, 
+result = client.time_series(resource='foods/log/water',
+                            base_date=start_date('water', 'data/water'),
                             end_date='today')
 df = pd.DataFrame(result['foods-log-water'])
-common.append_to_csv('data/water', df)
+save('water', 'data/water', df)
 
 # get sleep data
-common.append_to_csv('data/sleep', common.get_sleep_data(client, base_date))
+df = common.get_sleep_data(client, start_date('sleep', 'data/sleep', 'date'))
+save('sleep', 'data/sleep', df, 'date')
 
 # activities to retrieve
 activities = ['steps', 'calories', 'distance', 'minutesSedentary',
@@ -38,7 +87,9 @@ activities = ['steps', 'calories', 'distance', 'minutesSedentary',
 
 # this loop gets the activities data, convert it to DataFrame and saves it to csv
 for act in activities:
+    filename = 'data/{}'.format(act)
     result = client.time_series(resource='activities/{}'.format(act),
-                                base_date=base_date, end_date='today')
+                                base_date=start_date(act, filename),
+                                end_date='today')
     df = pd.DataFrame(result['activities-{}'.format(act)])
-    common.append_to_csv('data/{}'.format(act), df)
+    save(act, filename, df)
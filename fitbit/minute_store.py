@@ -0,0 +1,185 @@
+"""
+Memory-mapped store for the minute-level intraday data.
+
+Every metric is one flat binary file with a fixed-size slot per day (1440
+minutes) and a small JSON index next to it:
+
+    data/intraday/<metric>/values.dat     days x 1440 values
+    data/intraday/<metric>/index.json     first day, dtype and days present
+
+Steps, floors and heart rate are int16 and the other metrics float32;
+minutes without a sample hold MISSING (-1, or NaN for floats). A day is
+written straight into its slot and marked as present in the index only once
+it is flushed to disk. Range reads return NumPy views over the mapped file,
+so years of minute data can be sliced without loading them into memory.
+
+Usage:
+    python minute_store.py steps 2020-07-01 2020-07-31
+"""
+import argparse
+import datetime
+import json
+import os
+
+import numpy as np
+
+STORE_DIR = 'data/intraday'
+MINUTES = 1440
+MISSING = -1
+DTYPES = {
+    'steps': 'int16',
+    'floors': 'int16',
+    'heart': 'int16',
+    'calories': 'float32',
+    'distance': 'float32',
+    'elevation': 'float32',
+}
+# the file is grown this many days at a time
+GROW_DAYS = 31
+
+
+def _to_date(date):
+    if isinstance(date, datetime.datetime):
+        return date.date()
+    if isinstance(date, datetime.date):
+        return date
+    return datetime.datetime.strptime(date[:10], '%Y-%m-%d').date()
+
+
+def minutes(times):
+    """Minute of the day of HH:MM:SS strings."""
+    times = np.asarray(times, dtype='U8')
+    hours = times.astype('U2').astype(np.int32)
+    mins = np.char.partition(times, ':')[:, 2].astype('U2').astype(np.int32)
+    return hours * 60 + mins
+
+
+class MinuteStore:
+    """One metric of the store."""
+
+    def __init__(self, metric, store_dir=STORE_DIR):
+        self.metric = metric
+        self.dir = os.path.join(store_dir, metric)
+        self.values_path = os.path.join(self.dir, 'values.dat')
+        self.index_path = os.path.join(self.dir, 'index.json')
+        self.dtype = np.dtype(DTYPES.get(metric, 'float32'))
+        self.missing = np.nan if self.dtype.kind == 'f' else MISSING
+        self.start = None
+        self.present = set()
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.start = _to_date(index['start'])
+            self.dtype = np.dtype(index['dtype'])
+            self.present = set(index['present'])
+
+    @property
+    def days(self):
+        if not os.path.exists(self.values_path):
+            return 0
+        return os.path.getsize(self.values_path) // \
+            (MINUTES * self.dtype.itemsize)
+
+    def save_index(self):
+        """Marks the days written so far as present."""
+        index = {'start': self.start.isoformat(), 'dtype': self.dtype.name,
+                 'present': sorted(self.present)}
+        with open(self.index_path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def _new_days(self, count):
+        return np.full((count, MINUTES), self.missing, dtype=self.dtype)
+
+    def _ensure(self, date):
+        """Makes room for date and returns its slot."""
+        os.makedirs(self.dir, exist_ok=True)
+        if self.start is None:
+            self.start = date
+        if date < self.start:
+            # rare (a backfill before the first day), so the file is
+            # rewritten with the extra days in front
+            shift = (self.start - date).days
+            tmp_path = self.values_path + '.tmp'
+            with open(tmp_path, 'wb') as dst:
+                self._new_days(shift).tofile(dst)
+                if os.path.exists(self.values_path):
+                    with open(self.values_path, 'rb') as src:
+                        while True:
+                            block = src.read(1 << 24)
+                            if not block:
+                                break
+                            dst.write(block)
+            os.replace(tmp_path, self.values_path)
+            self.start = date
+            self.save_index()
+        slot = (date - self.start).days
+        if slot >= self.days:
+            with open(self.values_path, 'ab') as f:
+                self._new_days(slot + GROW_DAYS - self.days).tofile(f)
+        return slot
+
+    def write_day(self, date, times, values, save=True):
+        """Writes the samples of one day; times are HH:MM:SS strings. With
+        save=False the index is only written by the next save_index(), so a
+        batch of days rewrites it once.
+        """
+        date = _to_date(date)
+        slot = self._ensure(date)
+        day = self._new_days(1)[0]
+        if len(times):
+            day[minutes(times)] = np.asarray(values, dtype=self.dtype)
+        data = np.memmap(self.values_path, dtype=self.dtype, mode='r+',
+                         offset=slot * MINUTES * self.dtype.itemsize,
+                         shape=(MINUTES,))
+        data[:] = day
+        data.flush()
+        del data
+        self.present.add(date.isoformat())
+        if save:
+            self.save_index()
+
+    def read(self, start_date=None, end_date=None):
+        """Returns the dates and a read-only days x 1440 view of the values
+        between start_date and end_date (both included). Days that weren't
+        downloaded hold MISSING; has_days() tells them apart.
+        """
+        if self.start is None:
+            return [], np.empty((0, MINUTES), dtype=self.dtype)
+        first = 0 if start_date is None else \
+            max((_to_date(start_date) - self.start).days, 0)
+        last = self.days - 1 if end_date is None else \
+            min((_to_date(end_date) - self.start).days, self.days - 1)
+        if last < first:
+            return [], np.empty((0, MINUTES), dtype=self.dtype)
+        data = np.memmap(self.values_path, dtype=self.dtype, mode='r',
+                         shape=(self.days, MINUTES))
+        dates = [self.start + datetime.timedelta(days=i)
+                 for i in range(first, last + 1)]
+        return dates, data[first:last + 1]
+
+    def has_days(self, dates):
+        """A boolean array telling which of dates were downloaded."""
+        return np.array([_to_date(date).isoformat() in self.present
+                         for date in dates], dtype=bool)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('metric')
+    parser.add_argument('start_date')
+    parser.add_argument('end_date')
+    parser.add_argument('--store_dir', default=STORE_DIR)
+    args = parser.parse_args()
+
+    store = MinuteStore(args.metric, args.store_dir)
+    dates, values = store.read(args.start_date, args.end_date)
+    present = store.has_days(dates)
+    for date, day, has_day in zip(dates, values, present):
+        if not has_day:
+            print('{}: missing'.format(date))
+            continue
+        valid = day[day != MISSING] if store.dtype.kind != 'f' \
+            else day[~np.isnan(day)]
+        print('{}: {} minutes, total {}, max {}'.format(
+            date, len(valid), valid.sum(), valid.max() if len(valid) else '-'))
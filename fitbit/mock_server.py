@@ -0,0 +1,160 @@
+"""
+Local stand-in for the parts of the Fitbit API the scripts use, to try the
+multi-user scheduler without real accounts or quota.
+
+It answers the sleep logs of any day with a made up night, enforces the
+per-user quota with the Fitbit-Rate-Limit-* headers and 429s, and expires
+every access token after a number of calls so the token refresh is
+exercised. Access tokens look like <user>.<n> and refresh tokens like
+<user>.refresh.<n>; it writes a matching users.json to start from.
+
+Usage:
+    python mock_server.py --users data/users.json --limit 150 --port 8000
+"""
+import argparse
+import datetime
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# python-fitbit doesn't zero-pad the month and day
+SLEEP_URL = re.compile(r'^/1(\.2)?/user/-/sleep/date/(\d{4}-\d{1,2}-\d{1,2})\.json')
+
+
+class MockState:
+    def __init__(self, limit, window, token_calls, latency):
+        self.limit = limit
+        self.window = window
+        self.token_calls = token_calls
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.tokens = {}       # access token -> [user, calls left]
+        self.refresh = {}      # refresh token -> user
+        self.quota = {}        # user -> [window start, calls]
+        self.served = {}       # user -> calls served
+
+    def issue(self, user, n):
+        access, refresh = '{}.{}'.format(user, n), '{}.refresh.{}'.format(user, n)
+        self.tokens[access] = [user, self.token_calls]
+        self.refresh[refresh] = user
+        return {'access_token': access, 'refresh_token': refresh,
+                'expires_in': 28800, 'token_type': 'Bearer', 'user_id': user}
+
+    def rate(self, user):
+        """Returns the calls remaining and the seconds until the reset,
+        counting this call.
+        """
+        now = time.time()
+        start, calls = self.quota.get(user, (now, 0))
+        if now - start >= self.window:
+            start, calls = now, 0
+        calls += 1
+        self.quota[user] = [start, calls]
+        return self.limit - calls, int(start + self.window - now) + 1
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, str(value))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != '/oauth2/token':
+                return self._send(404, {'errors': [{'errorType': 'not_found'}]})
+            length = int(self.headers.get('Content-Length', 0))
+            form = parse_qs(self.rfile.read(length).decode())
+            refresh = form.get('refresh_token', [''])[0]
+            with state.lock:
+                user = state.refresh.pop(refresh, None)
+                if user is None:
+                    return self._send(400, {'errors': [
+                        {'errorType': 'invalid_grant'}]})
+                n = int(refresh.rsplit('.', 1)[1]) + 1
+                return self._send(200, state.issue(user, n))
+
+        def do_GET(self):
+            match = SLEEP_URL.match(self.path)
+            if match is None:
+                return self._send(404, {'errors': [{'errorType': 'not_found'}]})
+            token = self.headers.get('Authorization', '')[len('Bearer '):]
+            with state.lock:
+                entry = state.tokens.get(token)
+                if entry is None or entry[1] <= 0:
+                    return self._send(401, {'errors': [
+                        {'errorType': 'expired_token'}]})
+                user = entry[0]
+                remaining, reset = state.rate(user)
+                headers = {'Fitbit-Rate-Limit-Limit': state.limit,
+                           'Fitbit-Rate-Limit-Remaining': max(remaining, 0),
+                           'Fitbit-Rate-Limit-Reset': reset}
+                if remaining < 0:
+                    headers['Retry-After'] = reset
+                    return self._send(429, {'errors': [
+                        {'errorType': 'system'}]}, headers)
+                entry[1] -= 1
+                state.served[user] = state.served.get(user, 0) + 1
+            time.sleep(state.latency)
+            day = datetime.datetime.strptime(match.group(2), '%Y-%m-%d')
+            date = day.strftime('%Y-%m-%d')
+            # a made up night that differs from day to day and user to user
+            start = day - datetime.timedelta(
+                hours=1, minutes=zlib.crc32(date.encode()) % 90)
+            end = start + datetime.timedelta(
+                hours=7, minutes=zlib.crc32(user.encode()) % 60)
+            minutes = int((end - start).total_seconds() // 60)
+            self._send(200, {'sleep': [{
+                'dateOfSleep': date, 'isMainSleep': True, 'efficiency': 93,
+                'startTime': start.strftime('%Y-%m-%dT%H:%M:%S.000'),
+                'endTime': end.strftime('%Y-%m-%dT%H:%M:%S.000'),
+                'timeInBed': minutes, 'minutesAsleep': minutes - 20}]},
+                headers)
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', default='data/users.json',
+                        help="users.json to write with the initial tokens")
+    parser.add_argument('--names', nargs='+', default=['alice', 'bob', 'carol'])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--limit', type=int, default=150,
+                        help="calls per user per window")
+    parser.add_argument('--window', type=int, default=3600,
+                        help="seconds of the quota window")
+    parser.add_argument('--token_calls', type=int, default=50,
+                        help="calls before an access token expires")
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    state = MockState(args.limit, args.window, args.token_calls, args.latency)
+    users = {}
+    for name in args.names:
+        token = state.issue(name, 0)
+        users[name] = {'access_token': token['access_token'],
+                       'refresh_token': token['refresh_token'],
+                       'expires_at': None}
+    with open(args.users, 'w') as f:
+        json.dump(users, f, indent=2, sort_keys=True)
+
+    server = ThreadingHTTPServer(('localhost', args.port), make_handler(state))
+    print('Mock Fitbit API on http://localhost:{}'.format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        # how the calls were split among the users
+        print(state.served)
@@ -0,0 +1,165 @@
+"""
+Date-partitioned columnar store for the Fitbit resources.
+
+Every resource is kept as typed Parquet files partitioned by month:
+
+    data/store/<resource>/month=YYYY-MM/data.parquet
+
+Each month lives in a single file, so appending rewrites only that month
+into a temporary file and renames it, which keeps the writes atomic. Reads
+prune the months outside of the requested date range and filter the rest
+inside Arrow.
+
+Usage:
+    python store.py import data/steps_intraday.csv steps_intraday
+    python store.py export steps_intraday steps_intraday.csv
+"""
+import argparse
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+STORE_DIR = 'data/store'
+
+# the column that holds the date of each resource; everything else
+# (the daily activities and water) uses dateTime
+DATE_KEYS = {
+    'sleep': 'date',
+    'steps_intraday': 'date',
+}
+# columns that identify a row, used to drop duplicates on upserts
+ROW_KEYS = {
+    'steps_intraday': ['date', 'time'],
+}
+
+
+def date_key(resource):
+    return DATE_KEYS.get(resource, 'dateTime')
+
+
+def row_key(resource):
+    return ROW_KEYS.get(resource, [date_key(resource)])
+
+
+def _to_typed(df, key):
+    """Parses the date column into dates and the numeric-looking columns
+    into numbers, since the API returns most values as strings.
+    """
+    df = df.copy()
+    df[key] = pd.to_datetime(df[key]).dt.normalize()
+    for column in df.columns:
+        if column != key and not pd.api.types.is_numeric_dtype(df[column]):
+            converted = pd.to_numeric(df[column], errors='coerce')
+            if converted.notna().sum() == df[column].notna().sum():
+                df[column] = converted
+    return df
+
+
+def _write_atomic(table, path):
+    tmp_path = '{}.tmp'.format(path)
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+
+def _month_path(root, month):
+    return os.path.join(root, 'month={}'.format(month), 'data.parquet')
+
+
+def append(resource, df, store_dir=STORE_DIR, dedupe=True):
+    """Adds df to the resource. Rows with the same key as existing rows
+    replace them unless dedupe is False.
+    """
+    if df.empty:
+        return
+    key = date_key(resource)
+    root = os.path.join(store_dir, resource)
+    df = _to_typed(df, key)
+    months = df[key].dt.strftime('%Y-%m')
+
+    for month, part in df.groupby(months):
+        path = _month_path(root, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            existing = pq.read_table(path).to_pandas()
+            existing[key] = pd.to_datetime(existing[key])
+            part = pd.concat([existing, part], ignore_index=True, sort=False)
+        if dedupe:
+            part = part.drop_duplicates(subset=row_key(resource), keep='last')
+        part = part.sort_values(row_key(resource)).reset_index(drop=True)
+        part[key] = part[key].dt.date
+        _write_atomic(pa.Table.from_pandas(part, preserve_index=False), path)
+
+
+def read(resource, start_date=None, end_date=None, columns=None,
+         store_dir=STORE_DIR):
+    """Reads the typed rows of resource between start_date and end_date
+    (both included, as YYYY-MM-DD strings).
+    """
+    key = date_key(resource)
+    dataset = ds.dataset(os.path.join(store_dir, resource), format='parquet',
+                         partitioning='hive')
+    condition = None
+    if start_date is not None:
+        condition = (ds.field('month') >= start_date[:7]) & \
+            (ds.field(key) >= pd.Timestamp(start_date).date())
+    if end_date is not None:
+        end_condition = (ds.field('month') <= end_date[:7]) & \
+            (ds.field(key) <= pd.Timestamp(end_date).date())
+        condition = end_condition if condition is None \
+            else condition & end_condition
+    if columns is not None and key not in columns:
+        columns = [key] + list(columns)
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name != 'month']
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+def read_batches(resource, columns=None, batch_size=65536,
+                 store_dir=STORE_DIR):
+    """Yields the typed rows of resource as DataFrames of at most batch_size
+    rows, so a resource bigger than memory can be processed in pieces.
+    """
+    dataset = ds.dataset(os.path.join(store_dir, resource), format='parquet',
+                         partitioning='hive')
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name != 'month']
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def read_compat(resource, start_date=None, end_date=None,
+                store_dir=STORE_DIR):
+    """Returns the same DataFrame pd.read_csv gives for the old csv files:
+    dates as YYYY-MM-DD strings and 64-bit numbers.
+    """
+    key = date_key(resource)
+    df = read(resource, start_date, end_date, store_dir=store_dir)
+    df[key] = pd.to_datetime(df[key]).dt.strftime('%Y-%m-%d')
+    for column in df.columns:
+        if pd.api.types.is_integer_dtype(df[column]):
+            df[column] = df[column].astype('int64')
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype('float64')
+        elif df[column].notna().all():
+            # str gives the same string dtype read_csv infers
+            df[column] = df[column].astype(str)
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('source', help="csv file to import or resource to export")
+    parser.add_argument('target', help="resource to import into or csv file to export to")
+    parser.add_argument('--store_dir', default=STORE_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        append(args.target, pd.read_csv(args.source), store_dir=args.store_dir)
+    else:
+        read_compat(args.source, store_dir=args.store_dir).to_csv(
+            args.target, index=False)
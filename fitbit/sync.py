@@ -0,0 +1,73 @@
+"""
+Incremental sync helpers. Every resource keeps a high-water mark (the last
+date that was downloaded) so each run only asks for the days after it, plus
+a small overlap to pick up late corrections, and upserts the rows by date.
+"""
+import datetime
+import json
+import os
+
+import pandas as pd
+
+WATERMARKS_FILE = 'data/watermarks.json'
+# days re-downloaded before the watermark, since Fitbit data keeps syncing
+# from the device for a while
+OVERLAP_DAYS = 3
+
+
+def load_watermarks(path=WATERMARKS_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_watermarks(watermarks, path=WATERMARKS_FILE):
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(watermarks, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def get_watermark(watermarks, resource, filename, key):
+    """Returns the high-water mark of resource. If it was never recorded,
+    it falls back to the last date already stored in the csv.
+    """
+    if resource in watermarks:
+        return watermarks[resource]
+    if os.path.exists('{}.csv'.format(filename)):
+        dates = pd.read_csv('{}.csv'.format(filename), usecols=[key])[key]
+        if len(dates) > 0:
+            return str(dates.max())[:10]
+    return None
+
+
+def sync_start_date(watermark, base_date, overlap_days=OVERLAP_DAYS):
+    """Returns the first date that needs to be requested."""
+    if watermark is None:
+        return base_date
+    start = datetime.datetime.strptime(watermark, '%Y-%m-%d') - \
+        datetime.timedelta(days=overlap_days)
+    return max(start.strftime('%Y-%m-%d'), base_date)
+
+
+def upsert_csv(filename, df, key):
+    """Merges df into filename.csv, replacing the rows with the same key (a
+    column, or a list of columns starting with the date), and returns the
+    last date stored in the file (or None if df is empty).
+    The file is written to a temporary file first and then renamed.
+    """
+    path = '{}.csv'.format(filename)
+    if df.empty:
+        return None
+    keys = [key] if isinstance(key, str) else list(key)
+    df = df.astype({k: str for k in keys})
+    if os.path.exists(path):
+        existing = pd.read_csv(path, dtype={k: str for k in keys})
+        df = pd.concat([existing, df], ignore_index=True, sort=False)
+    df = df.drop_duplicates(subset=keys, keep='last').sort_values(keys)
+
+    tmp_path = '{}.tmp'.format(path)
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return df[keys[0]].max()[:10]
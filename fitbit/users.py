@@ -0,0 +1,249 @@
+"""
+Downloads the Fitbit data of several people at once.
+
+The token sets of every user are kept in data/users.json:
+
+    {"alice": {"access_token": "...", "refresh_token": "...",
+               "expires_at": 1594000000.0}, ...}
+
+python-fitbit refreshes an expired token by itself, and the new token set is
+written back to the file right away, since Fitbit refresh tokens can only be
+used once.
+
+The requests of all users share one pool of worker threads. Every user has
+their own token bucket (the 150 requests per hour quota is per user), and
+the workers take the users in turns, skipping the ones that are out of
+quota, so a long backfill of one user doesn't hold up the others. Each user
+has at most one request in flight, which also keeps two threads from using
+the same refresh token.
+
+Usage:
+    python users.py --base_date 2020-07-01
+    # against a local mock server (see mock_server.py)
+    python users.py --base_date 2020-07-01 --api http://localhost:8000
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+import fitbit
+from fitbit.exceptions import HTTPTooManyRequests
+
+import common
+from fetcher import MAX_RETRIES, DayFetcher, TokenBucket
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
+
+USERS_FILE = 'data/users.json'
+MAX_WORKERS = 8
+
+
+class TokenStore:
+    """The token sets of the users, saved on every change."""
+
+    def __init__(self, path=USERS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        with open(path) as f:
+            self.tokens = json.load(f)
+
+    def users(self):
+        return sorted(self.tokens)
+
+    def get(self, user_id):
+        return dict(self.tokens[user_id])
+
+    def save(self, user_id, token):
+        with self.lock:
+            self.tokens[user_id] = {
+                'access_token': token['access_token'],
+                'refresh_token': token['refresh_token'],
+                'expires_at': token.get('expires_at'),
+            }
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.tokens, f, indent=2, sort_keys=True)
+            os.replace(self.path + '.tmp', self.path)
+
+
+def make_client(tokens, user_id, api_endpoint=None):
+    """A Fitbit client for user_id whose refreshed tokens are saved to
+    tokens. api_endpoint points it to another server, like the mock one.
+    """
+    token = tokens.get(user_id)
+    client = fitbit.Fitbit(os.environ['FITBIT_KEY'],
+                           os.environ['FITBIT_SECRET'],
+                           access_token=token['access_token'],
+                           refresh_token=token['refresh_token'],
+                           expires_at=token.get('expires_at'),
+                           refresh_cb=lambda new: tokens.save(user_id, new),
+                           system='en_DE')
+    if api_endpoint is not None:
+        refresh_url = '{}/oauth2/token'.format(api_endpoint)
+        client.API_ENDPOINT = api_endpoint
+        client.client.refresh_token_url = refresh_url
+        client.client.session.auto_refresh_url = refresh_url
+    telemetry.instrument_session(client.client.session, 'fitbit')
+    return client
+
+
+class FairScheduler:
+    """Runs API calls of many users on one thread pool, taking the users in
+    turns and respecting the quota of each of them.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_retries=MAX_RETRIES):
+        self.max_retries = max_retries
+        self.queues = collections.OrderedDict()
+        self.buckets = {}
+        self.running = set()
+        self.turn = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.workers = [threading.Thread(target=self._work, daemon=True)
+                        for _ in range(max_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def fetcher(self, user_id, client):
+        """Returns a DayFetcher for user_id whose calls go through the
+        scheduler, to pass to the get_* functions.
+        """
+        with self.condition:
+            self.queues.setdefault(user_id, collections.deque())
+            self.buckets.setdefault(user_id, TokenBucket())
+        return UserFetcher(self, user_id, client, self.buckets[user_id])
+
+    def submit(self, user_id, fn):
+        """Queues fn() for user_id and returns its Future."""
+        future = Future()
+        with self.condition:
+            self.queues[user_id].append((fn, future, 0))
+            self.condition.notify()
+        return future
+
+    def _next(self):
+        """Waits for the next user in turn that has work and quota."""
+        with self.condition:
+            while not self.closed:
+                users = list(self.queues)
+                wait = None
+                for i in range(len(users)):
+                    user_id = users[(self.turn + i) % len(users)]
+                    if not self.queues[user_id] or user_id in self.running:
+                        continue
+                    user_wait = self.buckets[user_id].try_acquire()
+                    if user_wait:
+                        wait = user_wait if wait is None else min(wait, user_wait)
+                        continue
+                    self.turn = (self.turn + i + 1) % len(users)
+                    self.running.add(user_id)
+                    return (user_id,) + self.queues[user_id].popleft()
+                self.condition.wait(wait)
+            return None
+
+    def _work(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            user_id, fn, future, attempt = task
+            retry = False
+            try:
+                future.set_result(fn())
+            except HTTPTooManyRequests as e:
+                if attempt >= self.max_retries:
+                    future.set_exception(e)
+                else:
+                    retry_after = getattr(e, 'retry_after_secs', None) or 60
+                    print('{} rate limited, waiting {}s'.format(
+                        user_id, retry_after))
+                    self.buckets[user_id].pause(int(retry_after) + 1)
+                    telemetry.METRICS.retry('fitbit', 429)
+                    retry = True
+            except Exception as e:
+                future.set_exception(e)
+            with self.condition:
+                self.running.discard(user_id)
+                if retry:
+                    self.queues[user_id].appendleft((fn, future, attempt + 1))
+                self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+
+class UserFetcher(DayFetcher):
+    """DayFetcher that hands its calls to a FairScheduler."""
+
+    def __init__(self, scheduler, user_id, client, bucket):
+        super().__init__(client, bucket=bucket)
+        self.scheduler = scheduler
+        self.user_id = user_id
+
+    def map(self, fn, dates):
+        futures = [self.scheduler.submit(
+            self.user_id, lambda date=date: fn(self.client, date))
+            for date in dates]
+        return [future.result() for future in futures]
+
+    def imap(self, fn, dates):
+        futures = {self.scheduler.submit(
+            self.user_id, lambda date=date: fn(self.client, date)): date
+            for date in dates}
+        for future in as_completed(futures):
+            yield futures.pop(future), future.result()
+
+
+def download_user(scheduler, tokens, user_id, base_date, out_dir,
+                  api_endpoint=None):
+    """Downloads the sleep data of one user into out_dir/<user_id>/."""
+    started = time.monotonic()
+    client = make_client(tokens, user_id, api_endpoint)
+    fetcher = scheduler.fetcher(user_id, client)
+    df = common.get_sleep_data(client, base_date, fetcher=fetcher)
+    user_dir = os.path.join(out_dir, user_id)
+    os.makedirs(user_dir, exist_ok=True)
+    df.to_csv(os.path.join(user_dir, 'sleep.csv'), index=False)
+    print('{}: {} nights in {:.1f}s'.format(user_id, len(df),
+                                           time.monotonic() - started))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', default=USERS_FILE,
+                        help="json file with the token sets of the users")
+    parser.add_argument('--base_date', '-bd', default='2019-09-03')
+    parser.add_argument('--out_dir', default='data/users')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    parser.add_argument('--api', default=None,
+                        help="API endpoint to use instead of api.fitbit.com")
+    args = parser.parse_args()
+
+    if args.api is not None and args.api.startswith('http://'):
+        # oauthlib refuses to refresh tokens over plain http otherwise
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+    telemetry.start('fitbit-users')
+    tokens = TokenStore(args.users)
+    scheduler = FairScheduler(args.workers)
+    # one thread per user only builds the DataFrames; the API calls all go
+    # through the scheduler's workers
+    with ThreadPoolExecutor(max_workers=len(tokens.users()) or 1) as executor:
+        futures = {executor.submit(download_user, scheduler, tokens, user_id,
+                                   args.base_date, args.out_dir, args.api):
+                   user_id for user_id in tokens.users()}
+    for future, user_id in futures.items():
+        if future.exception() is not None:
+            print('{} failed: {!r}'.format(user_id, future.exception()))
+    scheduler.close()
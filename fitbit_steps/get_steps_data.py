@@ -1,59 +1,122 @@
 import argparse
-import datetime
 import os
+import sys
 
 import fitbit
 import pandas as pd
 
+# the shared fetcher lives next to the other Fitbit scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'fitbit'))
+from fetcher import DayFetcher, date_range  # noqa: E402
+from cache import CachedClient, ResponseCache  # noqa: E402
+import store  # noqa: E402
+import sync  # noqa: E402
+from minute_store import MinuteStore  # noqa: E402
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--access_token', '-at',
                     help="Fitbit Access Token", type=str)
 parser.add_argument('--refresh_token', '-rt',
                     help="Fitbit Refresh Token", type=str)
+parser.add_argument('--format', '-f', choices=['csv', 'parquet'], default='csv',
+                    help="Write a csv file or the month-partitioned Parquet store")
+parser.add_argument('--cache', '-c', action='store_true',
+                    help="Serve already downloaded days from the local cache")
+parser.add_argument('--detail_level', '-d', choices=['15min', '1min'],
+                    default='15min',
+                    help="1min writes every metric into the memory-mapped store")
+parser.add_argument('--metrics', '-m', nargs='+', default=['steps'],
+                    help="Intraday metrics to download with --detail_level 1min")
+parser.add_argument('--start_date', '-sd', default='2020-07-02',
+                    help="First day to download (YYYY-MM-DD)")
+parser.add_argument('--end_date', '-ed', default='2020-07-16',
+                    help="Last day to download, included (YYYY-MM-DD)")
 args = parser.parse_args()
 access_token = args.access_token
 refresh_token = args.refresh_token
 
 
-def append_to_csv(filename, df):
-    """Appends the steps data to an existing file.
-    If the file does not exist, it creates it.
-    """
-
-    # Write the header if the file does not exist.
-    should_write_header = not os.path.exists('{}.csv'.format(filename))
-    with open('{}.csv'.format(filename), 'a+') as f:
-        df.to_csv(f, header=should_write_header, index=False)
-
-
-def get_intraday_steps_data(client, start_date, end_date):
+def get_intraday_steps_data(client, start_date, end_date, fetcher=None):
     """Gets the intraday steps data from start_date to end_date.
     Mind that Fitbit API only allows for 150 requests per hour per
-    authorized user.
+    authorized user; the fetcher throttles the calls to that budget.
     """
 
-    start = datetime.datetime.strptime(start_date, '%Y-%m-%d')
-    end = datetime.datetime.strptime(end_date, '%Y-%m-%d')
-    delta = end - start
-    dates = [start + datetime.timedelta(days=i) for i in range(delta.days + 1)]
-    steps_data = []
+    dates = date_range(start_date, end_date)
+    fetcher = fetcher or DayFetcher(client)
 
-    for date in dates:
+    def fetch_day(c, date):
         print(date)
-        single_day_steps = client.intraday_time_series(
+        return c.intraday_time_series(
             'activities/steps', base_date=date, detail_level='15min')
+
+    responses = fetcher.map(fetch_day, dates)
+    steps_data = []
+
+    for date, single_day_steps in zip(dates, responses):
         for entry in single_day_steps.get('activities-steps-intraday').get('dataset'):
             steps_data.append((date, entry.get('time'), entry.get('value')))
 
     return pd.DataFrame(steps_data, columns=['date', 'time', 'value'])
 
 
+def get_intraday_minutes_data(client, metric, start_date, end_date,
+                               minute_store, fetcher=None):
+    """Downloads the 1 minute samples of metric (steps, calories, heart...)
+    from start_date to end_date into minute_store. Every day is written as
+    soon as its response arrives, so only the days in flight are held, and
+    the days already written are kept if the download stops halfway.
+    """
+
+    dates = date_range(start_date, end_date)
+    fetcher = fetcher or DayFetcher(client)
+
+    def fetch_day(c, date):
+        print(metric, date)
+        return c.intraday_time_series(
+            'activities/{}'.format(metric), base_date=date, detail_level='1min')
+
+    try:
+        for date, response in fetcher.imap(fetch_day, dates):
+            dataset = response.get(
+                'activities-{}-intraday'.format(metric)).get('dataset')
+            minute_store.write_day(date,
+                                   [entry.get('time') for entry in dataset],
+                                   [entry.get('value') for entry in dataset],
+                                   save=False)
+    finally:
+        # the index is written once for the whole batch
+        minute_store.save_index()
+
+
 if __name__ == "__main__":
     client = fitbit.Fitbit(os.environ['FITBIT_KEY'],
                            os.environ['FITBIT_SECRET'],
                            access_token=access_token,
                            refresh_token=refresh_token,
                            system='en_DE')
+    telemetry.start('fitbit_steps-get_steps_data')
+    telemetry.instrument_session(client.client.session, 'fitbit')
+    if args.cache:
+        client = CachedClient(client, ResponseCache('data/fitbit_cache.sqlite'))
+
+    if args.detail_level == '1min':
+        fetcher = DayFetcher(client)
+        for metric in args.metrics:
+            get_intraday_minutes_data(client, metric, args.start_date,
+                                      args.end_date, MinuteStore(metric),
+                                      fetcher)
+        sys.exit()
 
-    df = get_intraday_steps_data(client, '2020-07-02', '2020-07-16')
-    append_to_csv('data/steps_intraday', df)
+    df = get_intraday_steps_data(client, args.start_date, args.end_date)
+    if args.format == 'parquet':
+        store.append('steps_intraday', df)
+    else:
+        # the same days can be downloaded again, so rows are replaced, not
+        # appended twice
+        sync.upsert_csv('data/steps_intraday', df, ['date', 'time'])
@@ -0,0 +1,107 @@
+"""
+Resampling of the intraday steps, in place of the R aggregation that
+produced hourly_values_R.csv.
+
+data/steps_intraday.csv is read in chunks with compact types: the date and
+time strings are parsed once per distinct value (as categoricals) into a
+single datetime index, and the step counts are kept as int16. Only that
+series is kept across chunks, so memory doesn't grow with the size of the
+csv text. Samples downloaded more than once are kept once (the last one, like
+the store upserts). The hourly, daily and weekday x hour grids, and their
+rolling statistics, are derived from the series in a single pass.
+
+Usage:
+    python intraday.py data/steps_intraday.csv hourly_values.csv \\
+        --freq 15min --start 2019-07-09 --end 2019-08-02
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 500000
+
+
+def _parse(chunk):
+    """Turns a chunk of date, time and value columns into an int16 Series
+    with a datetime index.
+    """
+    date = chunk['date'].astype('category')
+    time = chunk['time'].astype('category')
+    days = pd.to_datetime(date.cat.categories).to_numpy()
+    offsets = pd.to_timedelta(time.cat.categories).to_numpy()
+    index = days[date.cat.codes.to_numpy()] + offsets[time.cat.codes.to_numpy()]
+    return pd.Series(chunk['value'].to_numpy(dtype=np.int16),
+                     index=pd.DatetimeIndex(index, name='ds'), name='y')
+
+
+def from_frame(df):
+    """The Series read() returns, from a frame with the date, time and value
+    columns, like the one store.read_compat('steps_intraday') gives.
+    """
+    series = _parse(df)
+    return series[~series.index.duplicated(keep='last')].sort_index()
+
+
+def read(path, chunksize=CHUNK_SIZE):
+    """Reads the intraday csv into an int16 Series of the steps of every
+    sample, indexed by time.
+    """
+    parts = []
+    dtype = {'date': 'string', 'time': 'string', 'value': np.int16}
+    for chunk in pd.read_csv(path, dtype=dtype, chunksize=chunksize):
+        part = _parse(chunk)
+        parts.append(part[~part.index.duplicated(keep='last')])
+    if not parts:
+        return pd.Series(dtype=np.int16, name='y',
+                         index=pd.DatetimeIndex([], name='ds'))
+    # a single concat, and the later chunks win like in the store upserts
+    series = pd.concat(parts)
+    return series[~series.index.duplicated(keep='last')].sort_index()
+
+
+def resample(series, freq):
+    """Steps per freq; int32, since the sums don't fit in int16."""
+    return series.astype(np.int32).resample(freq).sum()
+
+
+def grids(series):
+    """Returns the hourly and daily steps with rolling statistics, and the
+    mean steps per weekday (Monday is 0) and hour.
+    """
+    hourly = resample(series, 'h').to_frame('y')
+    hourly['rolling_mean_24h'] = hourly['y'].rolling(24, min_periods=1).mean()
+    daily = resample(series, 'D').to_frame('y')
+    daily['rolling_mean_7d'] = daily['y'].rolling(7, min_periods=1).mean()
+    daily['rolling_std_7d'] = daily['y'].rolling(7, min_periods=2).std()
+    index = hourly.index
+    weekday_hour = hourly['y'].groupby(
+        [index.weekday.rename('weekday'), index.hour.rename('hour')]).mean()
+    return hourly, daily, weekday_hour.unstack('hour')
+
+
+def prophet_frame(series, start=None, end=None):
+    """The ds, y frame Prophet expects, between the start and end dates
+    (both included, as YYYY-MM-DD strings).
+    """
+    if end is not None:
+        end = pd.Timestamp(end) + pd.Timedelta(days=1) - pd.Timedelta(1)
+    series = series.loc[start:end]
+    return pd.DataFrame({'ds': series.index, 'y': series.to_numpy()})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', help='intraday csv with date, time, value')
+    parser.add_argument('target', help='csv file with ds, y to write')
+    parser.add_argument('--freq', default='h',
+                        help='15min keeps the samples as they are')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    series = resample(read(args.source, args.chunksize), args.freq)
+    df = prophet_frame(series, args.start, args.end)
+    df.to_csv(args.target, index=False)
+    print('{} rows written to {}'.format(len(df), args.target))
@@ -1,21 +1,51 @@
 """
 This script fits a time series model using my Fitbit steps data.
 """
+import argparse
+import os
+import sys
+
 import matplotlib.pyplot as plt
-import pandas as pd
 import seaborn as sns
-from fbprophet import Prophet
+
+import intraday
+
+# the model cache lives with the 7-eleven-swarm scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '7-eleven-swarm'))
+import prophet_cache  # noqa: E402
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'fitbit'))
+import store  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--store', action='store_true',
+                    help='Read the samples from the columnar store of '
+                         'get_steps_data.py --format parquet instead of '
+                         'data/steps_intraday.csv')
+parser.add_argument('--store_dir', default=store.STORE_DIR)
+args = parser.parse_args()
 
 # setting the Seaborn aesthetics.
 sns.set()
 
-df = pd.read_csv('hourly_values_R.csv')
+# the same 15 minute samples hourly_values_R.csv has, without the round trip
+# through R
+if args.store:
+    steps = intraday.from_frame(store.read_compat(
+        'steps_intraday', '2019-07-09', '2019-08-02',
+        store_dir=args.store_dir))
+else:
+    steps = intraday.read('data/steps_intraday.csv')
+df = intraday.prophet_frame(intraday.resample(steps, '15min'),
+                            start='2019-07-09', end='2019-08-02')
 
 # the trend line is a bit underfit, so I'll increase changepoint_prior_scale
 # to 0.06 (from 0.05).
-m = Prophet(changepoint_prior_scale=0.06)
-m.fit(df)
-forecast = m.predict(df)
+# the fitted model and its forecast are cached, and reused until the data
+# changes
+m, forecast = prophet_cache.fit_predict(df, changepoint_prior_scale=0.06)
 fig = m.plot_components(forecast)
 # this plot shows the trend, weekly and daily seasonality.
 plt.show()
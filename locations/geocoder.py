@@ -0,0 +1,149 @@
+"""
+Offline reverse geocoder: tags lat/lon points with the country (and the
+city, if city polygons are available) they fall in.
+
+The full resolution polygons of countries.geojson are simplified once and
+kept in a compact binary cache (the names plus one WKB blob), which loads in
+a fraction of the time of parsing the GeoJSON. The polygons go into an
+STRtree, and whole arrays of points are matched against it in one call.
+Points that fall just outside every polygon because of the simplification
+(on the coast, mostly) get the nearest polygon within the tolerance.
+
+Usage:
+    python geocoder.py build data/countries.geojson data/countries.bin
+    python geocoder.py tag checkins.csv tagged.csv --lat lat --lon lng
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+COUNTRIES_GEOJSON = 'data/countries.geojson'
+COUNTRIES_CACHE = 'data/countries.bin'
+# degrees; about 1 km at the equator
+TOLERANCE = 0.01
+MAGIC = b'GEOC1'
+
+
+def build_cache(geojson_path, cache_path, name_field='ADMIN',
+                tolerance=TOLERANCE):
+    """Simplifies the polygons of geojson_path and writes them to
+    cache_path.
+    """
+    with open(geojson_path, encoding='utf-8') as f:
+        features = json.load(f)['features']
+    names = [feature['properties'][name_field] for feature in features]
+    geometries = [shape(feature['geometry']) for feature in features]
+    simplified = shapely.simplify(np.array(geometries, dtype=object),
+                                  tolerance, preserve_topology=True)
+    blobs = shapely.to_wkb(simplified)
+    offsets = np.cumsum([0] + [len(blob) for blob in blobs], dtype=np.int64)
+    header = json.dumps({'names': names, 'offsets': offsets.tolist(),
+                         'tolerance': tolerance}).encode('utf-8')
+    with open(cache_path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(cache_path + '.tmp', cache_path)
+
+
+def load_cache(cache_path):
+    """Returns the names, the polygons and the simplification tolerance."""
+    with open(cache_path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a geocoder cache'.format(cache_path))
+        size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(size).decode('utf-8'))
+        data = f.read()
+    offsets = header['offsets']
+    blobs = [data[start:end] for start, end in zip(offsets, offsets[1:])]
+    return header['names'], shapely.from_wkb(blobs), header['tolerance']
+
+
+def load_polygons(cache_path=COUNTRIES_CACHE, geojson_path=COUNTRIES_GEOJSON,
+                  name_field='ADMIN'):
+    """Like load_cache, building the cache first if it's missing or older
+    than the GeoJSON.
+    """
+    if not os.path.exists(cache_path) or (
+            os.path.exists(geojson_path) and
+            os.path.getmtime(geojson_path) > os.path.getmtime(cache_path)):
+        build_cache(geojson_path, cache_path, name_field)
+    return load_cache(cache_path)
+
+
+class PolygonIndex:
+    """STRtree over named polygons."""
+
+    def __init__(self, names, polygons, tolerance=TOLERANCE):
+        self.names = np.array(list(names) + [None], dtype=object)
+        self.polygons = polygons
+        self.tolerance = tolerance
+        self.tree = shapely.STRtree(polygons)
+
+    @classmethod
+    def from_cache(cls, cache_path):
+        return cls(*load_cache(cache_path))
+
+    def lookup(self, lats, lons):
+        """Returns the name of the polygon of every point, or None."""
+        points = shapely.points(np.asarray(lons, dtype=float),
+                                np.asarray(lats, dtype=float))
+        found = np.full(len(points), len(self.polygons))
+        point_index, polygon_index = self.tree.query(points,
+                                                     predicate='intersects')
+        # a point on a border matches both sides; keep the first one
+        found[point_index[::-1]] = polygon_index[::-1]
+        missing = np.flatnonzero(found == len(self.polygons))
+        if len(missing):
+            point_index, polygon_index = self.tree.query_nearest(
+                points[missing], max_distance=self.tolerance * 2,
+                all_matches=False)
+            found[missing[point_index]] = polygon_index
+        return self.names[found]
+
+
+class ReverseGeocoder:
+    def __init__(self, countries_cache=COUNTRIES_CACHE, cities_cache=None):
+        self.countries = PolygonIndex.from_cache(countries_cache)
+        self.cities = PolygonIndex.from_cache(cities_cache) \
+            if cities_cache is not None else None
+
+    def tag(self, df, lat='lat', lon='lon'):
+        """Returns a copy of df with country (and city) columns."""
+        df = df.copy()
+        df['country'] = self.countries.lookup(df[lat], df[lon])
+        if self.cities is not None:
+            df['city'] = self.cities.lookup(df[lat], df[lon])
+        return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='Build a polygon cache')
+    build.add_argument('geojson')
+    build.add_argument('cache')
+    build.add_argument('--name_field', default='ADMIN')
+    build.add_argument('--tolerance', type=float, default=TOLERANCE)
+    tag = subparsers.add_parser('tag', help='Tag the points of a csv')
+    tag.add_argument('source')
+    tag.add_argument('target')
+    tag.add_argument('--lat', default='lat')
+    tag.add_argument('--lon', default='lon')
+    tag.add_argument('--countries', default=COUNTRIES_CACHE)
+    tag.add_argument('--cities', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_cache(args.geojson, args.cache, args.name_field, args.tolerance)
+    else:
+        geocoder = ReverseGeocoder(args.countries, args.cities)
+        geocoder.tag(pd.read_csv(args.source), args.lat, args.lon).to_csv(
+            args.target, index=False)
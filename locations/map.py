@@ -2,11 +2,19 @@ import matplotlib.pyplot as plt
 import geopandas as gpd
 import pandas as pd
 
+import geocoder
+
 
 def load_data():
     df = pd.read_csv('data/places.csv')
     # Countries data taken and modified from https://github.com/datasets/geo-countries
-    c = gpd.read_file('data/countries.geojson')
+    # and read from the simplified cache built from it on the first run
+    names, polygons, tolerance = geocoder.load_polygons()
+    c = gpd.GeoDataFrame({'ADMIN': names}, geometry=polygons, crs='EPSG:4326')
+    if 'Country' not in df.columns:
+        # places with coordinates only are tagged offline
+        index = geocoder.PolygonIndex(names, polygons, tolerance)
+        df['Country'] = index.lookup(df['lat'], df['lon'])
     grouped = df.groupby(['Country']).size().reset_index(name='n')
 
     merged_df = c.merge(grouped, how='inner',
@@ -0,0 +1,286 @@
+"""
+Runs the scripts of the repository as a pipeline of stages.
+
+A Stage is a command run in a directory of the repository, with the files
+it reads (inputs) and writes (outputs), all relative to the repository. A
+stage that reads what another one writes runs after it; the stages that
+don't depend on each other run in parallel, so a full run takes about as
+long as the longest chain of stages.
+
+A stage is skipped when its command, its scripts and the content of its
+inputs are the same as on its last successful run and its outputs exist.
+The hashes are saved in .pipeline_state.json after every stage, so a run
+that failed halfway resumes from the stages that failed (and the ones
+after them) when started again. Fetch stages, which download from an API,
+only run with fetch=True (or when their outputs are missing); the stages
+after them run again only if the downloaded data changed.
+
+Stages can name the resources they use, like an API quota; two stages
+that share a resource never run at the same time.
+
+The output of every stage goes to logs/<stage>.log next to this file.
+"""
+import hashlib
+import json
+import os
+import string
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(PIPELINE_DIR, '.pipeline_state.json')
+LOG_DIR = os.path.join(PIPELINE_DIR, 'logs')
+SCRIPT_EXTENSIONS = ('.py', '.R', '.Rmd')
+
+
+class Stage:
+    """A command run in cwd. Arguments can use $VARIABLES of the
+    environment; the scripts among the arguments count as inputs. Stages
+    that share one of their resources run one after the other.
+    """
+
+    def __init__(self, name, cwd, cmd, inputs=(), outputs=(), fetch=False,
+                 resources=()):
+        self.name = name
+        self.cwd = cwd
+        self.cmd = list(cmd)
+        self.inputs = list(inputs) + [
+            os.path.normpath(os.path.join(cwd, arg)) for arg in self.cmd
+            if arg.endswith(SCRIPT_EXTENSIONS) and
+            os.path.exists(os.path.join(REPO_DIR, cwd, arg))]
+        self.outputs = list(outputs)
+        self.fetch = fetch
+        self.resources = set(resources)
+
+    def __repr__(self):
+        return 'Stage({!r})'.format(self.name)
+
+
+def _within(path, directory):
+    return path == directory or path.startswith(directory.rstrip('/') + '/')
+
+
+def dependencies(stages):
+    """The names of the stages every stage has to wait for."""
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError('{} is written by {} and {}'.format(
+                    output, producers[output], stage.name))
+            producers[output] = stage.name
+    deps = {}
+    for stage in stages:
+        deps[stage.name] = {producers[output] for path in stage.inputs
+                            for output in producers
+                            if _within(path, output)} - {stage.name}
+    # a cycle would leave stages waiting forever
+    done, pending = set(), set(deps)
+    while pending:
+        ready = {name for name in pending if deps[name] <= done}
+        if not ready:
+            raise ValueError('stages depend on each other: {}'.format(
+                ', '.join(sorted(pending))))
+        done |= ready
+        pending -= ready
+    return deps
+
+
+def upstream(stages, targets):
+    """The stages of targets and all the stages they depend on."""
+    deps = dependencies(stages)
+    needed, queue = set(), list(targets)
+    while queue:
+        name = queue.pop()
+        if name not in deps:
+            raise ValueError('no stage named {}'.format(name))
+        if name not in needed:
+            needed.add(name)
+            queue.extend(deps[name])
+    return [stage for stage in stages if stage.name in needed]
+
+
+def _files(path):
+    full = os.path.join(REPO_DIR, path)
+    if not os.path.isdir(full):
+        return [path]
+    return sorted(os.path.relpath(os.path.join(root, name), REPO_DIR)
+                  for root, _, names in os.walk(full) for name in names)
+
+
+def file_hash(path, files):
+    """sha1 of the file at path, reused from files while its size and mtime
+    are the same.
+    """
+    stat = os.stat(os.path.join(REPO_DIR, path))
+    known = files.get(path)
+    if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return known[2]
+    h = hashlib.sha1()
+    with open(os.path.join(REPO_DIR, path), 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    files[path] = [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+    return files[path][2]
+
+
+def stage_key(stage, files):
+    h = hashlib.sha1(json.dumps([stage.cwd, stage.cmd]).encode())
+    for path in stage.inputs:
+        for name in _files(path):
+            h.update(name.encode())
+            h.update(file_hash(name, files).encode())
+    return h.hexdigest()
+
+
+def _outputs_exist(stage):
+    return all(os.path.exists(os.path.join(REPO_DIR, path))
+               for path in stage.outputs)
+
+
+def _load_state(path):
+    if not os.path.exists(path):
+        return {'files': {}, 'stages': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state(state, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def run_stage(stage):
+    """Runs the command of stage and returns its exit code and seconds."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    started = time.perf_counter()
+    with open(os.path.join(LOG_DIR, stage.name + '.log'), 'w') as log:
+        try:
+            cmd = [string.Template(arg).substitute(os.environ)
+                   for arg in stage.cmd]
+        except KeyError as e:
+            log.write('Missing environment variable {}\n'.format(e))
+            return 1, 0.0
+        # the plotting scripts would otherwise wait on plt.show()
+        env = dict(os.environ, MPLBACKEND='Agg')
+        process = subprocess.run(cmd, cwd=os.path.join(REPO_DIR, stage.cwd),
+                                 stdout=log, stderr=subprocess.STDOUT, env=env)
+    return process.returncode, time.perf_counter() - started
+
+
+def _outdated(stage, state, fetch, force):
+    """The key of stage if it has to run, else None."""
+    key = stage_key(stage, state['files'])
+    previous = state['stages'].get(stage.name, {})
+    if force or not _outputs_exist(stage) or (stage.fetch and fetch):
+        return key
+    if not stage.fetch and previous.get('key') != key:
+        return key
+    return None
+
+
+def critical_path(stages, seconds):
+    """The chain of stages with the most seconds in total, and its seconds."""
+    deps = dependencies(stages)
+    longest = {}
+
+    def chain(name):
+        if name not in longest:
+            before = max((chain(dep) for dep in deps[name]),
+                         key=lambda c: c[1], default=([], 0.0))
+            longest[name] = (before[0] + [name],
+                             before[1] + seconds.get(name, 0.0))
+        return longest[name]
+
+    return max((chain(stage.name) for stage in stages), key=lambda c: c[1],
+               default=([], 0.0))
+
+
+def run(stages, workers=None, fetch=False, force=False, dry_run=False,
+        state_file=STATE_FILE):
+    """Runs the stages that are out of date and returns the names of the
+    ones that failed or couldn't run.
+    """
+    deps = dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    state = _load_state(state_file)
+    status = {}
+    running = {}
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=workers or len(stages) or 1)
+    try:
+        while len(status) < len(stages):
+            for name, stage in by_name.items():
+                if name in status or name in running.values():
+                    continue
+                if any(status.get(dep) in ('failed', 'blocked')
+                       for dep in deps[name]):
+                    status[name] = 'blocked'
+                    print('{:<28} blocked'.format(name))
+                    continue
+                if not all(status.get(dep) in ('ok', 'skipped', 'dry-run')
+                           for dep in deps[name]):
+                    continue
+                if any(status[dep] == 'dry-run' for dep in deps[name]):
+                    # its inputs would change, or don't exist yet
+                    status[name] = 'dry-run'
+                    print('{:<28} would run'.format(name))
+                    continue
+                try:
+                    key = _outdated(stage, state, fetch, force)
+                except FileNotFoundError as e:
+                    status[name] = 'failed'
+                    print('{:<28} missing input {}'.format(
+                        name, os.path.relpath(e.filename, REPO_DIR)))
+                    continue
+                if key is None:
+                    status[name] = 'skipped'
+                    print('{:<28} unchanged'.format(name))
+                elif dry_run:
+                    status[name] = 'dry-run'
+                    print('{:<28} would run'.format(name))
+                elif stage.resources & {resource for other in running.values()
+                                        for resource in by_name[other].resources}:
+                    # waits for the stage that holds the resource
+                    continue
+                else:
+                    print('{:<28} running'.format(name), flush=True)
+                    future = executor.submit(run_stage, stage)
+                    future.key = key
+                    running[future] = name
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                code, seconds = future.result()
+                if code == 0:
+                    status[name] = 'ok'
+                    state['stages'][name] = {'key': future.key,
+                                             'seconds': seconds}
+                    print('{:<28} done in {:.1f}s'.format(name, seconds))
+                else:
+                    status[name] = 'failed'
+                    # its outputs may be half written
+                    state['stages'].pop(name, None)
+                    print('{:<28} failed ({}), see logs/{}.log'.format(
+                        name, code, name))
+                # saved after every stage, so a failed run can resume
+                _save_state(state, state_file)
+    finally:
+        executor.shutdown()
+        _save_state(state, state_file)
+
+    elapsed = time.perf_counter() - started
+    seconds = {name: state['stages'].get(name, {}).get('seconds', 0.0)
+               for name in by_name}
+    chain, chain_seconds = critical_path(stages, seconds)
+    print('{} stages in {:.1f}s; all of them one after the other take '
+          '{:.1f}s, the longest chain ({}) {:.1f}s'.format(
+              len(stages), elapsed, sum(seconds.values()),
+              ' > '.join(chain), chain_seconds))
+    return sorted(name for name, s in status.items()
+                  if s in ('failed', 'blocked'))
@@ -0,0 +1,190 @@
+"""
+The scripts of the repository and the files they pass to each other, as
+stages of runner.py.
+
+The API credentials come from the environment:
+    FOURSQUARE_CLIENT_ID, FOURSQUARE_CLIENT_SECRET, FOURSQUARE_ACCESS_CODE
+    FITBIT_KEY, FITBIT_SECRET, ACCESS_TOKEN, REFRESH_TOKEN
+    GOOGLE_MAPS_KEY
+
+Usage (from anywhere; the paths are relative to the repository):
+    python pipeline/stages.py                   # what changed since last run
+    python pipeline/stages.py --fetch           # the nightly refresh
+    python pipeline/stages.py swarmapp-render   # a stage and what it needs
+    python pipeline/stages.py --dry_run --fetch
+    python pipeline/stages.py --list
+"""
+import argparse
+import datetime
+import sys
+
+import runner
+from runner import Stage
+
+# the fetch scripts stop the day before their end date
+TODAY = datetime.date.today()
+TOMORROW = (TODAY + datetime.timedelta(days=1)).isoformat()
+# the intraday steps of the last days are fetched again, since they keep
+# syncing from the device for a while (like sync.OVERLAP_DAYS)
+STEPS_DAYS = ['--start_date', (TODAY - datetime.timedelta(days=3)).isoformat(),
+              '--end_date', TODAY.isoformat()]
+FOURSQUARE = ['--end_date', TOMORROW,
+              '--client_id', '$FOURSQUARE_CLIENT_ID',
+              '--client_secret', '$FOURSQUARE_CLIENT_SECRET',
+              '--access_code', '$FOURSQUARE_ACCESS_CODE']
+FITBIT_TOKENS = ['--access_token', '$ACCESS_TOKEN',
+                 '--refresh_token', '$REFRESH_TOKEN']
+# the Fitbit scripts share the 150 requests per hour of one user; each one
+# throttles itself, but two at once would run the quota out
+FITBIT_API = ['fitbit-api']
+
+
+def notebook(name, cwd, rmd, inputs=(), outputs=(), knit_root_dir='.'):
+    """A stage that knits an R Markdown notebook."""
+    expression = "rmarkdown::render('{}', knit_root_dir='{}', quiet=TRUE)" \
+        .format(rmd, knit_root_dir)
+    return Stage(name, cwd, ['Rscript', '-e', expression],
+                 [cwd + '/' + rmd] + list(inputs), outputs)
+
+
+STAGES = [
+    # swarmapp: check-ins -> subcategories -> decision tree -> figures
+    Stage('swarmapp-fetch', 'swarmapp',
+          ['python', 'get_data.py'] + FOURSQUARE,
+          ['swarmapp/checkins.py'],
+          ['swarmapp/data/checkins.ndjson', 'swarmapp/data/checkins.json'],
+          fetch=True),
+    notebook('swarmapp-categories', 'swarmapp', 'categories.Rmd',
+             ['swarmapp/data/checkins.json',
+              'locations/data/countries_iso_2.csv'],
+             ['swarmapp/model/subcategories.csv'], knit_root_dir='model'),
+    Stage('swarmapp-tree', 'swarmapp/model', ['python', 'decision_tree.py'],
+          ['swarmapp/model/subcategories.csv'],
+          ['swarmapp/model/decision_tree_051220.joblib',
+           'swarmapp/model/encoder_051220.joblib']),
+    Stage('swarmapp-train', 'swarmapp/model',
+          ['python', 'train.py', '../data/checkins.ndjson'],
+          ['swarmapp/data/checkins.ndjson', 'swarmapp/model/predict.py',
+           'swarmapp/model/decision_tree.py'],
+          ['swarmapp/model/artifacts/LATEST']),
+    Stage('swarmapp-render', 'render',
+          ['python', 'jobs.py', '--only', 'swarmapp'],
+          ['render/render.py', 'swarmapp/model/decision_tree.py',
+           'swarmapp/model/decision_tree_051220.joblib',
+           'swarmapp/model/subcategories.csv'],
+          ['swarmapp/whole_tree_high_dpi.png',
+           'swarmapp/tree_high_dpi_max_depth_3.png']),
+
+    # 7-eleven-swarm: check-ins -> start times -> outlier detector -> figures
+    Stage('7-eleven-fetch', '7-eleven-swarm',
+          ['python', 'get_data.py'] + FOURSQUARE,
+          ['swarmapp/checkins.py'],
+          ['7-eleven-swarm/data/checkins.ndjson',
+           '7-eleven-swarm/data/checkins.json'],
+          fetch=True),
+    notebook('7-eleven-notebook', '7-eleven-swarm', 'notebook.Rmd',
+             ['7-eleven-swarm/data/checkins.json',
+              '7-eleven-swarm/data/locations.csv'],
+             ['7-eleven-swarm/ts_df.csv', '7-eleven-swarm/data/start_times.csv']),
+    Stage('7-eleven-detector', '7-eleven-swarm',
+          ['python', 'outlier_detection.py'],
+          ['7-eleven-swarm/data/start_times.csv'],
+          ['7-eleven-swarm/data/checkins_detector.joblib']),
+    Stage('7-eleven-render', 'render',
+          ['python', 'jobs.py', '--only', '7-eleven-swarm'],
+          ['render/render.py', '7-eleven-swarm/outlier_detection.py',
+           '7-eleven-swarm/decision_surface.py',
+           '7-eleven-swarm/ts.py', '7-eleven-swarm/prophet_cache.py',
+           '7-eleven-swarm/data/start_times.csv',
+           '7-eleven-swarm/data/checkins_detector.joblib',
+           '7-eleven-swarm/ts_df.csv'],
+          ['7-eleven-swarm/plots/decision_boundary.png',
+           '7-eleven-swarm/plots/ts_components.png']),
+
+    # Fitbit
+    Stage('fitbit-fetch', 'fitbit',
+          ['python', 'get_data.py', '--sync'] + FITBIT_TOKENS,
+          ['fitbit/common.py', 'fitbit/sync.py', 'fitbit/store.py'],
+          ['fitbit/data'], fetch=True, resources=FITBIT_API),
+    Stage('steps-fetch', 'fitbit_steps',
+          ['python', 'get_steps_data.py'] + STEPS_DAYS + FITBIT_TOKENS,
+          ['fitbit/fetcher.py', 'fitbit/sync.py'],
+          ['fitbit_steps/data/steps_intraday.csv'], fetch=True,
+          resources=FITBIT_API),
+    Stage('steps-time-series', 'fitbit_steps',
+          ['python', 'steps_time_series.py'],
+          ['fitbit_steps/data/steps_intraday.csv',
+           'fitbit_steps/intraday.py', 'fitbit/store.py',
+           '7-eleven-swarm/prophet_cache.py']),
+    Stage('sleep-fetch', 'fitbit-sleep', ['python', 'get_data.py'],
+          outputs=['fitbit-sleep/data/df.csv'], fetch=True,
+          resources=FITBIT_API),
+    notebook('sleep-notebook', 'fitbit-sleep', 'notebook.Rmd',
+             ['fitbit-sleep/data/df.csv'],
+             ['fitbit-sleep/data/start_times.csv']),
+    Stage('sleep-detector', 'fitbit-sleep', ['python', 'outliers-detection.py'],
+          ['fitbit-sleep/data/start_times.csv', 'fitbit-sleep/one_class.py'],
+          ['fitbit-sleep/data/sleep_detector.joblib']),
+    # the scripts below read the csv files, not the columnar store (that
+    # takes --store); decimal_start.csv and time_in_bed.csv are exports kept
+    # in the repository, so no stage comes before these two
+    Stage('sleep-start-time-series', 'fitbit-sleep',
+          ['python', 'start_time_ts.py'],
+          ['fitbit-sleep/data/decimal_start.csv', 'fitbit-sleep/one_class.py',
+           '7-eleven-swarm/prophet_cache.py']),
+    Stage('sleep-time-asleep-series', 'fitbit-sleep',
+          ['python', 'time_asleep_ts.py'],
+          ['fitbit-sleep/data/time_in_bed.csv',
+           '7-eleven-swarm/prophet_cache.py']),
+
+    # places-summarized, which renders its figures itself
+    Stage('places-fetch', 'places-summarized',
+          ['python', 'main.py', '--key', '$GOOGLE_MAPS_KEY',
+           '--locations', 'locations.csv'],
+          ['places-summarized/locations.csv', 'places-summarized/batch.py',
+           'places-summarized/figures.py'],
+          ['places-summarized/places_summary.parquet'], fetch=True),
+
+    # unsupervised-city-planning
+    Stage('hongkong-clustering', 'unsupervised-city-planning/hongkong',
+          ['python', 'clustering.py'],
+          ['unsupervised-city-planning/hongkong/data/coordinates.csv',
+           'unsupervised-city-planning/geo_clustering.py'],
+          ['unsupervised-city-planning/hongkong/data/cluster_labels.csv',
+           'unsupervised-city-planning/hongkong/data/cluster_summary.csv']),
+
+    Stage('background-sensors', 'background_sensors', ['make', 'script'],
+          ['background_sensors/script.R', 'background_sensors/Makefile']),
+]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('targets', nargs='*',
+                        help='Stages to bring up to date, with the ones they '
+                             'depend on; all of them by default')
+    parser.add_argument('--fetch', action='store_true',
+                        help='Download new data from the APIs')
+    parser.add_argument('--force', action='store_true',
+                        help='Run every stage, changed or not')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Stages to run at once')
+    parser.add_argument('--dry_run', action='store_true',
+                        help="Only print what would run")
+    parser.add_argument('--list', action='store_true',
+                        help='Print the stages and what they wait for')
+    args = parser.parse_args()
+
+    if args.list:
+        deps = runner.dependencies(STAGES)
+        for stage in STAGES:
+            print('{:<28} {}'.format(stage.name,
+                                     ', '.join(sorted(deps[stage.name]))))
+        sys.exit(0)
+
+    stages = runner.upstream(STAGES, args.targets) if args.targets else STAGES
+    failed = runner.run(stages, args.jobs, args.fetch, args.force,
+                        args.dry_run)
+    if failed:
+        print('Not up to date: {}'.format(', '.join(failed)))
+    sys.exit(1 if failed else 0)
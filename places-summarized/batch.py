@@ -0,0 +1,189 @@
+"""
+Places summaries of many locations at once.
+
+The locations file is a csv with a location ("latitude,longitude"), a radius
+in metres, how many extra pages to get and, optionally, a name:
+
+    name,location,radius,pages
+    Bali,"-8.6465434,115.1367221",1000,2
+
+The locations are summarized concurrently. A next_page_token only becomes
+valid a couple of seconds after it is issued, so instead of sleeping a fixed
+5 seconds the next page is asked for right away and retried with a short
+backoff until Google accepts the token. Every raw response is cached by
+(location, radius, page), so running the batch again costs no requests.
+
+The summaries are written to a single Parquet table with one row per
+location.
+
+Usage:
+    python main.py --key KEY --locations locations.csv
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import googlemaps
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from places_summarized.summary import Summary
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
+
+CACHE_FILE = 'places_cache.sqlite'
+# places change, so responses are only reused for a week
+CACHE_TTL = 7 * 24 * 3600
+MAX_WORKERS = 4
+# seconds between tries of a page token that isn't valid yet
+TOKEN_RETRY = 0.5
+TOKEN_TIMEOUT = 20
+
+
+class PagesCache:
+    """Raw places_nearby responses by (location, radius, page)."""
+
+    def __init__(self, path=CACHE_FILE, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pages ('
+                          'location TEXT, radius INTEGER, page INTEGER, '
+                          'response TEXT, fetched_at REAL, '
+                          'PRIMARY KEY (location, radius, page))')
+        self.conn.commit()
+
+    def get(self, location, radius, page):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT response, fetched_at FROM pages WHERE location = ? '
+                'AND radius = ? AND page = ?',
+                (location, radius, page)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, location, radius, page, response):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+                (location, radius, page, json.dumps(response), time.time()))
+            self.conn.commit()
+
+
+def read_locations(path):
+    df = pd.read_csv(path, dtype={'location': str})
+    if 'radius' not in df.columns:
+        df['radius'] = 1000
+    if 'pages' not in df.columns:
+        df['pages'] = 0
+    return df
+
+
+def _next_page(client, token):
+    """Asks for the page of token as soon as Google accepts it."""
+    deadline = time.monotonic() + TOKEN_TIMEOUT
+    delay = TOKEN_RETRY
+    while True:
+        try:
+            return client.places_nearby(page_token=token)
+        except googlemaps.exceptions.ApiError as e:
+            # a token that isn't valid yet is an INVALID_REQUEST
+            if e.status != 'INVALID_REQUEST' or time.monotonic() > deadline:
+                raise
+            telemetry.METRICS.retry('google_maps', e.status)
+        time.sleep(delay)
+        delay = min(delay * 1.5, 2.0)
+
+
+def summarize(client, cache, location, radius, pages, use_cached=True):
+    """Returns the Summary of location with up to pages extra pages."""
+    summary = None
+    cached = False
+    for page in range(pages + 1):
+        response = cache.get(location, radius, page) \
+            if cache is not None and use_cached else None
+        if response is None:
+            if page == 0:
+                response = client.places_nearby(location=location,
+                                                radius=radius)
+            else:
+                try:
+                    response = _next_page(client, summary.next_page_token)
+                except googlemaps.exceptions.ApiError:
+                    if not cached:
+                        raise
+                    # the token of a cached page has expired by now
+                    return summarize(client, cache, location, radius, pages,
+                                     use_cached=False)
+            if cache is not None:
+                cache.put(location, radius, page, response)
+        else:
+            cached = True
+        if summary is None:
+            summary = Summary(response, location)
+            summary._make_summary()
+        else:
+            summary._add_more_results(response)
+        if summary.next_page_token is None:
+            break
+    return summary
+
+
+def run(client, locations, cache=None, max_workers=MAX_WORKERS):
+    """Summarizes every row of the locations DataFrame concurrently and
+    returns the summaries in the same order.
+    """
+    rows = list(locations[['location', 'radius', 'pages']].itertuples(
+        index=False))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(summarize, client, cache, location,
+                                   int(radius), int(pages))
+                   for location, radius, pages in rows]
+    return [future.result() for future in futures]
+
+
+SCHEMA = pa.schema([
+    ('name', pa.string()),
+    ('location', pa.string()),
+    ('radius', pa.int64()),
+    ('number_locations', pa.int64()),
+    ('average_rating', pa.float64()),
+    ('average_user_ratings_total', pa.float64()),
+    ('average_price_level', pa.float64()),
+    ('ratings', pa.list_(pa.float64())),
+    ('user_ratings_total', pa.list_(pa.int64())),
+    ('price_levels', pa.list_(pa.int64())),
+    ('location_types', pa.map_(pa.string(), pa.int64())),
+])
+
+
+def write_table(locations, summaries, path):
+    """Writes the summary.result() of every location to one Parquet table."""
+    names = locations['name'] if 'name' in locations.columns \
+        else locations['location']
+    records = []
+    for name, radius, summary in zip(names, locations['radius'], summaries):
+        r = summary.result()
+        records.append({
+            'name': name,
+            'location': summary.location,
+            'radius': int(radius),
+            'number_locations': r['number_locations'],
+            'average_rating': r.get('average_rating'),
+            'average_user_ratings_total': r.get('average_user_ratings_total'),
+            'average_price_level': r.get('average_price_level'),
+            'ratings': r['ratings'],
+            'user_ratings_total': r['user_ratings_total'],
+            'price_levels': r['price_levels'],
+            'location_types': list(r['location_types'].items()),
+        })
+    table = pa.Table.from_pylist(records, schema=SCHEMA)
+    pq.write_table(table, path + '.tmp')
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,114 @@
+"""
+The plots of a places summary, one function per figure. Each takes the
+summary.result() dict and the location and returns its Figure.
+"""
+import matplotlib.pyplot as plt
+import pandas as pd
+import pyarrow.parquet as pq
+import seaborn as sns
+
+# Set Seaborn's color palette.
+sns.set_color_codes()
+
+SAVE = {'dpi': 320, 'orientation': 'landscape'}
+
+
+def has_prices(r):
+    prices = r['price_levels']
+    # if there is more than one price, and they are not all the same
+    return len(prices) > 1 and len(set(prices)) > 1
+
+
+def ratings(r, location):
+    # Plot histogram of ratings
+    fig = plt.figure()
+    sns.distplot(r['ratings']).set_title(
+        'Ratings of locations from {}'.format(location))
+    return fig
+
+
+def price_levels(r, location):
+    # Plot the price levels
+    fig = plt.figure()
+    sns.distplot(r['price_levels']).set_title(
+        'Prices levels of locations from {}'.format(location))
+    return fig
+
+
+def user_ratings_total(r, location):
+    # Plot user_ratings_total
+    fig = plt.figure()
+    sns.distplot(r['user_ratings_total']).set_title(
+        'Total user ratings of locations from {}'.format(location))
+    return fig
+
+
+def _types_df(r):
+    df = pd.DataFrame.from_dict(r['location_types'], orient='index')
+    df.index.name = 'location'
+    df.reset_index(inplace=True)
+    df.rename(columns={0: 'val'}, inplace=True)
+    # Remove the row with point_of_interest and establishment location
+    return df[(df.location != 'point_of_interest') &
+              (df.location != 'establishment')]
+
+
+def types(r, location):
+    # Plot location_types
+    df = _types_df(r)
+    fig = plt.figure(figsize=(16, 11))
+    sns.barplot(x="location", y="val", data=df, order=df.sort_values(
+        'val', ascending=False)['location']).set_title('Location types from {}'.format(location))
+    plt.xticks(rotation=45)
+    plt.subplots_adjust(bottom=0.15)
+    return fig
+
+
+def location_percentage(r, location):
+    # Plot the location percentage
+    df = _types_df(r)
+    df['location_percentage'] = (df.val / r['number_locations']) * 100
+    fig = plt.figure(figsize=(16, 11))
+    sns.barplot(x="location", y="location_percentage", data=df, order=df.sort_values(
+        'val', ascending=False)['location']).set_title('Location percentage types from {}'.format(location))
+    plt.xticks(rotation=45)
+    return fig
+
+
+FIGURES = {
+    'ratings': ratings,
+    'price_levels': price_levels,
+    'user_ratings_total': user_ratings_total,
+    'types': types,
+    'location_percentage': location_percentage,
+}
+
+
+def output(location, kind):
+    return '{}_{}.png'.format(location, kind)
+
+
+def plot(r, location):
+    """Draws and saves every figure of the summary, one after the other."""
+    for kind, figure in FIGURES.items():
+        if kind == 'price_levels' and not has_prices(r):
+            continue
+        figure(r, location).savefig(output(location, kind), **SAVE)
+        plt.close('all')
+
+
+def read_results(path):
+    """The summary.result() dicts of a table written by batch.write_table,
+    by location.
+    """
+    results = {}
+    for row in pq.read_table(path).to_pylist():
+        row['location_types'] = dict(row['location_types'])
+        results[row['location']] = row
+    return results
+
+
+def table_figure(inputs, location, kind):
+    """Render job: figure kind of location from the summaries table."""
+    r = read_results(inputs[0])[location]
+    return FIGURES[kind](r, location)
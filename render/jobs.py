@@ -0,0 +1,98 @@
+"""
+The figures of the repository as render jobs.
+
+Usage (from anywhere; the paths are relative to the repository):
+    python render/jobs.py
+    python render/jobs.py --only swarmapp 7-eleven-swarm --workers 4
+    python render/jobs.py --force
+"""
+import argparse
+import os
+import sys
+
+import render
+from render import REPO_DIR, Job
+
+SWARMAPP_MODEL = 'swarmapp/model/decision_tree_051220.joblib'
+SWARMAPP_DATA = 'swarmapp/model/subcategories.csv'
+PLACES_TABLE = 'places-summarized/places_summary.parquet'
+
+
+def _import_from(directory):
+    path = os.path.join(REPO_DIR, directory)
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+def places_jobs(table=PLACES_TABLE, out_dir='places-summarized'):
+    """Five figures per location of a table written by batch.write_table."""
+    _import_from('places-summarized')
+    import figures
+    if not os.path.exists(os.path.join(REPO_DIR, table)):
+        print('{} not found, run main.py --locations first'.format(table))
+        return []
+    jobs = []
+    for location, r in figures.read_results(
+            os.path.join(REPO_DIR, table)).items():
+        for kind in figures.FIGURES:
+            if kind == 'price_levels' and not figures.has_prices(r):
+                continue
+            jobs.append(Job(os.path.join(out_dir,
+                                         figures.output(location, kind)),
+                            figures.table_figure, [table],
+                            {'location': location, 'kind': kind},
+                            figures.SAVE))
+    return jobs
+
+
+def swarmapp_jobs():
+    """The whole decision tree and its first three levels."""
+    _import_from('swarmapp/model')
+    import decision_tree
+    inputs = [SWARMAPP_MODEL, SWARMAPP_DATA]
+    return [
+        Job('swarmapp/whole_tree_high_dpi.png',
+            decision_tree.plot_tree_figure, inputs,
+            {'figsize': [50, 24], 'fontsize': 6}, {'dpi': 100}),
+        Job('swarmapp/tree_high_dpi_max_depth_3.png',
+            decision_tree.plot_tree_figure, inputs,
+            {'figsize': [30, 20], 'fontsize': 14, 'max_depth': 3,
+             'labels': True}, {'dpi': 100}),
+    ]
+
+
+def seven_eleven_jobs():
+    """The check-ins decision boundary and the time series components."""
+    _import_from('7-eleven-swarm')
+    import outlier_detection
+    import ts
+    return [
+        Job('7-eleven-swarm/plots/decision_boundary.png',
+            outlier_detection.boundary_figure,
+            ['7-eleven-swarm/data/start_times.csv',
+             '7-eleven-swarm/data/checkins_detector.joblib',
+             '7-eleven-swarm/decision_surface.py']),
+        Job('7-eleven-swarm/plots/ts_components.png', ts.components_figure,
+            ['7-eleven-swarm/ts_df.csv', '7-eleven-swarm/prophet_cache.py']),
+    ]
+
+
+GROUPS = {
+    'places-summarized': places_jobs,
+    'swarmapp': swarmapp_jobs,
+    '7-eleven-swarm': seven_eleven_jobs,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', nargs='+', choices=sorted(GROUPS),
+                        default=sorted(GROUPS))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true',
+                        help="Render every figure, changed or not")
+    args = parser.parse_args()
+
+    jobs = [job for group in args.only for job in GROUPS[group]()]
+    failed = render.render(jobs, args.workers, args.force)
+    sys.exit(1 if failed else 0)
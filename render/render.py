@@ -0,0 +1,162 @@
+"""
+Headless, parallel rendering of the figures of the scripts.
+
+Every figure is a Job: the function that draws it, the data files it reads
+(inputs), its plotting parameters (params) and the savefig arguments (save).
+The jobs are rendered with the Agg backend across a process pool, so a full
+regeneration takes about as long as the slowest figure. The slowest figures
+of the last run are started first.
+
+A figure is only rendered again when its inputs, params, save arguments or
+the module that defines its function changed since the last render, or when
+the output file is missing. Helpers imported from other modules aren't
+followed, so their files go in the inputs of the job. The hashes are kept in
+.render_state.json next to this file; the hash of a file is reused while its
+size and mtime don't change.
+"""
+import hashlib
+import inspect
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+# before pyplot is imported anywhere; the workers never open a window
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt  # noqa: E402
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '.render_state.json')
+
+
+class Job:
+    """One figure. fn(inputs, **params) draws it and returns the Figure (or
+    None for the current one); paths are relative to the repository. The
+    scripts fn relies on besides its own module count as inputs too.
+    """
+
+    def __init__(self, output, fn, inputs=(), params=None, save=None):
+        self.output = output
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.save = save or {}
+
+    def __repr__(self):
+        return 'Job({!r})'.format(self.output)
+
+
+def _path(path):
+    return os.path.join(REPO_DIR, path)
+
+
+def _load_state(path):
+    if not os.path.exists(path):
+        return {'files': {}, 'outputs': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state(state, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def file_hash(path, files):
+    """sha1 of the file at path, reused from files while its size and mtime
+    are the same.
+    """
+    stat = os.stat(_path(path))
+    known = files.get(path)
+    if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return known[2]
+    h = hashlib.sha1()
+    with open(_path(path), 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    files[path] = [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+    return files[path][2]
+
+
+def source_file(fn):
+    """The file of the module that defines fn, relative to the repository."""
+    return os.path.relpath(os.path.abspath(inspect.getsourcefile(fn)),
+                           REPO_DIR)
+
+
+def job_key(job, files):
+    h = hashlib.sha1()
+    h.update('{}.{}'.format(job.fn.__module__, job.fn.__qualname__).encode())
+    # the whole module, since fn calls the helpers and constants around it
+    h.update(file_hash(source_file(job.fn), files).encode())
+    h.update(json.dumps([job.params, job.save], sort_keys=True,
+                        default=str).encode())
+    for path in job.inputs:
+        h.update(path.encode())
+        h.update(file_hash(path, files).encode())
+    return h.hexdigest()
+
+
+def render_job(job):
+    """Draws and saves the figure of job; runs in a worker process."""
+    started = time.perf_counter()
+    try:
+        fig = job.fn([_path(path) for path in job.inputs], **job.params)
+        fig = fig if fig is not None else plt.gcf()
+        output = _path(job.output)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        # the format comes from the extension of the output, not of tmp
+        extension = os.path.splitext(output)[1][1:] or 'png'
+        fig.savefig(output + '.tmp', format=extension, **job.save)
+        os.replace(output + '.tmp', output)
+    finally:
+        plt.close('all')
+    return time.perf_counter() - started
+
+
+def render(jobs, workers=None, force=False, state_file=STATE_FILE):
+    """Renders the jobs that changed and returns the outputs that failed."""
+    state = _load_state(state_file)
+    outdated = []
+    for job in jobs:
+        try:
+            key = job_key(job, state['files'])
+        except FileNotFoundError as e:
+            print('{}: missing input {}'.format(job.output, e.filename))
+            continue
+        previous = state['outputs'].get(job.output, {})
+        if force or previous.get('key') != key or \
+                not os.path.exists(_path(job.output)):
+            outdated.append((job, key))
+    print('{} of {} figures to render'.format(len(outdated), len(jobs)))
+    if not outdated:
+        _save_state(state, state_file)
+        return []
+
+    # longest first, so the slowest figure doesn't start last
+    outdated.sort(key=lambda item: -state['outputs'].get(
+        item[0].output, {}).get('seconds', 0))
+    failed = []
+    started = time.perf_counter()
+    workers = workers or min(len(outdated), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(job, key, executor.submit(render_job, job))
+                   for job, key in outdated]
+        for job, key, future in futures:
+            try:
+                seconds = future.result()
+            except Exception:
+                print('{} failed:'.format(job.output))
+                traceback.print_exc()
+                failed.append(job.output)
+                continue
+            state['outputs'][job.output] = {'key': key, 'seconds': seconds}
+            print('{} in {:.1f}s'.format(job.output, seconds))
+    _save_state(state, state_file)
+    print('rendered in {:.1f}s'.format(time.perf_counter() - started))
+    return failed
@@ -0,0 +1,178 @@
+"""
+Streaming, resumable download of the Foursquare/Swarm check-ins.
+
+Every page is appended to an NDJSON file (one check-in per line) as soon as
+it arrives, and a checkpoint with the remaining timestamp window and offset
+is saved after it. If the download is interrupted, the next run continues
+from the checkpoint. Check-ins already in the file are skipped by id, so
+nothing gets duplicated and memory doesn't grow with the history size.
+
+The pace adapts to the rate limit reported by the API instead of sleeping
+a fixed time after every page. Every page is timed, with the budget left,
+by telemetry.py.
+"""
+import json
+import os
+import sys
+import time
+
+import foursquare
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
+
+PAGE_SIZE = 250
+# seconds between pages while the quota is healthy
+MIN_DELAY = 1.0
+# seconds to back off after a rate limit error; it doubles up to MAX_BACKOFF
+BACKOFF = 60.0
+MAX_BACKOFF = 15 * 60.0
+CHECKINS_ENDPOINT = '/v2/users/self/checkins'
+
+
+def read_ids(path):
+    """Returns the ids of the check-ins already stored in path. A last line
+    cut short by a crash is removed from the file.
+    """
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+    complete = 0
+    with open(path, 'rb+') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                ids.add(json.loads(line)['id'])
+            except ValueError:
+                break
+            complete += len(line)
+        f.truncate(complete)
+    return ids
+
+
+def _load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_checkpoint(path, checkpoint):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+
+def pacing_delay(client):
+    """Spreads the remaining requests over the rest of the hour. The
+    foursquare client keeps the X-RateLimit-* headers of the last response.
+    """
+    limit = getattr(client, 'rate_limit', None)
+    remaining = getattr(client, 'rate_remaining', None)
+    if not limit or remaining is None:
+        return MIN_DELAY
+    limit, remaining = int(limit), int(remaining)
+    if remaining <= 0:
+        return BACKOFF
+    if remaining < limit / 10:
+        # running low, so spread what is left over the hour
+        return 3600.0 / remaining
+    return MIN_DELAY
+
+
+def fetch_checkins(client, start_ts, end_ts, path='data/checkins.ndjson'):
+    """Downloads the check-ins created in [start_ts, end_ts) into path and
+    returns how many new ones were written.
+    """
+    checkpoint_path = path + '.checkpoint'
+    checkpoint = _load_checkpoint(checkpoint_path)
+    if checkpoint is not None and checkpoint['after'] == start_ts and \
+            checkpoint['end'] == end_ts:
+        print('Resuming at offset {}, before {}'.format(
+            checkpoint['offset'], checkpoint['before']))
+    else:
+        checkpoint = {'after': start_ts, 'end': end_ts, 'before': end_ts,
+                      'offset': 0}
+
+    ids = read_ids(path)
+    written = 0
+    backoff = BACKOFF
+
+    with open(path, 'a') as fp:
+        while True:
+            # newest first, so the window shrinks from the end after every page
+            try:
+                with telemetry.METRICS.call('foursquare',
+                                            CHECKINS_ENDPOINT) as call:
+                    c = client.users.checkins(params={
+                        'afterTimestamp': checkpoint['after'],
+                        'beforeTimestamp': checkpoint['before'],
+                        'sort': 'newestfirst',
+                        'limit': PAGE_SIZE,
+                        'offset': checkpoint['offset']})
+                    call.items = len(c['checkins']['items'])
+            except foursquare.RateLimitExceeded:
+                telemetry.METRICS.retry('foursquare', 'RateLimitExceeded',
+                                        CHECKINS_ENDPOINT)
+                print('Rate limit exceeded, sleeping {}s'.format(backoff))
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            backoff = BACKOFF
+            if getattr(client, 'rate_remaining', None) is not None:
+                telemetry.METRICS.rate_limit(
+                    'foursquare', CHECKINS_ENDPOINT, client.rate_remaining,
+                    getattr(client, 'rate_limit', None))
+
+            items = c['checkins']['items']
+            if len(items) == 0:
+                break
+
+            for item in items:
+                if item['id'] in ids:
+                    continue
+                fp.write(json.dumps(item) + '\n')
+                ids.add(item['id'])
+                written += 1
+            fp.flush()
+            os.fsync(fp.fileno())
+
+            # move the end of the window to the oldest check-in of the page;
+            # the ones sharing its timestamp come again and are skipped by id
+            oldest = min(item['createdAt'] for item in items)
+            if oldest + 1 < checkpoint['before']:
+                checkpoint['before'] = oldest + 1
+                checkpoint['offset'] = 0
+            else:
+                checkpoint['offset'] += PAGE_SIZE
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+            delay = pacing_delay(client)
+            print('Sleeping {:.0f}s before {}. New check-ins: {}.'.format(
+                delay, checkpoint['before'], written))
+            time.sleep(delay)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return written
+
+
+def write_json_array(ndjson_path, json_path):
+    """Rewrites the NDJSON file as the JSON array the R scripts read, one
+    line at a time.
+    """
+    with open(ndjson_path) as src, open(json_path + '.tmp', 'w') as dst:
+        dst.write('[')
+        first = True
+        for line in src:
+            line = line.strip()
+            if not line:
+                continue
+            if not first:
+                dst.write(',')
+            dst.write(line)
+            first = False
+        dst.write(']')
+    os.replace(json_path + '.tmp', json_path)
@@ -1,10 +1,16 @@
 import foursquare
 import argparse
 import datetime
-import json
-import time
+import os
+import sys
 from pytz import timezone
 
+from checkins import fetch_checkins, write_json_array
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--start_date', '-bd', help='Starting date', type=str,
                     default='2019-05-28')
@@ -22,15 +28,18 @@ access_code = args.access_code
 
 client = foursquare.Foursquare(client_id=client_id, client_secret=client_secret,
                                redirect_uri='https://juandes.com/oauth/authorize')
+telemetry.start('swarmapp-get_data')
 
 # Get the user's access_token
-access_token = client.oauth.get_token(access_code)
+with telemetry.METRICS.call('foursquare', '/oauth2/access_token'):
+    access_token = client.oauth.get_token(access_code)
 
 # Apply the returned access token to the client
 client.set_access_token(access_token)
 
 # Get the user's data
-user = client.users()
+with telemetry.METRICS.call('foursquare', '/v2/users/self'):
+    user = client.users()
 
 # Change the given times to the corresponding time zone
 start_ts = int(datetime.datetime.strptime(
@@ -38,27 +47,8 @@ start_ts = int(datetime.datetime.strptime(
 end_ts = int(datetime.datetime.strptime(
     end_date, '%Y-%m-%d').replace(tzinfo=timezone('Asia/Singapore')).timestamp())
 
-offset = 0
-data = []
-
-while True:
-    # Get the check-ins using afterTimestamp and beforeTimestamp to filter the result
-    c = client.users.checkins(params={'afterTimestamp': start_ts,
-                                      'beforeTimestamp': end_ts,
-                                      'sort': 'newestfirst',
-                                      'limit': 250,
-                                      'offset': offset})
-    if len(c['checkins']['items']) == 0:
-        break
-
-    for item in c['checkins']['items']:
-        data.append(item)
-    offset += 250
-
-    print("Sleeping after offset {}. Data size: {}.".format(offset, len(data)))
-    time.sleep(15)
-
-
-fl = [item for sublist in data for item in sublist]
-with open('data/checkins.json', 'a+') as fp:
-    json.dump(data, fp)
+# stream the check-ins to ndjson, then rewrite them as the json array
+# the R scripts read
+written = fetch_checkins(client, start_ts, end_ts, 'data/checkins.ndjson')
+print('{} new check-ins'.format(written))
+write_json_array('data/checkins.ndjson', 'data/checkins.json')
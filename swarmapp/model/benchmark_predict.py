@@ -0,0 +1,95 @@
+"""
+Compares the compiled tree of predict.py with clf.predict on the one-hot
+matrix of the encoder: the latency of tagging one check-in at a time, and
+the throughput on batches.
+
+The records are drawn from subcategories.csv, with a share of countries the
+encoder has never seen, and both ways must agree on every one of them.
+
+Usage:
+    python benchmark_predict.py --sizes 1000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import predict
+
+
+def sample(df, n, unknown=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    records = df.sample(n, replace=True, random_state=seed)[
+        predict.COLUMNS].reset_index(drop=True)
+    records.loc[rng.random(n) < unknown, 'country'] = 'XX'
+    return records
+
+
+def sklearn_predict(clf, enc, records):
+    return clf.predict(enc.transform(records))
+
+
+def latencies(fn, records):
+    """Microseconds of fn on every record, one at a time."""
+    times = np.empty(len(records))
+    for i, record in enumerate(records):
+        started = time.perf_counter()
+        fn(record)
+        times[i] = time.perf_counter() - started
+    return times * 1e6
+
+
+def throughput(fn, records, repeat=3):
+    best = min(_timed(fn, records) for _ in range(repeat))
+    return len(records) / best
+
+
+def _timed(fn, records):
+    started = time.perf_counter()
+    fn(records)
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=predict.MODEL)
+    parser.add_argument('--encoder', default=predict.ENCODER)
+    parser.add_argument('--data', default=predict.DATA)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--latency_samples', type=int, default=1000)
+    args = parser.parse_args()
+
+    compiled, clf, enc = predict.load_model(args.model, args.encoder,
+                                            args.data)
+    df = pd.read_csv(args.data)
+
+    check = pd.concat([df[predict.COLUMNS], sample(df, 10000)],
+                      ignore_index=True)
+    expected = sklearn_predict(clf, enc, check)
+    assert (compiled.predict(check) == expected).all()
+    assert [compiled.predict_one(record) for record in
+            check.to_dict('records')] == expected.tolist()
+    print('Same predictions on {} records, tree depth {}'.format(
+        len(check), compiled.max_depth))
+
+    records = sample(df, args.latency_samples, seed=1)
+    dicts = records.to_dict('records')
+    frames = [records.iloc[[i]] for i in range(len(records))]
+    print('\nLatency of one record (us)   median     p99')
+    for name, fn, inputs in [
+            ('clf.predict', lambda r: sklearn_predict(clf, enc, r), frames),
+            ('predict_one', compiled.predict_one, dicts)]:
+        times = latencies(fn, inputs)
+        print('{:<28}{:>7.1f} {:>7.1f}'.format(
+            name, np.median(times), np.percentile(times, 99)))
+
+    print('\nThroughput (records/s)      {:>12} {:>12}'.format(
+        'clf.predict', 'compiled'))
+    for size in args.sizes:
+        records = sample(df, size, seed=2)
+        print('{:<28}{:>12.0f} {:>12.0f}'.format(
+            '{} records'.format(size),
+            throughput(lambda r: sklearn_predict(clf, enc, r), records),
+            throughput(compiled.predict, records)))
@@ -1,34 +1,49 @@
 import matplotlib.pyplot as plt
 import pandas as pd
-from joblib import dump
+from joblib import dump, load
 from sklearn import tree
 from sklearn.metrics import classification_report
 from sklearn.preprocessing import OneHotEncoder
 
-df = pd.read_csv('subcategories.csv')
-X = df.drop('subcategory', axis=1)
-y = df.subcategory
 
-enc = OneHotEncoder(handle_unknown='ignore').fit(X)
-X = enc.transform(X)
-
-# To see the features
-enc.get_feature_names()
-
-clf = tree.DecisionTreeClassifier().fit(X, y)
-dump(clf, 'decision_tree_051220.joblib')
-y_pred = clf.predict(X)
-print(classification_report(y, y_pred))
-
-
-fig, ax = plt.subplots(figsize=(50, 24))
-tree.plot_tree(clf, fontsize=6)
-plt.savefig('whole_tree_high_dpi', dpi=100)
-
-
-fig, ax = plt.subplots(figsize=(30, 20))
-tree.plot_tree(clf, fontsize=14, max_depth=3,
-               feature_names=enc.get_feature_names(),
-               class_names=sorted(y.unique()),
-               impurity=False)
-plt.savefig('tree_high_dpi_max_depth_3', dpi=100)
+def encode(path):
+    df = pd.read_csv(path)
+    X = df.drop('subcategory', axis=1)
+    y = df.subcategory
+    enc = OneHotEncoder(handle_unknown='ignore').fit(X)
+    return enc, enc.transform(X), y
+
+
+def plot_tree_figure(inputs, figsize, fontsize, max_depth=None,
+                     labels=False):
+    """Render job: the tree of the model inputs[0] trained on the data
+    inputs[1], with the feature and class names if labels.
+    """
+    clf = load(inputs[0])
+    fig, ax = plt.subplots(figsize=figsize)
+    if labels:
+        enc, _, y = encode(inputs[1])
+        tree.plot_tree(clf, fontsize=fontsize, max_depth=max_depth,
+                       feature_names=enc.get_feature_names_out(),
+                       class_names=sorted(y.unique()),
+                       impurity=False)
+    else:
+        tree.plot_tree(clf, fontsize=fontsize, max_depth=max_depth)
+    return fig
+
+
+if __name__ == '__main__':
+    enc, X, y = encode('subcategories.csv')
+
+    # To see the features
+    enc.get_feature_names_out()
+
+    clf = tree.DecisionTreeClassifier().fit(X, y)
+    dump(clf, 'decision_tree_051220.joblib')
+    # predict.py compiles the tree against the columns of this encoder
+    dump(enc, 'encoder_051220.joblib')
+    y_pred = clf.predict(X)
+    print(classification_report(y, y_pred))
+
+    # the trees are drawn by the render stage:
+    #   python ../../render/jobs.py --only swarmapp
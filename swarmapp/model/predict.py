@@ -0,0 +1,299 @@
+"""
+Tags new check-ins with the subcategory predicted by the decision tree of
+decision_tree.py, without going through scikit-learn.
+
+Every split of the tree is on one one-hot column of the encoder, i.e. on
+"column == category". The tree is compiled into flat arrays where each node
+holds that column and the code of that category, so a record is only turned
+into one small integer code per column (a dict lookup) and never into a
+one-hot matrix. Unknown categories get code -1, which matches no split, like
+the all-zero columns of handle_unknown='ignore', or the code of the
+infrequent categories when the encoder pools them (as train.py does).
+
+predict_one walks the tree for one record in plain Python (a few
+microseconds). For batches, the class of every combination of codes is
+worked out once, when the tree is compiled (8 x 20 x 11 of them for
+subcategories.csv), so predict is a single table lookup per record. Inputs
+with too many combinations fall back to walking the tree for the whole
+batch with numpy, one level per step.
+
+The records are dicts with weekday, hour and country, or raw check-ins as
+written by swarmapp/checkins.py, and the predictions are served on stdin or
+over HTTP:
+
+    python predict.py < ../data/checkins.ndjson
+    python predict.py --port 8080
+    curl -d '[{"weekday": "Monday", "hour": 14, "country": "NZ"}]' \\
+        localhost:8080/predict
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+from joblib import load
+
+import decision_tree
+
+MODEL = 'decision_tree_051220.joblib'
+ENCODER = 'encoder_051220.joblib'
+DATA = 'subcategories.csv'
+# the columns of subcategories.csv, for encoders that don't keep them
+COLUMNS = ['weekday', 'hour', 'country']
+# largest number of code combinations to tabulate
+MAX_TABLE_SIZE = 1 << 20
+
+
+def checkin_features(checkin):
+    """Weekday name, hour and country of a check-in, in local time."""
+    local = datetime.datetime.utcfromtimestamp(
+        checkin['createdAt'] + checkin.get('timeZoneOffset', 0) * 60)
+    return {'weekday': local.strftime('%A'), 'hour': local.hour,
+            'country': checkin.get('venue', {}).get('location', {}).get('cc')}
+
+
+def _slots(enc, c):
+    """The code of every category of column c of the encoder, and the code
+    of the unknown categories last. The infrequent categories of encoders
+    with max_categories or min_frequency share the last one-hot column.
+    """
+    n = len(enc.categories_[c])
+    try:
+        infrequent = enc.infrequent_categories_[c]
+    except AttributeError:
+        # encoders pickled before scikit-learn 1.1
+        infrequent = None
+    if infrequent is None:
+        return np.append(np.arange(n), -1)
+    is_infrequent = np.isin(enc.categories_[c], infrequent)
+    n_frequent = int((~is_infrequent).sum())
+    slots = np.where(is_infrequent, n_frequent, np.cumsum(~is_infrequent) - 1)
+    unknown = n_frequent if enc.handle_unknown == 'infrequent_if_exist' \
+        else -1
+    return np.append(slots, unknown)
+
+
+class CompiledTree:
+    """A fitted DecisionTreeClassifier over the one-hot columns of a
+    OneHotEncoder, compiled into flat arrays over the raw columns.
+    """
+
+    def __init__(self, clf, enc, columns):
+        if getattr(enc, 'drop_idx_', None) is not None:
+            raise ValueError('encoders that drop categories are not supported')
+        # the code of every category of every column is the one-hot column
+        # it sets within that column's block
+        self.slots = [_slots(enc, c) for c in range(len(enc.categories_))]
+        widths = [int(slots.max()) + 1 if len(slots) else 0
+                  for slots in self.slots]
+        # one-hot column -> (raw column, category code)
+        onehot_column = np.concatenate(
+            [np.full(width, c) for c, width in enumerate(widths)])
+        onehot_code = np.concatenate([np.arange(width) for width in widths])
+        tree = clf.tree_
+        if tree.n_features != len(onehot_column):
+            raise ValueError('the encoder has {} columns, the tree {}'.format(
+                len(onehot_column), tree.n_features))
+
+        leaf = tree.children_left == -1
+        thresholds = tree.threshold[~leaf]
+        if len(thresholds) and (thresholds.min() <= 0 or
+                                thresholds.max() >= 1):
+            raise ValueError('the tree has splits that are not on 0/1 columns')
+        nodes = np.arange(tree.node_count)
+        feature = np.where(leaf, 0, tree.feature)
+        self.columns = list(columns)
+        self.classes = clf.classes_
+        self.column = np.where(leaf, 0, onehot_column[feature]).astype(np.intp)
+        # -2 matches no code, not even the -1 of unknown categories
+        self.code = np.where(leaf, -2, onehot_code[feature]).astype(np.int32)
+        # x <= 0.5, i.e. not this category, goes left; leaves point to
+        # themselves, so predict can take max_depth steps for every record
+        self.left = np.where(leaf, nodes, tree.children_left)
+        self.right = np.where(leaf, nodes, tree.children_right)
+        self.label = tree.value[:, 0, :].argmax(axis=1)
+        self.max_depth = tree.max_depth
+
+        self.categories = [pd.Index(categories)
+                           for categories in enc.categories_]
+        # one more code per column for the unknown categories
+        self.shape = tuple(width + 1 for width in widths)
+        self.table = None
+        if np.prod(self.shape) <= MAX_TABLE_SIZE:
+            combinations = np.indices(self.shape).reshape(
+                len(self.shape), -1).T - 1
+            self.table = self._walk(combinations)
+
+        # the categories are matched by value and by their str, for records
+        # that come from csv or JSON as strings
+        self.lookups = []
+        for categories, slots in zip(enc.categories_, self.slots):
+            lookup = {}
+            for category, code in zip(categories.tolist(), slots.tolist()):
+                lookup[str(category)] = code
+                lookup[category] = code
+            self.lookups.append(lookup)
+        self.unknown = [int(slots[-1]) for slots in self.slots]
+        labels = self.classes[self.label].tolist()
+        self._nodes = [(int(c), int(k), -1 if is_leaf else int(l), int(r),
+                        label)
+                       for c, k, l, r, is_leaf, label in zip(
+                           self.column, self.code, tree.children_left,
+                           tree.children_right, leaf, labels)]
+
+    def _codes(self, record):
+        if isinstance(record, dict):
+            record = [record.get(column) for column in self.columns]
+        return [lookup.get(value, unknown) for lookup, value, unknown in
+                zip(self.lookups, record, self.unknown)]
+
+    def predict_one(self, record):
+        """The class of one record, a dict or a sequence in column order."""
+        codes = self._codes(record)
+        nodes = self._nodes
+        node = 0
+        while True:
+            column, code, left, right, label = nodes[node]
+            if left < 0:
+                return label
+            node = right if codes[column] == code else left
+
+    def encode(self, records):
+        """The category codes of a DataFrame or a list of records."""
+        if not isinstance(records, pd.DataFrame):
+            if len(records) and not isinstance(records[0], dict):
+                records = pd.DataFrame(list(records), columns=self.columns)
+            else:
+                records = pd.DataFrame.from_records(list(records),
+                                                    columns=self.columns)
+        codes = np.empty((len(records), len(self.columns)), dtype=np.intp)
+        for c, (column, categories, slots) in enumerate(
+                zip(self.columns, self.categories, self.slots)):
+            values = records[column]
+            if pd.api.types.is_numeric_dtype(categories) and \
+                    not pd.api.types.is_numeric_dtype(values):
+                # numbers that came as strings from csv or JSON
+                values = values.astype(str)
+                categories = categories.astype(str)
+            # -1, for the unknown categories, takes the last slot
+            codes[:, c] = slots[categories.get_indexer(values)]
+        return codes
+
+    def _walk(self, codes):
+        """The label index of every row of codes."""
+        rows = np.arange(len(codes))
+        nodes = np.zeros(len(codes), dtype=np.intp)
+        for _ in range(self.max_depth):
+            right = codes[rows, self.column[nodes]] == self.code[nodes]
+            nodes = np.where(right, self.right[nodes], self.left[nodes])
+        return self.label[nodes]
+
+    def predict(self, records):
+        """The classes of a batch of records."""
+        codes = self.encode(records)
+        if self.table is None:
+            return self.classes[self._walk(codes)]
+        index = np.ravel_multi_index((codes + 1).T, self.shape)
+        return self.classes[self.table[index]]
+
+
+def load_model(model_path=MODEL, encoder_path=ENCODER, data_path=DATA):
+    """The compiled tree, the tree and the encoder. Without a saved encoder
+    it is fitted again on the training data, which gives the same columns.
+    """
+    clf = load(model_path)
+    if os.path.exists(encoder_path):
+        enc = load(encoder_path)
+    else:
+        enc = decision_tree.encode(data_path)[0]
+    columns = list(getattr(enc, 'feature_names_in_', COLUMNS))
+    return CompiledTree(clf, enc, columns), clf, enc
+
+
+def _features(record):
+    return checkin_features(record) if 'createdAt' in record else record
+
+
+def stream(compiled, lines, out):
+    """Tags every NDJSON record of lines as it comes."""
+    total, total_time = 0, 0.0
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        started = time.perf_counter()
+        record['subcategory'] = compiled.predict_one(_features(record))
+        total_time += time.perf_counter() - started
+        total += 1
+        print(json.dumps(record), file=out, flush=True)
+    if total:
+        print('{} records, {:.1f}us per record'.format(
+            total, total_time / total * 1e6), file=sys.stderr)
+
+
+def make_handler(compiled):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != '/predict':
+                return self._send(404, {'error': 'not found'})
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                records = json.loads(self.rfile.read(length))
+            except ValueError:
+                return self._send(400, {'error': 'invalid JSON'})
+            single = isinstance(records, dict)
+            records = [_features(record)
+                       for record in ([records] if single else records)]
+            if len(records) == 1:
+                labels = [compiled.predict_one(records[0])]
+            else:
+                labels = compiled.predict(records).tolist()
+            self._send(200, {'subcategory': labels[0] if single else labels})
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=MODEL)
+    parser.add_argument('--encoder', default=ENCODER)
+    parser.add_argument('--artifact', default=None,
+                        help='Model directory written by train.py, instead '
+                             'of --model and --encoder')
+    parser.add_argument('--data', default=DATA,
+                        help='Training data, to fit the encoder if it '
+                             'was not saved')
+    parser.add_argument('--port', type=int, default=None,
+                        help='Serve POST /predict instead of reading stdin')
+    args = parser.parse_args()
+
+    if args.artifact is not None:
+        args.model = os.path.join(args.artifact, 'tree.joblib')
+        args.encoder = os.path.join(args.artifact, 'encoder.joblib')
+    compiled = load_model(args.model, args.encoder, args.data)[0]
+    if args.port is None:
+        stream(compiled, sys.stdin, sys.stdout)
+    else:
+        server = ThreadingHTTPServer(('localhost', args.port),
+                                     make_handler(compiled))
+        print('Predicting on http://localhost:{}/predict'.format(args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
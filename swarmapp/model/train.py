@@ -0,0 +1,290 @@
+"""
+Training pipeline for the subcategory tree of the check-ins.
+
+The weekday, hour, country and subcategory of every check-in are streamed
+in chunks from the check-in store of swarmapp/checkins.py (or from a csv
+like subcategories.csv) into compact categorical columns. The subcategories
+are the ones of categories.Rmd.
+
+The one-hot encoder keeps at most max_categories columns per feature; the
+rarer countries (and any new one) share an "infrequent" column, so the width
+of the encoder doesn't grow with every new city. The tree stays a plain
+one-hot tree that predict.py can compile.
+
+max_depth and min_samples_leaf are picked by stratified k-fold
+cross-validation, every (parameters, fold) pair in its own process. The
+processes only get the small integer codes of the categories, which joblib
+memory-maps instead of copying once they are large.
+
+Every trained model is kept in artifacts/<version>/, where the version is a
+hash of the data rows and the training parameters, so running again on the
+same data only loads it. Fit time and peak memory are reported, and kept in
+the manifest.json of the version.
+
+Usage:
+    python train.py ../data/checkins.ndjson
+    python train.py subcategories.csv --max_categories 16 --folds 10
+    python predict.py --artifact artifacts/<version>
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn
+from joblib import Parallel, delayed, dump
+from pandas.api.types import union_categoricals
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.preprocessing import OneHotEncoder
+from sklearn.tree import DecisionTreeClassifier
+
+import predict
+
+STORE = '../data/checkins.ndjson'
+ARTIFACTS_DIR = 'artifacts'
+CHUNK_SIZE = 10000
+MAX_CATEGORIES = 32
+FOLDS = 5
+MAX_DEPTHS = [None, 6, 10, 15, 20]
+MIN_SAMPLES_LEAFS = [1, 2, 4, 8]
+CATEGORICAL = ['weekday', 'country', 'subcategory']
+
+
+def subcategory(category):
+    """The subcategory of a Foursquare category name, or None for the ones
+    that don't have one. The rules are checked in the order of
+    categories.Rmd, so a Coffee Shop counts as Shopping there too.
+    """
+    if category is None:
+        return None
+    if category in ('Convenience Store', 'Shopping Mall', 'Supermarket',
+                    'Market', 'Grocery Store', 'Electronics Store') or \
+            'Shop' in category:
+        return 'Shopping'
+    if 'Restaurant' in category or category in (
+            'Noodle House', 'Bakery', 'Pizza Place', 'Burger Joint',
+            'Pie Shop', 'Food Court', 'Food Truck'):
+        return 'Food'
+    if category in ('Coffee Shop', 'Café', 'Tea Room'):
+        return 'Coffee'
+    if 'Bar' in category or category in ('Pub', 'Beer Garden'):
+        return 'Drinks'
+    if 'Library' in category:
+        return 'Library'
+    return None
+
+
+def checkin_row(checkin):
+    categories = checkin.get('venue', {}).get('categories', [])
+    primary = next((c for c in categories if c.get('primary')),
+                   categories[0] if categories else {})
+    row = predict.checkin_features(checkin)
+    row['subcategory'] = subcategory(primary.get('name'))
+    return row
+
+
+def _compact(chunk):
+    chunk = chunk[predict.COLUMNS + ['subcategory']].dropna()
+    chunk = chunk.astype({'hour': np.int8})
+    return chunk.astype({column: 'category' for column in CATEGORICAL})
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yields DataFrames of the features and subcategory of the check-ins
+    of an NDJSON store or a csv.
+    """
+    if path.endswith('.csv'):
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            yield _compact(chunk)
+        return
+    with open(path) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                return
+            yield _compact(pd.DataFrame(
+                [checkin_row(json.loads(line)) for line in lines
+                 if line.strip()],
+                columns=predict.COLUMNS + ['subcategory']))
+
+
+def read_features(path, chunk_size=CHUNK_SIZE):
+    """The check-ins of path as one DataFrame of categorical columns, and a
+    hash of its rows.
+    """
+    h = hashlib.sha1()
+    chunks = []
+    for chunk in read_chunks(path, chunk_size):
+        h.update(pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+                 .tobytes())
+        chunks.append(chunk)
+    df = pd.DataFrame({
+        column: union_categoricals([chunk[column] for chunk in chunks])
+        if column in CATEGORICAL else
+        np.concatenate([chunk[column].to_numpy() for chunk in chunks])
+        for column in predict.COLUMNS + ['subcategory']})
+    return df, h.hexdigest()
+
+
+def make_encoder(max_categories=MAX_CATEGORIES):
+    return OneHotEncoder(max_categories=max_categories,
+                         handle_unknown='infrequent_if_exist')
+
+
+def _max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def _evaluate_fold(codes, y, train, test, params, max_categories):
+    started = time.perf_counter()
+    # the codes stand for the categories in sorted order, like the encoder's
+    enc = make_encoder(max_categories).fit(codes[train])
+    clf = DecisionTreeClassifier(random_state=0, **params).fit(
+        enc.transform(codes[train]), y[train])
+    y_pred = clf.predict(enc.transform(codes[test]))
+    return {'accuracy': accuracy_score(y[test], y_pred),
+            'f1_macro': f1_score(y[test], y_pred, average='macro'),
+            'fit_seconds': time.perf_counter() - started,
+            'peak_rss_mb': _max_rss_mb()}
+
+
+def search(df, max_depths=MAX_DEPTHS, min_samples_leafs=MIN_SAMPLES_LEAFS,
+           folds=FOLDS, max_categories=MAX_CATEGORIES, n_jobs=-1):
+    """Cross-validates every (max_depth, min_samples_leaf) pair in parallel
+    and returns the results, best (macro F1) first.
+    """
+    codes = np.column_stack([
+        pd.Categorical(df[column],
+                       categories=sorted(df[column].unique())).codes
+        for column in predict.COLUMNS]).astype(np.int16)
+    y = df['subcategory'].to_numpy(dtype=object)
+    splits = list(StratifiedKFold(folds, shuffle=True, random_state=0)
+                  .split(codes, y))
+    grid = [{'max_depth': max_depth, 'min_samples_leaf': min_samples_leaf}
+            for max_depth, min_samples_leaf in
+            itertools.product(max_depths, min_samples_leafs)]
+    scores = Parallel(n_jobs=n_jobs)(
+        delayed(_evaluate_fold)(codes, y, train, test, params,
+                                max_categories)
+        for params in grid for train, test in splits)
+
+    results = []
+    for i, params in enumerate(grid):
+        fold_scores = pd.DataFrame(scores[i * folds:(i + 1) * folds])
+        results.append(dict(params,
+                            accuracy=fold_scores['accuracy'].mean(),
+                            f1_macro=fold_scores['f1_macro'].mean(),
+                            f1_macro_std=fold_scores['f1_macro'].std(),
+                            fit_seconds=fold_scores['fit_seconds'].sum(),
+                            peak_rss_mb=fold_scores['peak_rss_mb'].max()))
+    return sorted(results, key=lambda result: -result['f1_macro'])
+
+
+def version(data_key, config):
+    h = hashlib.sha1(data_key.encode())
+    h.update(json.dumps(config, sort_keys=True).encode())
+    return h.hexdigest()[:12]
+
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True, default=str)
+    os.replace(path + '.tmp', path)
+
+
+def train(source, out_dir=ARTIFACTS_DIR, max_depths=MAX_DEPTHS,
+          min_samples_leafs=MIN_SAMPLES_LEAFS, folds=FOLDS,
+          max_categories=MAX_CATEGORIES, n_jobs=-1, force=False):
+    """Trains (or finds) the model of source and returns its directory."""
+    started = time.perf_counter()
+    df, data_key = read_features(source)
+    read_seconds = time.perf_counter() - started
+    config = {'max_depths': max_depths, 'min_samples_leafs': min_samples_leafs,
+              'folds': folds, 'max_categories': max_categories,
+              'sklearn': sklearn.__version__}
+    directory = os.path.join(out_dir, version(data_key, config))
+    manifest_path = os.path.join(directory, 'manifest.json')
+    print('{} check-ins read in {:.2f}s ({:.0f} kB)'.format(
+        len(df), read_seconds, df.memory_usage(deep=True).sum() / 1024))
+
+    if os.path.exists(manifest_path) and not force:
+        print('Data and parameters unchanged, using {}'.format(directory))
+    else:
+        search_started = time.perf_counter()
+        results = search(df, max_depths, min_samples_leafs, folds,
+                         max_categories, n_jobs)
+        search_seconds = time.perf_counter() - search_started
+        best = {'max_depth': results[0]['max_depth'],
+                'min_samples_leaf': results[0]['min_samples_leaf']}
+
+        fit_started = time.perf_counter()
+        X = df[predict.COLUMNS]
+        enc = make_encoder(max_categories).fit(X)
+        clf = DecisionTreeClassifier(random_state=0, **best).fit(
+            enc.transform(X), df['subcategory'])
+        fit_seconds = time.perf_counter() - fit_started
+
+        os.makedirs(directory, exist_ok=True)
+        dump(enc, os.path.join(directory, 'encoder.joblib'))
+        dump(clf, os.path.join(directory, 'tree.joblib'))
+        pd.DataFrame(results).to_csv(
+            os.path.join(directory, 'cv_results.csv'), index=False)
+        # written last: a version without it was interrupted
+        _write_json(manifest_path, {
+            'source': source, 'rows': len(df), 'data': data_key,
+            'config': config, 'params': best,
+            'width': int(enc.transform(X[:1]).shape[1]),
+            'cv': {key: results[0][key] for key in
+                   ('accuracy', 'f1_macro', 'f1_macro_std')},
+            'search_seconds': search_seconds, 'fit_seconds': fit_seconds,
+            'peak_rss_mb': _max_rss_mb(),
+            'worker_peak_rss_mb': max(r['peak_rss_mb'] for r in results),
+        })
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    with open(os.path.join(out_dir, 'LATEST.tmp'), 'w') as f:
+        f.write(os.path.basename(directory))
+    os.replace(os.path.join(out_dir, 'LATEST.tmp'),
+               os.path.join(out_dir, 'LATEST'))
+    print('{}: {} with {} one-hot columns, CV macro F1 {:.3f} (+/- {:.3f}), '
+          'accuracy {:.3f}'.format(
+              directory, manifest['params'], manifest['width'],
+              manifest['cv']['f1_macro'], manifest['cv']['f1_macro_std'],
+              manifest['cv']['accuracy']))
+    print('Search {:.2f}s, final fit {:.3f}s, peak memory {:.0f} MB '
+          '(workers {:.0f} MB)'.format(
+              manifest['search_seconds'], manifest['fit_seconds'],
+              manifest['peak_rss_mb'], manifest['worker_peak_rss_mb']))
+    return directory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', nargs='?', default=STORE,
+                        help='Check-ins NDJSON store or csv')
+    parser.add_argument('--out_dir', default=ARTIFACTS_DIR)
+    parser.add_argument('--max_depths', type=int, nargs='+',
+                        default=MAX_DEPTHS[1:],
+                        help='Depths to try besides an unlimited one')
+    parser.add_argument('--min_samples_leafs', type=int, nargs='+',
+                        default=MIN_SAMPLES_LEAFS)
+    parser.add_argument('--folds', type=int, default=FOLDS)
+    parser.add_argument('--max_categories', type=int, default=MAX_CATEGORIES)
+    parser.add_argument('--jobs', type=int, default=-1)
+    parser.add_argument('--force', action='store_true',
+                        help='Train even if the version exists')
+    args = parser.parse_args()
+
+    train(args.source, args.out_dir, [None] + args.max_depths,
+          args.min_samples_leafs, args.folds, args.max_categories,
+          args.jobs, args.force)
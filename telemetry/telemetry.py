@@ -0,0 +1,416 @@
+"""
+Latency, bytes, retries, status codes and rate-limit budget of the calls the
+scripts make to the Fitbit, Foursquare, OpenWeather, Google Maps and
+BigQuery APIs.
+
+The clients built on a requests.Session (python-fitbit, googlemaps, and
+requests.get for OpenWeather) are instrumented once with instrument_session:
+every HTTP request is timed, with its status code, its size and the
+rate-limit headers of the response (Fitbit-Rate-Limit-* or X-RateLimit-*).
+The endpoint is the path of the url, with the dates and ids replaced, so the
+query string and the keys in it are never recorded. The clients that hide
+their responses (foursquare, aiohttp, pandas_gbq) are timed where they are
+called, with METRICS.call.
+
+start(name) writes what was recorded when the script exits (and every
+interval seconds for the ones that never do) to TELEMETRY_DIR, by default
+telemetry/runs next to this file:
+
+    <name>.prom   Prometheus text format, for the textfile collector of
+                  node_exporter
+    <name>.json   summary of the run: calls, errors, retries, status codes,
+                  latency percentiles, bytes and lowest rate-limit budget
+                  per endpoint
+"""
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+OUT_DIR = os.environ.get(
+    'TELEMETRY_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runs'))
+# seconds; from a local cache hit to a Fitbit call that waited on its quota
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0, 60.0)
+# (limit, remaining, reset) headers of the APIs
+RATE_LIMIT_HEADERS = [
+    ('Fitbit-Rate-Limit-Limit', 'Fitbit-Rate-Limit-Remaining',
+     'Fitbit-Rate-Limit-Reset'),
+    ('X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset'),
+]
+# python-fitbit doesn't pad the days; short numbers are API versions
+PLACEHOLDERS = [
+    (re.compile(r'\d{4}-\d{1,2}-\d{1,2}'), '{date}'),
+    (re.compile(r'^[0-9a-f]{24}$'), '{id}'),
+    (re.compile(r'^\d{5,}$'), '{id}'),
+]
+
+
+def endpoint(url):
+    """The path of url with the dates and ids replaced by placeholders."""
+    segments = []
+    for segment in urlparse(url).path.split('/'):
+        for pattern, placeholder in PLACEHOLDERS:
+            segment = pattern.sub(placeholder, segment)
+        segments.append(segment)
+    return '/'.join(segments) or '/'
+
+
+class Endpoint:
+    """What was recorded for the calls to one endpoint of an API."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.statuses = {}
+        self.errors = {}
+        self.retries = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.items = 0
+        self.limit = None
+        self.remaining = None
+        self.min_remaining = None
+        self.reset = None
+
+    @property
+    def calls(self):
+        return sum(self.buckets)
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def quantile(self, q):
+        """Estimated like histogram_quantile of Prometheus: linearly within
+        the bucket the quantile falls in.
+        """
+        rank = q * self.calls
+        count = 0
+        for i, n in enumerate(self.buckets):
+            if n and count + n >= rank:
+                if i == len(BUCKETS):
+                    return self.max_seconds
+                lower = BUCKETS[i - 1] if i else 0.0
+                return min(lower + (BUCKETS[i] - lower) * (rank - count) / n,
+                           self.max_seconds)
+            count += n
+        return 0.0
+
+    def summary(self):
+        calls = self.calls
+        return {
+            'calls': calls,
+            'errors': sum(self.errors.values()),
+            'retries': sum(self.retries.values()),
+            'status': dict(sorted(self.statuses.items())),
+            'error_types': dict(sorted(self.errors.items())),
+            'retry_reasons': dict(sorted(self.retries.items())),
+            'latency_seconds': {
+                'total': round(self.seconds, 6),
+                'mean': round(self.seconds / calls, 6) if calls else None,
+                'p50': round(self.quantile(0.5), 6),
+                'p95': round(self.quantile(0.95), 6),
+                'p99': round(self.quantile(0.99), 6),
+                'max': round(self.max_seconds, 6),
+            },
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'items': self.items,
+            'rate_limit': {'limit': self.limit, 'remaining': self.remaining,
+                           'min_remaining': self.min_remaining,
+                           'reset_seconds': self.reset},
+        }
+
+
+class Call:
+    """One call being timed by Metrics.call. The caller fills in what the
+    client tells about the response.
+    """
+
+    def __init__(self):
+        self.status = 'ok'
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.items = 0
+
+
+class Metrics:
+    """Thread-safe registry of the calls of a script, by API and endpoint."""
+
+    def __init__(self, name='script'):
+        self.name = name
+        self.started = time.time()
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _endpoint(self, api, path):
+        key = (api, path)
+        if key not in self.endpoints:
+            self.endpoints[key] = Endpoint()
+        return self.endpoints[key]
+
+    def observe(self, api, path, seconds, status, bytes_in=0, bytes_out=0,
+                items=0, error=None):
+        with self.lock:
+            e = self._endpoint(api, path)
+            e.observe(seconds)
+            status = str(status)
+            e.statuses[status] = e.statuses.get(status, 0) + 1
+            if error is not None:
+                e.errors[error] = e.errors.get(error, 0) + 1
+            e.bytes_in += bytes_in
+            e.bytes_out += bytes_out
+            e.items += items
+        # so retry knows which endpoint this thread was calling
+        self._last()[api] = path
+
+    def _last(self):
+        if not hasattr(self.local, 'last'):
+            self.local.last = {}
+        return self.local.last
+
+    def call(self, api, path):
+        """Context manager that times a call and records its Call, and the
+        class of the exception if it raised one.
+        """
+        return _Timer(self, api, path)
+
+    def retry(self, api, reason, path=None):
+        """Counts a retry of the last endpoint this thread called on api,
+        or of path.
+        """
+        path = path or self._last().get(api, '*')
+        reason = str(reason)
+        with self.lock:
+            e = self._endpoint(api, path)
+            e.retries[reason] = e.retries.get(reason, 0) + 1
+
+    def rate_limit(self, api, path, remaining, limit=None, reset=None):
+        """The budget the API reports as left, out of limit, until reset
+        seconds from now.
+        """
+        with self.lock:
+            e = self._endpoint(api, path)
+            e.remaining = int(remaining)
+            if e.min_remaining is None or e.remaining < e.min_remaining:
+                e.min_remaining = e.remaining
+            if limit is not None:
+                e.limit = int(limit)
+            if reset is not None:
+                e.reset = float(reset)
+
+    def summary(self):
+        with self.lock:
+            endpoints = [dict(api=api, endpoint=path, **e.summary())
+                         for (api, path), e in sorted(self.endpoints.items())]
+        finished = time.time()
+        return {'script': self.name, 'started': self.started,
+                'finished': finished,
+                'seconds': round(finished - self.started, 3),
+                'endpoints': endpoints}
+
+    def prometheus(self):
+        """The metrics in the Prometheus text format."""
+        families = {}
+
+        def add(family, kind, help_text, labels, value, suffix=''):
+            if family not in families:
+                families[family] = ['# HELP {} {}'.format(family, help_text),
+                                    '# TYPE {} {}'.format(family, kind)]
+            families[family].append('{}{}{{{}}} {}'.format(
+                family, suffix, _labels(dict({'script': self.name}, **labels)),
+                _number(value)))
+
+        latency = ('api_request_duration_seconds', 'histogram',
+                   'Latency of the API calls.')
+        with self.lock:
+            for (api, path), e in sorted(self.endpoints.items()):
+                labels = {'api': api, 'endpoint': path}
+                count = 0
+                for bound, n in zip(BUCKETS + ('+Inf',), e.buckets):
+                    count += n
+                    add(*latency, dict(labels, le=bound), count, '_bucket')
+                add(*latency, labels, e.seconds, '_sum')
+                add(*latency, labels, count, '_count')
+                for status, n in sorted(e.statuses.items()):
+                    add('api_requests_total', 'counter',
+                        'API calls by status code.',
+                        dict(labels, status=status), n)
+                for error, n in sorted(e.errors.items()):
+                    add('api_errors_total', 'counter',
+                        'API calls that raised, by exception.',
+                        dict(labels, error=error), n)
+                for reason, n in sorted(e.retries.items()):
+                    add('api_retries_total', 'counter',
+                        'API calls made again, by reason.',
+                        dict(labels, reason=reason), n)
+                add('api_response_bytes_total', 'counter',
+                    'Bytes received from the API.', labels, e.bytes_in)
+                add('api_request_bytes_total', 'counter',
+                    'Bytes sent to the API.', labels, e.bytes_out)
+                add('api_items_total', 'counter',
+                    'Records returned by the API.', labels, e.items)
+                if e.remaining is not None:
+                    add('api_rate_limit_remaining', 'gauge',
+                        'Calls left in the quota window.', labels,
+                        e.remaining)
+                    add('api_rate_limit_min_remaining', 'gauge',
+                        'Fewest calls left in the quota window during the '
+                        'run.', labels, e.min_remaining)
+                if e.limit is not None:
+                    add('api_rate_limit_limit', 'gauge',
+                        'Calls allowed per quota window.', labels, e.limit)
+                if e.reset is not None:
+                    add('api_rate_limit_reset_seconds', 'gauge',
+                        'Seconds until the quota window resets.', labels,
+                        e.reset)
+        add('api_telemetry_timestamp_seconds', 'gauge',
+            'When the metrics were written.', {}, time.time())
+        return '\n'.join(line for lines in families.values()
+                         for line in lines) + '\n'
+
+    def export(self, directory=OUT_DIR):
+        """Writes <name>.prom and <name>.json to directory."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.name)
+        for extension, text in (
+                ('.prom', self.prometheus()),
+                ('.json', json.dumps(self.summary(), indent=2) + '\n')):
+            with open(path + extension + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(path + extension + '.tmp', path + extension)
+
+
+class _Timer:
+    def __init__(self, metrics, api, path):
+        self.metrics = metrics
+        self.api = api
+        self.path = path
+        self.call = Call()
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self.call
+
+    def __exit__(self, kind, error, traceback):
+        seconds = time.perf_counter() - self.started
+        call = self.call
+        if error is not None:
+            call.status = _status(error)
+        self.metrics.observe(self.api, self.path, seconds, call.status,
+                             call.bytes_in, call.bytes_out, call.items,
+                             None if kind is None else kind.__name__)
+        return False
+
+
+def _status(error):
+    """The HTTP (or API) status of an exception of a client, if it has one."""
+    response = getattr(error, 'response', None)
+    for status in (getattr(response, 'status_code', None),
+                   getattr(error, 'status_code', None),
+                   getattr(error, 'status', None),
+                   getattr(error, 'code', None)):
+        if isinstance(status, (int, str)) and status != '':
+            return status
+    return 'error'
+
+
+def _labels(labels):
+    return ','.join('{}="{}"'.format(
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')) for key, value in labels.items())
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+METRICS = Metrics()
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    try:
+        return len(body)
+    except TypeError:
+        # a generator or file being streamed
+        return 0
+
+
+def instrument_session(session, api, metrics=None):
+    """Times every request of a requests.Session (or of a subclass like the
+    OAuth2Session of python-fitbit) and records its status, size and the
+    rate-limit headers of the response. Returns the session.
+    """
+    metrics = metrics or METRICS
+    if getattr(session, '_telemetry_api', None) is not None:
+        return session
+    request = session.request
+
+    def instrumented(method, url, *args, **kwargs):
+        path = endpoint(url)
+        started = time.perf_counter()
+        try:
+            response = request(method, url, *args, **kwargs)
+        except Exception as e:
+            metrics.observe(api, path, time.perf_counter() - started,
+                            _status(e), error=type(e).__name__)
+            raise
+        seconds = time.perf_counter() - started
+        if kwargs.get('stream'):
+            bytes_in = int(response.headers.get('Content-Length', 0))
+        else:
+            bytes_in = len(response.content)
+        metrics.observe(api, path, seconds, response.status_code, bytes_in,
+                        _body_size(response.request.body))
+        for limit, remaining, reset in RATE_LIMIT_HEADERS:
+            if remaining in response.headers:
+                metrics.rate_limit(api, path, response.headers[remaining],
+                                   response.headers.get(limit),
+                                   response.headers.get(reset))
+                break
+        return response
+
+    session.request = instrumented
+    session._telemetry_api = api
+    return session
+
+
+def session(api, metrics=None):
+    """A new instrumented requests.Session."""
+    import requests
+    return instrument_session(requests.Session(), api, metrics)
+
+
+def start(name, directory=OUT_DIR, interval=None, metrics=None):
+    """Names the run and writes its metrics when the script exits, and every
+    interval seconds if given.
+    """
+    metrics = metrics or METRICS
+    metrics.name = name
+    metrics.started = time.time()
+    atexit.register(metrics.export, directory)
+    if interval:
+        def loop():
+            while True:
+                time.sleep(interval)
+                metrics.export(directory)
+
+        threading.Thread(target=loop, daemon=True).start()
+    return metrics
@@ -0,0 +1,54 @@
+"""
+Points per second of geo_clustering.py as the number of points grows,
+clustering the whole set at once and in tiles, on synthetic places: blobs
+of a few hundred metres scattered over Singapore, plus uniform noise.
+
+Usage:
+    python benchmark_clustering.py --sizes 1000 10000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+import geo_clustering
+
+# lat, lon box around Singapore
+BOX = ((1.24, 103.62), (1.46, 104.0))
+
+
+def synthetic_points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    low, high = np.array(BOX[0]), np.array(BOX[1])
+    centres = rng.uniform(low, high, size=(max(n // 50, 1), 2))
+    clustered = centres[rng.integers(len(centres), size=n - n // 10)] + \
+        rng.normal(0, 0.002, size=(n - n // 10, 2))
+    noise = rng.uniform(low, high, size=(n // 10, 2))
+    return np.vstack([clustered, noise])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--tile_size', type=float, default=0.05)
+    parser.add_argument('--min_cluster_size', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>8} {:>6} {:>9} {:>9} {:>10}'.format(
+        'points', 'mode', 'clusters', 'seconds', 'points/s'))
+    for n in args.sizes:
+        points = synthetic_points(n)
+        for mode in ('whole', 'tiled'):
+            started = time.perf_counter()
+            if mode == 'whole':
+                labels, _ = geo_clustering.cluster(
+                    points, min_cluster_size=args.min_cluster_size,
+                    cache_dir=None)
+            else:
+                labels, _ = geo_clustering.cluster_tiled(
+                    points, args.tile_size,
+                    min_cluster_size=args.min_cluster_size, cache_dir=None)
+            elapsed = time.perf_counter() - started
+            print('{:>8} {:>6} {:>9} {:>9.2f} {:>10.0f}'.format(
+                n, mode, labels.max() + 1, elapsed, n / elapsed))
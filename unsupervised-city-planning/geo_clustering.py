@@ -0,0 +1,264 @@
+"""
+HDBSCAN clustering of places for city-scale point sets.
+
+Instead of letting HDBSCAN compute every haversine distance, the k nearest
+neighbours of every point are found once with a BallTree and kept as a
+sparse distance graph, which is cached on disk next to the input (in the
+.graph_cache directory beside the input file, see cache_dir_for). HDBSCAN
+runs on that precomputed graph, one connected component at a time (the
+sparse mode needs a connected graph).
+
+Very large inputs can be split into tiles of tile_size degrees. Every tile
+is clustered in its own process together with a margin of the tiles around
+it, and the clusters that share enough points in those margins are merged,
+so a cluster lying across a tile edge comes out whole.
+
+The labels (-1 is noise) and a summary of every cluster (size, centre and
+radius in metres) are written as csv files.
+
+Usage:
+    python geo_clustering.py hongkong/data/coordinates.csv hongkong/data
+    python geo_clustering.py singapore/data.xml singapore/data --tile_size 0.05
+"""
+import argparse
+import hashlib
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import hdbscan
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from sklearn.neighbors import BallTree
+
+EARTH_RADIUS = 6371000.0
+CACHE_DIR = '.graph_cache'
+K = 15
+
+
+def cache_dir_for(path):
+    """The graph cache of the points read from path, in its directory."""
+    return os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+
+
+def read_points(path):
+    """Returns the lat, lon degrees of a csv with lon and lat columns or of
+    the placemarks of a KML file.
+    """
+    if path.endswith('.csv'):
+        df = pd.read_csv(path)
+        return df[['lat', 'lon']].to_numpy(dtype=float)
+    points = []
+    for _, element in ET.iterparse(path):
+        if element.tag.endswith('coordinates') and element.text:
+            for coordinate in element.text.split():
+                lon, lat = coordinate.split(',')[:2]
+                points.append((float(lat), float(lon)))
+        element.clear()
+    return np.array(points, dtype=float).reshape(-1, 2)
+
+
+def knn_graph(points, k=K, cache_dir=CACHE_DIR):
+    """Sparse, symmetric graph with the haversine distance (in radians) from
+    every point to its k nearest neighbours.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        h = hashlib.sha1(np.ascontiguousarray(points).tobytes())
+        h.update(str(k).encode())
+        cache_path = os.path.join(cache_dir, '{}.npz'.format(h.hexdigest()))
+        if os.path.exists(cache_path):
+            return sparse.load_npz(cache_path)
+
+    n = len(points)
+    k = min(k, n - 1)
+    rads = np.radians(points)
+    distances, indices = BallTree(rads, metric='haversine').query(rads, k + 1)
+    # the first neighbour is the point itself
+    rows = np.repeat(np.arange(n), k)
+    graph = sparse.csr_matrix((distances[:, 1:].ravel(),
+                               (rows, indices[:, 1:].ravel())), shape=(n, n))
+    # duplicate places are at distance 0, which a sparse matrix can't hold
+    graph.data = np.maximum(graph.data, 1e-12)
+    graph = graph.maximum(graph.T).tocsr()
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        sparse.save_npz(cache_path + '.tmp.npz', graph)
+        os.replace(cache_path + '.tmp.npz', cache_path)
+    return graph
+
+
+def cluster_graph(graph, min_cluster_size=2, min_samples=None):
+    """Runs HDBSCAN on every connected component of the graph and returns
+    the labels and membership probabilities.
+    """
+    n = graph.shape[0]
+    labels = np.full(n, -1)
+    probabilities = np.zeros(n)
+    _, components = connected_components(graph, directed=False)
+    next_label = 0
+    for component in np.unique(components):
+        members = np.flatnonzero(components == component)
+        if len(members) < max(min_cluster_size, 2):
+            continue
+        model = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size,
+                                min_samples=min_samples, metric='precomputed')
+        component_labels = model.fit_predict(graph[members][:, members])
+        clustered = component_labels >= 0
+        labels[members[clustered]] = component_labels[clustered] + next_label
+        probabilities[members] = model.probabilities_
+        if clustered.any():
+            next_label = labels.max() + 1
+    return labels, probabilities
+
+
+def cluster(points, k=K, min_cluster_size=2, min_samples=None,
+            cache_dir=CACHE_DIR):
+    graph = knn_graph(points, k, cache_dir)
+    return cluster_graph(graph, min_cluster_size, min_samples)
+
+
+def _cluster_tile(points, k, min_cluster_size, min_samples, cache_dir):
+    if len(points) < 2:
+        return np.full(len(points), -1), np.zeros(len(points))
+    return cluster(points, k, min_cluster_size, min_samples, cache_dir)
+
+
+def _find(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def cluster_tiled(points, tile_size, margin=None, k=K, min_cluster_size=2,
+                  min_samples=None, cache_dir=CACHE_DIR, workers=None):
+    """Clusters tile_size x tile_size degree tiles in parallel, each with a
+    margin (a fifth of the tile by default) around it, and merges the
+    clusters that share enough points.
+    """
+    margin = tile_size / 5 if margin is None else margin
+    cells = np.floor(points / tile_size).astype(int)
+    tiles = sorted(set(map(tuple, cells)))
+    jobs = []
+    for tile in tiles:
+        low = np.array(tile) * tile_size - margin
+        high = low + tile_size + 2 * margin
+        members = np.flatnonzero(np.all((points >= low) & (points < high),
+                                        axis=1))
+        jobs.append(members)
+
+    probabilities = np.zeros(len(points))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            partial(_cluster_tile, k=k, min_cluster_size=min_cluster_size,
+                    min_samples=min_samples, cache_dir=cache_dir),
+            [points[members] for members in jobs]))
+
+    # every (tile, label) pair is a node; a point keeps the label of its own
+    # tile, and two nodes are merged when at least min_cluster_size points
+    # that one of them owns are in the other one too
+    offsets = np.cumsum([0] + [max(r[0].max() + 1, 0) for r in results])
+    own_node = np.full(len(points), -1)
+    points_in, nodes_in = [], []
+    for t, (members, (tile_labels, tile_probabilities)) in enumerate(
+            zip(jobs, results)):
+        clustered = tile_labels >= 0
+        own = np.all(cells[members] == tiles[t], axis=1)
+        own_node[members[own & clustered]] = \
+            tile_labels[own & clustered] + offsets[t]
+        probabilities[members[own]] = tile_probabilities[own]
+        points_in.append(members[~own & clustered])
+        nodes_in.append(tile_labels[~own & clustered] + offsets[t])
+    points_in = np.concatenate(points_in)
+    nodes_in = np.concatenate(nodes_in)
+    shared = own_node[points_in] >= 0
+    pairs, counts = np.unique(
+        np.c_[own_node[points_in[shared]], nodes_in[shared]], axis=0,
+        return_counts=True)
+
+    parent = np.arange(offsets[-1])
+    for a, b in pairs[counts >= min_cluster_size]:
+        parent[_find(parent, a)] = _find(parent, b)
+    roots = np.array([_find(parent, node) for node in range(len(parent))],
+                     dtype=int)
+    labels = np.full(len(points), -1)
+    clustered = own_node >= 0
+    _, labels[clustered] = np.unique(roots[own_node[clustered]],
+                                     return_inverse=True)
+    # a cluster whose points are mostly owned by other tiles can keep too
+    # few points of its own
+    sizes = np.bincount(labels[clustered])
+    small = clustered & (sizes[np.maximum(labels, 0)] < min_cluster_size)
+    labels[small] = -1
+    probabilities[small] = 0
+    clustered = labels >= 0
+    _, labels[clustered] = np.unique(labels[clustered], return_inverse=True)
+    return labels, probabilities
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Distance in metres between degrees."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def summarize(points, labels):
+    df = pd.DataFrame({'lat': points[:, 0], 'lon': points[:, 1],
+                       'label': labels})
+    df = df[df['label'] >= 0]
+    summary = df.groupby('label').agg(size=('lat', 'size'),
+                                      lat=('lat', 'mean'), lon=('lon', 'mean'))
+    centre = summary.loc[df['label']]
+    df['distance'] = haversine(df['lat'].to_numpy(), df['lon'].to_numpy(),
+                               centre['lat'].to_numpy(),
+                               centre['lon'].to_numpy())
+    summary['radius_m'] = df.groupby('label')['distance'].max()
+    return summary.reset_index()
+
+
+def save(points, labels, probabilities, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    pd.DataFrame({'lat': points[:, 0], 'lon': points[:, 1], 'label': labels,
+                  'probability': probabilities}).to_csv(
+        os.path.join(out_dir, 'cluster_labels.csv'), index=False)
+    summarize(points, labels).to_csv(
+        os.path.join(out_dir, 'cluster_summary.csv'), index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', help='csv with lon, lat or a KML file')
+    parser.add_argument('out_dir')
+    parser.add_argument('--k', type=int, default=K)
+    parser.add_argument('--min_cluster_size', type=int, default=2)
+    parser.add_argument('--min_samples', type=int, default=None)
+    parser.add_argument('--tile_size', type=float, default=None,
+                        help='Cluster tiles of this many degrees in parallel')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    points = read_points(args.source)
+    cache_dir = cache_dir_for(args.source)
+    started = time.perf_counter()
+    if args.tile_size:
+        labels, probabilities = cluster_tiled(
+            points, args.tile_size, k=args.k,
+            min_cluster_size=args.min_cluster_size,
+            min_samples=args.min_samples, cache_dir=cache_dir,
+            workers=args.workers)
+    else:
+        labels, probabilities = cluster(points, args.k, args.min_cluster_size,
+                                        args.min_samples, cache_dir)
+    elapsed = time.perf_counter() - started
+    save(points, labels, probabilities, args.out_dir)
+    print('{} points, {} clusters, {} noise in {:.2f}s ({:.0f} points/s)'
+          .format(len(points), labels.max() + 1, (labels < 0).sum(), elapsed,
+                  len(points) / elapsed))
@@ -1,8 +1,14 @@
-import hdbscan
-import pandas as pd
-import numpy as np
+import os
+import sys
 
-df = pd.read_csv('data/coordinates.csv')
-rads = np.radians(df)
-model = hdbscan.HDBSCAN(min_cluster_size=2, metric='haversine')
-predictions = model.fit_predict(rads)
+# the clustering engine is shared by the cities
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import geo_clustering  # noqa: E402
+
+# haversine wants (lat, lon), and the csv has lon first
+points = geo_clustering.read_points('data/coordinates.csv')
+predictions, probabilities = geo_clustering.cluster(
+    points, min_cluster_size=2,
+    cache_dir=geo_clustering.cache_dir_for('data/coordinates.csv'))
+# data/cluster_labels.csv and data/cluster_summary.csv
+geo_clustering.save(points, predictions, probabilities, 'data')
@@ -0,0 +1,179 @@
+"""
+Date-sharded export of a BigQuery table into local Parquet partitions.
+
+The requested range is split into day or month shards, the shards are
+queried concurrently with parameterized queries, and every shard is written
+straight to its own Parquet file:
+
+    <out_dir>/shard=YYYY-MM-DD/data.parquet
+
+A manifest keeps track of the shards that are complete (their range is
+already in the past), and those are never downloaded again. The query
+backend is pluggable, so a local SQLite file can stand in for BigQuery.
+"""
+import datetime
+import json
+import os
+import re
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
+
+MAX_WORKERS = 4
+MANIFEST_FILE = '_manifest.json'
+# project.dataset.table or a plain column name
+IDENTIFIER = re.compile(r'^[A-Za-z0-9_\-.:]+$')
+
+
+def check_identifier(name):
+    """Table and column names can't be query parameters, so they are
+    validated before being put in the query.
+    """
+    if not IDENTIFIER.match(name):
+        raise ValueError('Invalid identifier: {}'.format(name))
+    return name
+
+
+class BigQueryBackend:
+    def __init__(self, project_id):
+        import pandas_gbq
+        self.read_gbq = pandas_gbq.read_gbq
+        self.project_id = project_id
+
+    def query(self, table, column, start, end):
+        sql = 'SELECT * FROM `{}` WHERE {} >= @start AND {} < @end'.format(
+            check_identifier(table), check_identifier(column),
+            check_identifier(column))
+        parameters = [{'name': name,
+                       'parameterType': {'type': 'STRING'},
+                       'parameterValue': {'value': value}}
+                      for name, value in (('start', start), ('end', end))]
+        configuration = {'query': {'parameterMode': 'NAMED',
+                                   'queryParameters': parameters}}
+        with telemetry.METRICS.call('bigquery', 'read_gbq') as call:
+            df = self.read_gbq(sql, project_id=self.project_id,
+                               dialect='standard',
+                               configuration=configuration)
+            call.items = len(df)
+        return df
+
+
+class SQLiteBackend:
+    def __init__(self, path):
+        self.path = path
+
+    def query(self, table, column, start, end):
+        sql = 'SELECT * FROM {} WHERE {} >= :start AND {} < :end'.format(
+            check_identifier(table), check_identifier(column),
+            check_identifier(column))
+        # one connection per call since the shards run in several threads
+        with sqlite3.connect(self.path) as conn:
+            return pd.read_sql_query(sql, conn,
+                                     params={'start': start, 'end': end})
+
+
+def shards(start_date, end_date, granularity='month'):
+    """Splits [start_date, end_date) into (start, end) pairs of
+    YYYY-MM-DD strings.
+    """
+    start = datetime.datetime.strptime(start_date[:10], '%Y-%m-%d').date()
+    end = datetime.datetime.strptime(end_date[:10], '%Y-%m-%d').date()
+    result = []
+    while start < end:
+        if granularity == 'day':
+            next_start = start + datetime.timedelta(days=1)
+        else:
+            next_start = (start.replace(day=1) +
+                          datetime.timedelta(days=32)).replace(day=1)
+        next_start = min(next_start, end)
+        result.append((start.isoformat(), next_start.isoformat()))
+        start = next_start
+    return result
+
+
+def _load_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def shard_path(out_dir, start):
+    return os.path.join(out_dir, 'shard={}'.format(start), 'data.parquet')
+
+
+def _export_shard(backend, table, column, start, end, out_dir):
+    df = backend.query(table, column, start, end)
+    path = shard_path(out_dir, start)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    return len(df)
+
+
+def export(backend, table, column, start_date, end_date, out_dir,
+           granularity='month', max_workers=MAX_WORKERS, force=False):
+    """Exports the shards of [start_date, end_date) that aren't cached yet
+    and returns the paths of every shard of the range, in order.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = _load_manifest(out_dir)
+    today = datetime.date.today().isoformat()
+    ranges = shards(start_date, end_date, granularity)
+
+    pending = []
+    for start, end in ranges:
+        entry = manifest.get(start)
+        cached = entry is not None and entry['end'] == end and \
+            entry['complete'] and os.path.exists(shard_path(out_dir, start))
+        if force or not cached:
+            pending.append((start, end))
+    print('{} shards cached, {} to download'.format(
+        len(ranges) - len(pending), len(pending)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_export_shard, backend, table, column,
+                                   start, end, out_dir): (start, end)
+                   for start, end in pending}
+        errors = []
+        for future in as_completed(futures):
+            start, end = futures[future]
+            try:
+                rows = future.result()
+            except Exception as e:
+                print('Shard {} failed: {!r}'.format(start, e))
+                errors.append(e)
+                continue
+            # shards that reach today can still change, so they are
+            # downloaded again on the next run
+            manifest[start] = {'end': end, 'rows': rows,
+                               'complete': end <= today}
+            _save_manifest(out_dir, manifest)
+            print('Shard {} done: {} rows'.format(start, rows))
+    if errors:
+        raise errors[0]
+    return [shard_path(out_dir, start) for start, _ in ranges]
+
+
+def write_csv(paths, filename):
+    """Concatenates the shards into a csv, one shard at a time."""
+    should_write_header = True
+    with open(filename, 'w', encoding='utf-8') as f:
+        for path in paths:
+            df = pd.read_parquet(path)
+            df.to_csv(f, header=should_write_header, index=False)
+            should_write_header = False
@@ -0,0 +1,193 @@
+"""
+Asyncio version of get_data.py that collects the weather of many locations
+from a single process.
+
+Every location runs on its own drift-free schedule (the n-th call happens at
+start + n * interval, no matter how long the previous one took), and the
+weather and UV calls of each tick are done concurrently over one pooled
+aiohttp session. A slow or failing location only affects itself.
+
+The locations file is a csv with lat and lon columns.
+
+Usage:
+    python collector.py --key KEY --locations locations.csv \
+        --gcp-project P --bq-dataset D --bq-table-name T
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+
+import aiohttp
+from google.cloud import bigquery
+
+from get_data import prepare_bq_dataset, table_schema, time_delay
+from schema import extract_row, merge_payload
+from sinks import (BATCH_SIZE, FLUSH_INTERVAL, SPOOL_FILE, BatchWriter,
+                   BigQuerySink, CsvSink, Spool, SQLiteSink)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
+
+BASE_URL = 'https://api.openweathermap.org'
+WEATHER_PATH = '/data/2.5/weather'
+UV_PATH = '/data/2.5/uvi'
+REQUEST_TIMEOUT = 30
+MAX_CONNECTIONS = 100
+
+
+def load_locations(path):
+    with open(path) as f:
+        return [(float(row['lat']), float(row['lon']))
+                for row in csv.DictReader(f)]
+
+
+class WeatherCollector:
+    """Collects the weather of every location every interval seconds and
+    hands each row to on_row. on_row may be a regular function (it runs in
+    a worker thread so it can block) or a coroutine function. If archive
+    is an open file, every raw payload is also appended to it as a JSON line,
+    so the table can be rebuilt later with normalize.py.
+    """
+
+    def __init__(self, key, locations, on_row, interval=time_delay,
+                 base_url=BASE_URL, timeout=REQUEST_TIMEOUT,
+                 max_connections=MAX_CONNECTIONS, archive=None):
+        self.key = key
+        self.archive = archive
+        self.locations = locations
+        self.on_row = on_row
+        self.interval = interval
+        self.base_url = base_url.rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_connections = max_connections
+
+    async def fetch_json(self, session, path, lat, lon):
+        """Returns the decoded response, or None if the call failed."""
+        params = {'lat': lat, 'lon': lon, 'appid': self.key}
+        try:
+            with telemetry.METRICS.call('openweather', path) as call:
+                async with session.get(self.base_url + path,
+                                       params=params) as r:
+                    call.status = r.status
+                    # read once; json() decodes the same body
+                    call.bytes_in = len(await r.read())
+                    if r.status != 200:
+                        print('{} request for {},{} not ok: {}'.format(
+                            path, lat, lon, r.status))
+                        return None
+                    return await r.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print('{} request for {},{} failed: {!r}'.format(path, lat, lon, e))
+            return None
+
+    async def collect(self, session, lat, lon):
+        """Does the weather and UV calls of one location and returns the row,
+        or None if the weather call failed.
+        """
+        weather_data, uv_data = await asyncio.gather(
+            self.fetch_json(session, WEATHER_PATH, lat, lon),
+            self.fetch_json(session, UV_PATH, lat, lon))
+        # if the weather_data request is not ok, try again on the next tick;
+        # the uv data is optional
+        if weather_data is None:
+            return None
+        payload = merge_payload(weather_data, uv_data)
+        if self.archive is not None:
+            self.archive.write(json.dumps(payload) + '\n')
+            self.archive.flush()
+        try:
+            return extract_row(payload)
+        except Exception as e:
+            print('Exception for {},{}: {}'.format(lat, lon, e))
+            return None
+
+    async def emit(self, row):
+        if asyncio.iscoroutinefunction(self.on_row):
+            await self.on_row(row)
+        else:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.on_row, row)
+
+    async def run_location(self, session, lat, lon, start_time, ticks=None):
+        tick = 0
+        while ticks is None or tick < ticks:
+            # sleep until this location's next slot; if a call ran over the
+            # interval, the missed slots are skipped instead of piling up
+            delay = start_time + tick * self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                row = await self.collect(session, lat, lon)
+                if row is not None:
+                    await self.emit(row)
+            except Exception as e:
+                print('Error collecting {},{}: {!r}'.format(lat, lon, e))
+            elapsed = time.monotonic() - start_time
+            tick = max(tick + 1, int(elapsed // self.interval) + 1)
+
+    async def run(self, ticks=None):
+        """Runs forever, or ticks times per location if ticks is given."""
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=self.timeout) as session:
+            now = time.monotonic()
+            # spread the locations over the interval so hundreds of them
+            # don't all fire at the same second
+            step = self.interval / max(len(self.locations), 1)
+            await asyncio.gather(*(
+                self.run_location(session, lat, lon, now + i * step, ticks)
+                for i, (lat, lon) in enumerate(self.locations)))
+
+
+def make_sink(args):
+    if args.sink == 'sqlite':
+        return SQLiteSink(args.sink_path, table_schema)
+    if args.sink == 'csv':
+        return CsvSink(args.sink_path, table_schema)
+    client = bigquery.Client(project=args.gcp_project)
+    table = prepare_bq_dataset(client, args.bq_dataset, args.bq_table_name)
+    return BigQuerySink(client, table)
+
+
+if __name__ == '__main__':
+    print('Starting...')
+    parser = argparse.ArgumentParser(description='description')
+    parser.add_argument('--key', help='API key')
+    parser.add_argument('--locations', help='csv file with lat,lon columns')
+    parser.add_argument('--interval', type=float, default=time_delay,
+                        help='seconds between calls of the same location')
+    parser.add_argument('--base-url', default=BASE_URL,
+                        help='OpenWeather base url, e.g. a local test server')
+    parser.add_argument('--gcp-project', help='Google Cloud Project')
+    parser.add_argument('--bq-dataset', help='BigQuery Dataset')
+    parser.add_argument('--bq-table-name', help='BigQuery Dataset Table Name')
+    parser.add_argument('--sink', choices=['bigquery', 'sqlite', 'csv'],
+                        default='bigquery', help='Where the rows are written')
+    parser.add_argument('--sink-path', help='File of the sqlite or csv sink')
+    parser.add_argument('--spool', default=SPOOL_FILE,
+                        help='Local file where rows wait to be written')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--flush-interval', type=float, default=FLUSH_INTERVAL)
+    parser.add_argument('--archive', help='ndjson file to keep the raw payloads')
+    args = parser.parse_args()
+    telemetry.start('weather-collector', interval=60)
+
+    archive = open(args.archive, 'a') if args.archive else None
+
+    writer = BatchWriter(make_sink(args), Spool(args.spool),
+                         batch_size=args.batch_size,
+                         flush_interval=args.flush_interval).start()
+    collector = WeatherCollector(
+        args.key, load_locations(args.locations), writer.add,
+        interval=args.interval, base_url=args.base_url, archive=archive)
+    try:
+        asyncio.run(collector.run())
+    finally:
+        writer.close()
+        if archive is not None:
+            archive.close()
@@ -1,24 +1,38 @@
+import argparse
 import logging
+import os
 import sys
-import pandas_gbq
-import pandas as pd
-import sys
+
+from bq_export import BigQueryBackend, SQLiteBackend, export, write_csv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'telemetry'))
+import telemetry  # noqa: E402
 
 logger = logging.getLogger('pandas_gbq')
 logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 
-# read data from BigQuery
-query = """
-SELECT
-  *
-FROM
-  `{}`
-WHERE
-  date_iso >= '{}' AND
-  date_iso < '{}'
-""".format(sys.argv[1], sys.argv[3], sys.argv[4])
-df = pandas_gbq.read_gbq(query, project_id=sys.argv[2],
-                         dialect='standard')
+parser = argparse.ArgumentParser()
+parser.add_argument('table', help='BigQuery table, e.g. project.dataset.table')
+parser.add_argument('project_id', help='Google Cloud Project')
+parser.add_argument('start_date', help='Starting date (inclusive)')
+parser.add_argument('end_date', help='End date (not inclusive)')
+parser.add_argument('--granularity', choices=['day', 'month'], default='month')
+parser.add_argument('--workers', type=int, default=4)
+parser.add_argument('--out-dir', default='data/weather_shards',
+                    help='Directory of the Parquet shards')
+parser.add_argument('--sqlite', help='Query this SQLite file instead of BigQuery')
+parser.add_argument('--force', action='store_true',
+                    help='Download the cached shards again')
+args = parser.parse_args()
+
+telemetry.start('weather-get_bq_data')
+# read data from BigQuery, one shard at a time
+backend = SQLiteBackend(args.sqlite) if args.sqlite \
+    else BigQueryBackend(args.project_id)
+paths = export(backend, args.table, 'date_iso', args.start_date,
+               args.end_date, args.out_dir, granularity=args.granularity,
+               max_workers=args.workers, force=args.force)
 
-df.to_csv('df.csv', index=False, encoding='utf-8')
+write_csv(paths, 'df.csv')
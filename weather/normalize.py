@@ -0,0 +1,111 @@
+"""
+Vectorized normalizer for batches of raw OpenWeather payloads.
+
+A batch of payloads is converted once into an Arrow struct array and every
+column of schema.FIELDS is pulled out of it with Arrow compute kernels, so
+the per-row work happens in C++ instead of in a Python loop. Rows that miss
+a mandatory field are dropped, like the collectors do.
+
+It can also rebuild df.csv from an archive of raw payloads (one JSON
+payload per line, as written by collector.py --archive):
+
+Usage:
+    python normalize.py raw.ndjson df.csv
+"""
+import argparse
+import itertools
+import json
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from schema import FIELDS
+
+ARROW_TYPES = {
+    'FLOAT': pa.float64(),
+    'INTEGER': pa.int64(),
+    'STRING': pa.string(),
+}
+CHUNK_SIZE = 50000
+
+arrow_schema = pa.schema([(name, ARROW_TYPES[type_])
+                          for name, type_, _, _ in FIELDS])
+
+
+def _column(array, path):
+    """Follows path inside a struct array. Returns None if the path doesn't
+    exist in any payload of the batch.
+    """
+    for part in path.split('.'):
+        if part.isdigit():
+            if not pa.types.is_list(array.type):
+                return None
+            # lists that are too short become nulls instead of raising
+            lengths = pc.list_value_length(array)
+            has_item = pc.fill_null(pc.greater(lengths, int(part)), False)
+            array = pc.if_else(has_item, array, pa.scalar(None, array.type))
+            array = pc.list_element(array, int(part))
+        else:
+            if not pa.types.is_struct(array.type):
+                return None
+            index = array.type.get_field_index(part)
+            if index < 0:
+                return None
+            # the children of flatten() carry the nulls of the struct too;
+            # the pinned pyarrow has no struct_field kernel
+            array = array.flatten()[index]
+    return array
+
+
+def normalize_array(array):
+    """Turns a struct array of payloads into a table that follows FIELDS."""
+    columns = []
+    valid = pa.array([True] * len(array))
+    for name, type_, path, default in FIELDS:
+        target = ARROW_TYPES[type_]
+        column = _column(array, path)
+        if column is None or pa.types.is_null(column.type):
+            column = pa.nulls(len(array), target)
+        else:
+            # safe=False truncates the odd float that lands in an INTEGER
+            # column, the way BigQuery's streaming inserts would
+            column = pc.cast(column, target, safe=False)
+        if default is None:
+            valid = pc.and_(valid, pc.is_valid(column))
+        else:
+            column = pc.fill_null(column, pa.scalar(default).cast(target))
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=arrow_schema).filter(valid)
+
+
+def normalize(payloads):
+    """Normalizes a list of payload dicts."""
+    if not payloads:
+        return arrow_schema.empty_table()
+    return normalize_array(pa.array(payloads))
+
+
+def read_ndjson(path, chunk_size=CHUNK_SIZE):
+    """Normalizes an archive of raw payloads chunk by chunk."""
+    tables = []
+    with open(path) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                break
+            payloads = [json.loads(line) for line in lines if line.strip()]
+            tables.append(normalize(payloads))
+    if not tables:
+        return arrow_schema.empty_table()
+    return pa.concat_tables(tables)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', help='ndjson file with raw payloads')
+    parser.add_argument('target', help='csv file to write')
+    args = parser.parse_args()
+
+    table = read_ndjson(args.source)
+    table.to_pandas().to_csv(args.target, index=False, encoding='utf-8')
+    print('{} rows written to {}'.format(table.num_rows, args.target))
@@ -0,0 +1,79 @@
+"""
+Single description of the weather table. Every column says where its value
+lives in the OpenWeather payload and what to use when it's missing, and
+both the BigQuery table_schema and the normalizers are derived from it.
+
+The payload is the weather response with the UV response under 'uv'.
+"""
+
+# name, BigQuery type, path in the payload, default (None means mandatory)
+FIELDS = (
+    ('lat', 'FLOAT', 'coord.lat', None),
+    ('lon', 'FLOAT', 'coord.lon', None),
+    ('weather_main', 'STRING', 'weather.0.main', None),
+    ('weather_description', 'STRING', 'weather.0.description', None),
+    ('temp', 'FLOAT', 'main.temp', None),
+    ('pressure', 'FLOAT', 'main.pressure', None),
+    ('humidity', 'FLOAT', 'main.humidity', None),
+    ('temp_min', 'FLOAT', 'main.temp_min', None),
+    ('temp_max', 'FLOAT', 'main.temp_max', None),
+    ('pressure_sea_level', 'FLOAT', 'main.sea_level', -1),
+    ('pressure_grnd_level', 'FLOAT', 'main.grnd_level', -1),
+    ('wind_speed', 'FLOAT', 'wind.speed', None),
+    ('wind_deg', 'FLOAT', 'wind.deg', -1),
+    ('cloudiness', 'FLOAT', 'clouds.all', None),
+    # rain and snow are only there when it rains or snows
+    ('rain_1h', 'INTEGER', 'rain.1h', -1),
+    ('rain_3h', 'INTEGER', 'rain.3h', -1),
+    ('snow_1h', 'INTEGER', 'snow.1h', -1),
+    ('snow_3h', 'INTEGER', 'snow.3h', -1),
+    ('country', 'STRING', 'sys.country', None),
+    ('sunrise', 'STRING', 'sys.sunrise', None),
+    ('sunset', 'STRING', 'sys.sunset', None),
+    ('city_id', 'STRING', 'id', None),
+    ('city_name', 'STRING', 'name', None),
+    # the uv request is allowed to fail
+    ('uv', 'FLOAT', 'uv.value', -1),
+    ('date_iso', 'STRING', 'uv.date_iso', ''),
+    ('dt', 'INTEGER', 'dt', None),
+)
+
+_MISSING = object()
+
+
+def merge_payload(weather_data, uv_data=None):
+    """Puts the UV response inside the weather response."""
+    payload = dict(weather_data)
+    if uv_data is not None:
+        payload['uv'] = uv_data
+    return payload
+
+
+def _lookup(payload, path):
+    value = payload
+    for part in path.split('.'):
+        if isinstance(value, list):
+            index = int(part)
+            value = value[index] if index < len(value) else _MISSING
+        elif isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        else:
+            value = _MISSING
+        if value is _MISSING or value is None:
+            return _MISSING
+    return value
+
+
+def extract_row(payload):
+    """Returns the row of a single payload as a tuple in FIELDS order.
+    Raises a KeyError if a mandatory field is missing.
+    """
+    row = []
+    for name, _, path, default in FIELDS:
+        value = _lookup(payload, path)
+        if value is _MISSING:
+            if default is None:
+                raise KeyError('{} ({})'.format(name, path))
+            value = default
+        row.append(value)
+    return tuple(row)
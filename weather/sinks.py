@@ -0,0 +1,253 @@
+"""
+Buffered, loss-free writers for the weather rows.
+
+Every row is first appended to a local SQLite spool, and a BatchWriter
+flushes the spool to a sink in batches bounded by size and time. A row only
+leaves the spool once the sink accepted it, so rows that fail or arrive
+during an outage are retried, and rows left over from a previous run are
+replayed on startup. A row the sink rejects as invalid, or keeps rejecting,
+is moved to the dead table of the spool, so it doesn't hold back the rows
+behind it.
+
+The sinks are interchangeable: BigQuerySink is the real one, SQLiteSink
+and CsvSink write locally and stand in for BigQuery in tests.
+"""
+import csv
+import json
+import os
+import sqlite3
+import threading
+
+SPOOL_FILE = 'spool.sqlite'
+BATCH_SIZE = 500
+# seconds
+FLUSH_INTERVAL = 60.0
+# times a rejected row is tried before it goes to the dead table
+MAX_ATTEMPTS = 5
+# BigQuery reasons that won't change on a retry
+PERMANENT_ERRORS = {'invalid'}
+
+
+class Spool:
+    """Durable append-only queue of rows backed by SQLite."""
+
+    def __init__(self, path=SPOOL_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # every append is committed, so a crash loses nothing
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS rows (id INTEGER PRIMARY KEY, row TEXT, '
+            'attempts INTEGER NOT NULL DEFAULT 0)')
+        columns = [c[1] for c in self.conn.execute('PRAGMA table_info(rows)')]
+        if 'attempts' not in columns:
+            # a spool from before the attempts were counted
+            self.conn.execute('ALTER TABLE rows ADD COLUMN '
+                              'attempts INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS dead (id INTEGER PRIMARY KEY, row TEXT, '
+            'attempts INTEGER, error TEXT)')
+        self.conn.commit()
+
+    def append(self, row):
+        with self.lock:
+            self.conn.execute('INSERT INTO rows (row) VALUES (?)',
+                              (json.dumps(list(row)),))
+            self.conn.commit()
+
+    def peek(self, limit):
+        """Returns up to limit (id, row, attempts), oldest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT id, row, attempts FROM rows ORDER BY id LIMIT ?',
+                (limit,)).fetchall()
+        return [(row_id, tuple(json.loads(row)), attempts)
+                for row_id, row, attempts in rows]
+
+    def remove(self, ids):
+        with self.lock:
+            self.conn.executemany('DELETE FROM rows WHERE id = ?',
+                                  [(row_id,) for row_id in ids])
+            self.conn.commit()
+
+    def retry(self, ids):
+        """Counts a failed attempt for the rows of ids."""
+        with self.lock:
+            self.conn.executemany(
+                'UPDATE rows SET attempts = attempts + 1 WHERE id = ?',
+                [(row_id,) for row_id in ids])
+            self.conn.commit()
+
+    def bury(self, errors):
+        """Moves the rows of errors, a dict of id -> error, to the dead
+        table, where they are kept for a look by hand.
+        """
+        with self.lock:
+            for row_id, error in errors.items():
+                self.conn.execute(
+                    'INSERT INTO dead (id, row, attempts, error) '
+                    'SELECT id, row, attempts + 1, ? FROM rows WHERE id = ?',
+                    (json.dumps(error), row_id))
+                self.conn.execute('DELETE FROM rows WHERE id = ?', (row_id,))
+            self.conn.commit()
+
+    def dead(self):
+        """Returns the (id, row, attempts, error) of the dead rows."""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT id, row, attempts, error FROM dead ORDER BY id'
+            ).fetchall()
+        return [(row_id, tuple(json.loads(row)), attempts, json.loads(error))
+                for row_id, row, attempts, error in rows]
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM rows').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class BigQuerySink:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+
+    def write(self, rows):
+        """Inserts rows and returns the BigQuery errors (empty if none)."""
+        return self.client.insert_rows(self.table, rows)
+
+
+class SQLiteSink:
+    def __init__(self, path, schema):
+        self.schema = schema
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        columns = ', '.join(field.name for field in schema)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS weather ({})'.format(columns))
+        self.conn.commit()
+
+    def write(self, rows):
+        placeholders = ', '.join('?' * len(self.schema))
+        self.conn.executemany(
+            'INSERT INTO weather VALUES ({})'.format(placeholders), rows)
+        self.conn.commit()
+        return []
+
+
+class CsvSink:
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+
+    def write(self, rows):
+        should_write_header = not os.path.exists(self.path)
+        with open(self.path, 'a+', newline='') as f:
+            writer = csv.writer(f)
+            if should_write_header:
+                writer.writerow(field.name for field in self.schema)
+            writer.writerows(rows)
+        return []
+
+
+class BatchWriter:
+    """Spools every row and flushes the spool to sink when batch_size rows
+    are waiting or flush_interval seconds have passed since the last flush.
+    """
+
+    def __init__(self, sink, spool, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_attempts=MAX_ATTEMPTS):
+        self.sink = sink
+        self.spool = spool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        pending = len(self.spool)
+        if pending:
+            print('Replaying {} spooled rows'.format(pending))
+            self.flush()
+        self.thread.start()
+        return self
+
+    def add(self, row):
+        self.spool.append(row)
+        if len(self.spool) >= self.batch_size:
+            self.wake.set()
+
+    def _reject(self, batch, errors):
+        """Sorts out the rows of batch the sink rejected; returns the number
+        of rows it accepted.
+        """
+        # BigQuery reports the failed rows by their index
+        by_index = {error.get('index'): error for error in errors}
+        accepted, retry, dead = [], [], {}
+        for i, (row_id, _, attempts) in enumerate(batch):
+            error = by_index.get(i)
+            if error is None:
+                accepted.append(row_id)
+                continue
+            reasons = {e.get('reason') for e in error.get('errors', [])}
+            if reasons == {'stopped'}:
+                # the row was fine, another one stopped the insert
+                continue
+            if reasons & PERMANENT_ERRORS or \
+                    attempts + 1 >= self.max_attempts:
+                dead[row_id] = error
+            else:
+                retry.append(row_id)
+        print('Error inserting: {}'.format(errors))
+        self.spool.remove(accepted)
+        self.spool.retry(retry)
+        if dead:
+            print('{} rows moved to the dead table'.format(len(dead)))
+            self.spool.bury(dead)
+        return len(accepted)
+
+    def flush(self):
+        """Writes the spooled rows in batches. Returns the number of rows
+        written; the ones the sink rejected stay in the spool, until they
+        are rejected as invalid or max_attempts times.
+        """
+        written = 0
+        with self.flush_lock:
+            while True:
+                batch = self.spool.peek(self.batch_size)
+                if not batch:
+                    break
+                ids = [row_id for row_id, _, _ in batch]
+                try:
+                    errors = self.sink.write([row for _, row, _ in batch])
+                except Exception as e:
+                    # the sink is down, not the rows' fault
+                    print('Error writing batch: {!r}'.format(e))
+                    break
+                if errors:
+                    written += self._reject(batch, errors)
+                    break
+                self.spool.remove(ids)
+                written += len(ids)
+                if len(batch) < self.batch_size:
+                    break
+        if written:
+            print('{} rows written'.format(written))
+        return written
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.wake.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.flush()